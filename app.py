@@ -1,33 +1,150 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, redirect, request, jsonify, send_from_directory, stream_with_context
 from flask_pymongo import PyMongo
 from flask_bcrypt import Bcrypt
 from config import Config
 from kindo_api import KindoAPI
+from llm_cache import LLMCache
 from hugging_face_client import HuggingFaceClient 
 from firebase_handler import FirebaseHandler
-from rag import generate_article
+from local_storage import LocalStorageHandler
+from rag import configure_clients as configure_rag_clients, generate_article
 from tts import TTS
-import time
+from media import ImageTranscoder
+from slide_pipeline import SlidePipeline
+from token_budget import fit_context
+from course_repository import CourseRepository
+from asset_store import Asset, AssetStore
+from audio_stream import tee_to_background
+from slide_events import MongoSlideEventBus, SlideEventBus
+from job_queue import JobQueue, QueueFullError, WorkerPool
+from pymongo.errors import DuplicateKeyError
+from quiz_bank import QuizBank
+from logging_setup import configure_logging
+from tracing import CourseTracer
+import metrics
+import rate_limiter
+import tracing
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
 import re
 import threading
+import time
 import uuid
 
+logger = logging.getLogger(__name__)
+configure_logging(Config.LOG_LEVEL, Config.LOG_FORMAT)
+
 app = Flask(__name__)
 app.config["MONGO_URI"] = Config.MONGO_URI
 
 firebase_cred_path = "morpheus-key.json"
 firebase_bucket_name = "morpheus-grin.appspot.com"
 
+# Placeholder image used when a slide image could not be generated
+DEFAULT_SLIDE_IMAGE_URL = "https://firebasestorage.googleapis.com/v0/b/morpheus-grin.appspot.com/o/istockphoto-1409329028-612x612.jpg?alt=media&token=49ee18cf-7c68-4b0a-b5a1-6b6dcaa99e41"
+
 # Initialize KindoAPI
 mongo = PyMongo(app)
 bcrypt = Bcrypt(app)
 
-# Initialize KindoAPI with the API key from the config file
-kindo_api = KindoAPI(api_key=Config.KINDO_API_KEY)
-hf_client = HuggingFaceClient(Config.HUGGING_FACE_API_KEY)
-firebase_handler = FirebaseHandler(firebase_cred_path, firebase_bucket_name)
-tts = TTS(Config.TTS_KEY)
+# Optional response cache for repeated LLM requests
+llm_cache = None
+if Config.LLM_CACHE_ENABLED:
+    llm_cache = LLMCache(
+        mongo.db.llm_cache,
+        max_entries=Config.LLM_CACHE_MAX_ENTRIES,
+        ttl_seconds=Config.LLM_CACHE_TTL_SECONDS,
+    )
+    llm_cache.ensure_indexes()
 
+# Upstream rate limits, with token buckets shared through MongoDB when several processes call the providers
+if Config.RATE_LIMIT_BACKEND == "mongo":
+    rate_limiter.configure_limiter(mongo.db.rate_limits)
+
+# Initialize KindoAPI with the API key from the config file
+kindo_api = KindoAPI(api_key=Config.KINDO_API_KEY, cache=llm_cache, cache_routes=Config.LLM_CACHE_ROUTES,
+                     base_url=Config.KINDO_BASE_URL)
+configure_rag_clients(kindo_api=kindo_api)
+hf_client = HuggingFaceClient(Config.HUGGING_FACE_API_KEY, base_url=Config.HUGGING_FACE_BASE_URL)
+# Uploaded images and audio go to Firebase Storage, or to a local directory served by /files
+if Config.STORAGE_BACKEND == "local":
+    firebase_handler = LocalStorageHandler(Config.LOCAL_STORAGE_DIR, Config.LOCAL_STORAGE_BASE_URL)
+else:
+    firebase_handler = FirebaseHandler(
+        firebase_cred_path,
+        firebase_bucket_name,
+        url_mode=Config.FIREBASE_URL_MODE,
+        chunk_size=Config.FIREBASE_UPLOAD_CHUNK_SIZE,
+        resumable_threshold=Config.FIREBASE_RESUMABLE_THRESHOLD,
+    )
+tts = TTS(Config.TTS_KEY, stream_url=Config.TTS_STREAM_URL,
+          bitrate_profiles=Config.TTS_BITRATE_PROFILES, default_profile=Config.TTS_DEFAULT_PROFILE)
+image_transcoder = ImageTranscoder(Config.IMAGE_VARIANT_FORMAT, Config.IMAGE_VARIANT_WIDTHS,
+                                   Config.IMAGE_VARIANT_QUALITY)
+asset_store = AssetStore(mongo.db.assets)
+asset_store.ensure_indexes()
+course_repository = CourseRepository(mongo.db)
+course_repository.ensure_indexes()
+quiz_bank = QuizBank(
+    mongo.db.quiz_bank,
+    mongo.db.course_text,
+    kindo_api,
+    bank_size=Config.QUIZ_BANK_SIZE,
+    low_watermark=Config.QUIZ_BANK_LOW_WATERMARK,
+    max_questions=Config.QUIZ_BANK_MAX_QUESTIONS,
+    context_fn=lambda text: fit_context(text, None, Config.QUIZ_CONTEXT_TOKEN_BUDGET,
+                                        chunk_tokens=Config.CONTEXT_CHUNK_TOKENS),
+    workers=Config.QUIZ_BANK_WORKERS,
+)
+quiz_bank.ensure_indexes()
+# Sampled span trees of course generations, served by the admin trace endpoint
+course_tracer = CourseTracer(
+    mongo.db.course_traces,
+    sample_rate=Config.TRACE_SAMPLE_RATE,
+    max_spans=Config.TRACE_MAX_SPANS,
+    ttl_days=Config.TRACE_TTL_DAYS,
+)
+course_tracer.ensure_indexes()
+
+# Slide events for streaming clients, Mongo-backed when workers run in other processes
+if Config.SLIDE_EVENTS_BACKEND == "mongo":
+    slide_events = MongoSlideEventBus(mongo.db.slide_events)
+    slide_events.ensure_indexes()
+else:
+    slide_events = SlideEventBus()
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def _set_interactive_priority():
+    # Upstream calls made for a request go ahead of background generation. Request threads
+    # only serve requests, pool and worker threads keep the background default.
+    rate_limiter.set_priority(rate_limiter.INTERACTIVE)
+
+@app.after_request
+def _observe_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # Label by the route template so course IDs do not explode the series count
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+# Files of the local storage backend
+@app.route('/files/<path:file_name>', methods=['GET'])
+def get_local_file(file_name):
+    if Config.STORAGE_BACKEND != "local":
+        return jsonify({"error": "Not found."}), 404
+    return send_from_directory(firebase_handler.root_dir, file_name)
 
 # Signup API
 @app.route('/api/signup', methods=['POST'])
@@ -72,6 +189,27 @@ def get_recommended_prompts():
     if not user:
         return jsonify({"error": "User not found"}), 404
 
+    messages = _recommended_prompts_messages(user)
+    # Call Kindo API with the model and the prompt
+    model_name = 'azure/gpt-4o'
+    response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=150,
+                                        route="recommended_prompts")
+
+    # Check if the response is successful
+    if isinstance(response, dict):
+        logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
+        return {"error": "Failed to fetch recommendations from Kindo AI"}, 500
+
+    body = response.json()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Recommended prompts response", extra={"body": body})
+
+    # Extract the generated content from Kindo API's response
+    content = body['choices'][0]['message']['content']
+
+    return {"recommendations": _parse_recommendations(content)}, 200
+
+def _recommended_prompts_messages(user):
     # Extract the user's age and whether they are a cybersecurity professional
     age = user.get('age')
     is_professional = user.get('working_professional', False)
@@ -79,20 +217,9 @@ def get_recommended_prompts():
     # Create the prompt for Kindo API
     professional_status = "a cybersecurity professional" if is_professional else "not a cybersecurity professional"
     prompt = f"Generate 3 small topic names then ':' and then their 100 character descriptions. Each seperated by '_' (make sure no extra text, formatting and no numbering) in the cybersecurity domain appropriate for someone who is {age} years old and is {professional_status}."
+    return [{"role": "user", "content": prompt}]
 
-    # Call Kindo API with the model and the prompt
-    model_name = 'azure/gpt-4o'
-    messages = [{"role": "user", "content": prompt}]
-    response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=150)
-    print(response.json())
-
-    # Check if the response is successful
-    if response.status_code != 200:
-        return {"error": "Failed to fetch recommendations from Kindo AI"}, response.status_code
-
-    # Extract the generated content from Kindo API's response
-    content = response.json()['choices'][0]['message']['content']
-
+def _parse_recommendations(content):
      # Split the content by commas
     topics = content.split('_')
     
@@ -109,24 +236,139 @@ def get_recommended_prompts():
             key, value = topic.split(':', 1)  # Split into key and value
             key_value_dict[key.strip()] = value.strip()  # Store in the dictionary
 
-    return {"recommendations": key_value_dict}, 200
+    return key_value_dict
 
 # Background task to process slides and save to MongoDB
 def process_slides(input_prompt, course_id, username):
+    with course_tracer.trace(course_id, username=username):
+        try:
+            _generate_course(input_prompt, course_id, username)
+        except Exception as e:
+            # The queue retries the job while it has attempts left, after the last one the course
+            # is left for the resume endpoint or startup recovery, which pick up from the checkpoints
+            job = job_queue.get(course_id)
+            if job is None or job.get("attempts", 0) >= job_queue.max_attempts:
+                course_repository.set_stage(course_id, CourseRepository.STAGE_FAILED, error=e)
+            raise
+
+def _generate_course(input_prompt, course_id, username):
+    """
+    Generates a course, or resumes one from its checkpoints: a saved course text is reused
+    instead of calling the LLMs again, and slides already stored with their media are skipped.
+    """
+    # Save the course data in MongoDB, totalSlides is a placeholder until the text is split.
+    # A resumed generation finds the course already there.
+    course = course_repository.create_course(course_id, input_prompt.capitalize(), 100,
+                                             input_prompt=input_prompt, username=username)
+    if course.get("stage") == CourseRepository.STAGE_DONE:
+        logger.info("Course already generated", extra={"course_id": course_id})
+        return
+
+    saved_text = course_repository.get_course_text(course_id)
+    if saved_text is None:
+        # Streamed slides of an attempt whose text was lost, the new text may split differently.
+        # Not decided by slidesGenerated, which can be short after a crash.
+        course_repository.clear_slides(course_id)
+    else:
+        course_repository.recount_slides(course_id)
+    course_repository.set_stage(course_id, CourseRepository.STAGE_TEXT if saved_text is None
+                                else CourseRepository.STAGE_SLIDES)
 
-    # Save the course data in MongoDB
-    course_data = {
-        "courseId": course_id,
-        "title": input_prompt.capitalize(),
-        "totalSlides": 100,
-        "slides": [],
-    }
+    user = mongo.db.users.find_one({'username': username})
+    # Process the slides through the staged media pipeline and update MongoDB in slide order.
+    # The text is generated on its own thread, which submits slides as they become known.
+    sanitized_name = re.sub(r'[^\w_]', '', input_prompt)
+    with _create_slide_pipeline(sanitized_name) as pipeline, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="course-text") as text_executor:
+        text_future = text_executor.submit(_submit_course_slides, tracing.current_span(), pipeline,
+                                           input_prompt, course_id, username, user, saved_text)
+
+        with tracing.span("slides") as slides_span:
+            for slide_data in pipeline.results():
+                # Save to coursecontent collection and bump its slidesGenerated counter
+                course_repository.add_slide(course_id, slide_data)
+                slide_events.publish(course_id, {"type": "slide", "slide": slide_data})
+
+                # Optionally, you can also log or print the slide data for debugging
+                logger.info("Processed slide", extra={"course_id": course_id, "slide_number": slide_data['slideNumber']})
+            slides_span.set(count=text_future.result())
+
+    course_repository.set_stage(course_id, CourseRepository.STAGE_DONE)
+    # Fill the course's quiz bank in the background so quizzes are served from MongoDB
+    quiz_bank.fill_async(course_id)
+
+def _submit_course_slides(parent_span, pipeline, input_prompt, course_id, username, user, saved_text=None):
+    """
+    Generates the course text and submits its slides to the pipeline, closing the pipeline when done.
 
-    mongo.db.coursecontent.insert_one(
-            course_data
-    )
+    With FAST_FIRST_SLIDES, the first slides are submitted as soon as their paragraph has streamed
+    in, while the rest of the text is still being generated; totalSlides stays provisional until then.
+    With saved_text, the text of an earlier attempt is used and only unfinished slides are submitted.
 
-    user = mongo.db.users.find_one({'username': username})
+    Returns:
+        int: The number of slides.
+    """
+    with tracing.use_span(parent_span):
+        try:
+            early_slides = []
+
+            def on_paragraph(paragraph):
+                slide = _clean_slides([paragraph])
+                if not slide or len(early_slides) >= Config.FAST_FIRST_SLIDES:
+                    return
+                early_slides.append(slide[0])
+                if len(early_slides) == 1:
+                    # Lists the course for the user as soon as its first slide is on the way
+                    course_repository.add_course_to_user(username, course_id)
+                pipeline.submit(len(early_slides), slide[0])
+
+            finished = set()
+            if saved_text is None:
+                with tracing.span("course_text") as text_span:
+                    presentation_text = _generate_course_text(
+                        input_prompt, user, on_paragraph=on_paragraph if Config.FAST_FIRST_SLIDES > 0 else None)
+                    text_span.set(chars=len(presentation_text), early_slides=len(early_slides))
+                course_repository.save_course_text(course_id, presentation_text)
+                course_repository.set_stage(course_id, CourseRepository.STAGE_SLIDES)
+                logger.info("Generated course text", extra={"course_id": course_id, "chars": len(presentation_text)})
+            else:
+                presentation_text = saved_text
+                finished = course_repository.finished_slide_numbers(course_id, DEFAULT_SLIDE_IMAGE_URL)
+                logger.info("Resuming course from saved text", extra={"course_id": course_id,
+                                                                     "finished_slides": len(finished)})
+
+            # Split the presentation text into slides
+            slides = _clean_slides(presentation_text.split('\n\n'))
+            if slides[:len(early_slides)] != early_slides:
+                # Cannot happen while both use the same split, but never save mismatched slides silently
+                raise RuntimeError("Streamed slides differ from the final course text")
+
+            course_repository.set_total_slides(course_id, len(slides))
+            slide_events.publish(course_id, {"type": "status", "totalSlides": len(slides), "provisional": False})
+
+            # Update user presentation mapping
+            course_repository.add_course_to_user(username, course_id)
+            pipeline.submit_all([(slide_number, slide) for slide_number, slide
+                                  in enumerate(slides, start=1)
+                                  if slide_number > len(early_slides) and slide_number not in finished])
+            return len(slides)
+        finally:
+            pipeline.close()
+
+def _clean_slides(paragraphs):
+    slides = [
+        re.sub(r'#{2,}', '', slide.replace('**', '').strip())  # Remove two or more consecutive '#'
+        for slide in paragraphs if re.search(r'[a-zA-Z]', slide)  # Keep slides that contain at least one alphabet
+    ]
+
+    # Remove empty or whitespace-only strings
+    return [slide for slide in slides if slide.strip()]
+
+def _generate_course_text(input_prompt, user, on_paragraph=None):
+    """
+    Returns the course text. With on_paragraph, the gpt-4o text is streamed and each paragraph
+    is passed to on_paragraph as soon as it is complete.
+    """
     if (user.get('working_professional', False)):
         presentation_text = generate_article(input_prompt)
     else:
@@ -134,21 +376,21 @@ def process_slides(input_prompt, course_id, username):
         model_name = '/models/WhiteRabbitNeo-33B-DeepSeekCoder'
         prompt = f"Give me information on {input_prompt}"
         messages = [{"role": "user", "content": prompt}]
-        response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=500)
+        response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=500,
+                                            route="course_knowledge")
         white_rabbit_knowledge_text = ""
         if 'error' not in response:
             white_rabbit_knowledge_text = response.json()['choices'][0]['message']['content']
         else:
-            print(f"API call failed: {response['error']}, details: {response.get('details')}")
-            time.sleep(5)
-            process_slides(input_prompt, course_id, username)
-            return
+            # Transient failures were already retried by the transport, fail the job
+            logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
+            raise RuntimeError(f"Course knowledge generation failed: {response['error']}")
 
         model_name = 'azure/gpt-4o'
         # Find the user in the MongoDB database
 
         if not user:
-            return jsonify({"error": "User not found"}), 404
+            raise RuntimeError("User not found")
 
         # Extract the user's age and whether they are a cybersecurity professional
         age = user.get('age')
@@ -157,121 +399,222 @@ def process_slides(input_prompt, course_id, username):
         prompt = f"Generate a well designed course as paragraphs(word limit on each paragraph is 20) on topic '{input_prompt}' curated for someone who is {age} years old and {professional_status} based on the following information(avoid special characters like '*' or '#' keep it plain text with basic formatting):\n{white_rabbit_knowledge_text}"
         messages = [{"role": "user", "content": prompt}]
 
-        response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=500)
-        presentation_text = response.json()['choices'][0]['message']['content']
-    mongo.db.course_text.insert_one({'courseId':course_id, 'text':presentation_text})
-    print(presentation_text)
-    
-    # Split the presentation text into slides
-    slides = presentation_text.split('\n\n')
+        if on_paragraph is not None:
+            return _stream_course_text(model_name, messages, on_paragraph)
 
-    slides = [
-        re.sub(r'#{2,}', '', slide.replace('**', '').strip())  # Remove two or more consecutive '#'
-        for slide in slides if re.search(r'[a-zA-Z]', slide)  # Keep slides that contain at least one alphabet
-    ]
+        response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=500,
+                                            route="course_text")
+        if 'error' in response:
+            logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
+            raise RuntimeError(f"Course text generation failed: {response['error']}")
+        presentation_text = response.json()['choices'][0]['message']['content']
+    return presentation_text
+
+def _stream_course_text(model_name, messages, on_paragraph):
+    deltas = kindo_api.stream_kindo_api(model=model_name, messages=messages, max_tokens=500,
+                                        route="course_text")
+    if isinstance(deltas, dict):
+        logger.error("API call failed", extra={"error": deltas['error'], "details": deltas.get('details')})
+        raise RuntimeError(f"Course text generation failed: {deltas['error']}")
+
+    text = []
+    pending = ""
+    for delta in deltas:
+        text.append(delta)
+        # Paragraphs end at a blank line, split the same way as the finished text
+        paragraphs = (pending + delta).split('\n\n')
+        pending = paragraphs.pop()
+        for paragraph in paragraphs:
+            on_paragraph(paragraph)
+    return "".join(text)
+
+def _create_slide_pipeline(sanitized_name):
+    """
+    Builds the per-course slide pipeline with one callable per stage.
 
-    # Remove empty or whitespace-only strings
-    slides = [slide for slide in slides if slide.strip()]
-
-    mongo.db.coursecontent.update_one(
-    {"courseId": course_id},  # Filter the document by courseId
-    {
-        "$set": {
-            "totalSlides": len(slides),  # Update the total number of slides
-        }
-    }
-    )
+    Parameters:
+        sanitized_name (str): Course prompt stripped of special characters, used for image file names.
 
-    # Update user presentation mapping
-    mongo.db.user_presentation.update_one(
-        {"username": username},
-        {"$addToSet": {"courseIds": course_id}},  # Use $addToSet to avoid duplicates
-        upsert=True
-    )
-    # Process each slide content and update MongoDB
-    for slide_number, slide_content in enumerate(slides):
+    Returns:
+        SlidePipeline: The pipeline, to be used as a context manager.
+    """
+    def generate_image_prompt(slide_number, slide_content):
         prompt = f"Create a brief prompt for an image generative model to create an image related to this content with no extra text:'{slide_content}'"
         messages = [{"role": "user", "content": prompt}]
         model_name = 'azure/gpt-4o-mini'
-        response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=50)
+        response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=50,
+                                            route="image_prompt")
         image_prompt = None
         if 'error' not in response:
             image_prompt = response.json()['choices'][0]['message']['content']
         else:
-            print(f"image prompt generation failed: {response['error']}, details: {response.get('details')}")
-        print("Image prompt generated by gpt-4o-mini: "+str(image_prompt))
-
-        public_url="https://firebasestorage.googleapis.com/v0/b/morpheus-grin.appspot.com/o/istockphoto-1409329028-612x612.jpg?alt=media&token=49ee18cf-7c68-4b0a-b5a1-6b6dcaa99e41"
-        
-        if image_prompt:
-            model_name = "CompVis/stable-diffusion-v1-4"
-            image_data = hf_client.generate_image(image_prompt, model_name)
-            if image_data:
-                # Step 2: Save the image temporarily
-                # Remove special characters except underscore
-                sanitized_name = re.sub(r'[^\w_]', '', input_prompt)
-                file_name = f"{sanitized_name.replace(' ', '_')}{slide_number}.png"
-                local_file_path = f"./tmp/{file_name}"
-
-                with open(local_file_path, "wb") as file:
-                    file.write(image_data)
-
-                # Step 3: Upload the image to Firebase
-                public_url = firebase_handler.upload_to_firebase(file_name, local_file_path)
-
-                # Step 4: Clean up local file
-                firebase_handler.delete_local_file(local_file_path)
-                
-                print(f"Image URL: {public_url}")
-            else:
-                print("Image generation failed.")
-
-        text = slide_content
-        mp3_url = ""
-
+            logger.error("Image prompt generation failed", extra={"error": response['error'], "details": response.get('details')})
+        logger.info("Image prompt generated by gpt-4o-mini", extra={"slide_number": slide_number, "image_prompt": image_prompt})
+        return image_prompt
+
+    def generate_image_prompts(batch):
+        # One call for the prompts of several slides, slides missing from the reply fall back to generate_image_prompt
+        messages = _image_prompt_batch_messages(batch)
+        response = kindo_api.call_kindo_api(model='azure/gpt-4o-mini', messages=messages,
+                                            max_tokens=60 * len(batch) + 20, route="image_prompt_batch")
+        if 'error' in response:
+            logger.error("Batched image prompt generation failed", extra={"error": response['error'], "details": response.get('details')})
+            return {}
+        prompts = _parse_image_prompt_batch(response.json()['choices'][0]['message']['content'],
+                                            [slide_number for slide_number, _ in batch])
+        if len(prompts) < len(batch):
+            logger.warning("Batched image prompts incomplete", extra={"slides": len(batch), "prompts": len(prompts)})
+        return prompts
+
+    def generate_image(slide_number, image_prompt):
+        model_name = "CompVis/stable-diffusion-v1-4"
+        key = AssetStore.image_key(model_name, image_prompt)
+        existing_url, variants = asset_store.lookup_image(key)
+        if existing_url:
+            logger.info("Reusing image for prompt", extra={"image_prompt": image_prompt})
+            return Asset(key, None, variants or existing_url)
+
+        image_data = hf_client.generate_image(image_prompt, model_name)
+        if not image_data:
+            logger.error("Image generation failed", extra={"slide_number": slide_number})
+            return None
+        return Asset(key, image_data, None)
+
+    def transcode_image(slide_number, image):
+        # Reused images keep whatever was uploaded for them, new ones are re-encoded at each width
+        if image.url:
+            return image
+        variants = image_transcoder.transcode(image.data)
+        if not variants:
+            return image
+        return Asset(image.key, variants, None)
+
+    def upload_image(slide_number, image):
+        if image.url:
+            return image.url
+
+        file_stem = f"{sanitized_name.replace(' ', '_')}_{_asset_file_id(image.key)}"
+        if isinstance(image.data, list):
+            variants = []
+            for variant in image.data:
+                url = firebase_handler.upload_bytes(f"{file_stem}_{variant.width}.{variant.extension}",
+                                                    variant.data, variant.content_type)
+                variants.append({"url": url, "width": variant.width, "height": variant.height,
+                                 "format": variant.extension})
+            asset_store.record(image.key, AssetStore.IMAGE, variants[0]["url"], variants=variants)
+            logger.info("Uploaded image variants", extra={"slide_number": slide_number,
+                                                          "widths": [variant["width"] for variant in variants]})
+            return variants
+
+        file_name = f"{file_stem}.png"
+
+        # Upload the image to Firebase straight from memory
+        public_url = firebase_handler.upload_bytes(file_name, image.data, "image/png")
+        asset_store.record(image.key, AssetStore.IMAGE, public_url)
+
+        logger.info("Uploaded image", extra={"slide_number": slide_number, "url": public_url})
+        return public_url
+
+    def generate_audio(slide_number, slide_content):
         # Truncate text to 1000 characters if necessary
-        if text:
-            text = text[:1000]  # Keep only the first 1000 characters
+        text = slide_content[:1000]
+        key = AssetStore.audio_key(tts.voice_params, text)
+        existing_url = asset_store.lookup(key)
+        if existing_url:
+            return Asset(key, None, existing_url)
 
         # Generate MP3 using the TTS API
         audio_content = tts.generate_audio(text)
-
         if audio_content is None:
-            print("Failed to generate audio.")
-        else :
-            # Save the audio file locally
-            file_name = f"{uuid.uuid4()}.mp3"
-            local_file_path = f"./tmp/{file_name}"
-            with open(local_file_path, 'wb') as f:
-                f.write(audio_content)
-
-            # Upload to Firebase and get public URL
-            mp3_url = firebase_handler.upload_to_firebase(file_name, local_file_path)
-
-            # Optionally delete the local file after upload
-            firebase_handler.delete_local_file(local_file_path)
-
-
-        # Update course data
-        slide_data = {
-            "slideNumber": slide_number + 1,
-            "content": slide_content,
-            "images": [public_url],  # Placeholder for image URLs
-            "audio": mp3_url    # Placeholder for audio file URL
-        }
-        course_data["slides"].append(slide_data)
-        # Save to coursecontent collection
-        # Update or insert slide data in MongoDB
-        # Assuming 'course_id' is defined and uniquely identifies the course
-        mongo.db.coursecontent.update_one(
-            {"courseId": course_id},  # Filter for the course
-            {"$push": {"slides": slide_data}},  # Add the new slide to the slides array
-            upsert=True  # Create the course document if it doesn't exist
-        )
-        
-        # Optionally, you can also log or print the slide data for debugging
-        print(f"Processed slide {slide_number + 1}: {slide_content}")
-    
+            logger.error("Failed to generate audio", extra={"slide_number": slide_number})
+            return None
+        return Asset(key, audio_content, None)
+
+    def upload_audio(slide_number, audio):
+        if audio.url:
+            return audio.url
+        return _upload_audio_asset(audio)
+
+    return SlidePipeline(
+        generate_image_prompt=generate_image_prompt,
+        generate_image=generate_image,
+        upload_image=upload_image,
+        generate_audio=generate_audio,
+        upload_audio=upload_audio,
+        default_image_url=DEFAULT_SLIDE_IMAGE_URL,
+        workers={
+            "image_prompt": Config.IMAGE_PROMPT_WORKERS,
+            "image": Config.IMAGE_WORKERS,
+            "tts": Config.TTS_WORKERS,
+            "upload": Config.UPLOAD_WORKERS,
+            "transcode": Config.TRANSCODE_WORKERS,
+        },
+        generate_image_prompts=generate_image_prompts if Config.IMAGE_PROMPT_BATCH_SIZE > 0 else None,
+        batch_size=Config.IMAGE_PROMPT_BATCH_SIZE,
+        transcode_image=transcode_image if image_transcoder.enabled else None,
+    )
+
+def _image_prompt_batch_messages(batch):
+    slides_text = "\n".join(f"Slide {slide_number}: {content}" for slide_number, content in batch)
+    prompt = (f"For each of the {len(batch)} slides below, create a brief prompt for an image generative model "
+              "to create an image related to the slide's content. Reply with only a JSON array, no other text, "
+              "with one object per slide: {\"slide\": <slide number>, \"prompt\": \"<image prompt>\"}.\n"
+              f"{slides_text}")
+    return [{"role": "user", "content": prompt}]
+
+def _parse_image_prompt_batch(content, slide_numbers):
+    """
+    Parses the batched image prompt reply into {slide_number: prompt}, keeping only
+    non-empty prompts for the requested slides.
+    """
+    # Tolerate code fences or text around the array
+    match = re.search(r"\[.*\]", content, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    wanted = set(slide_numbers)
+    prompts = {}
+    for position, item in enumerate(items):
+        if isinstance(item, dict):
+            slide_number, image_prompt = item.get("slide"), item.get("prompt")
+        elif isinstance(item, str) and len(items) == len(slide_numbers):
+            # Bare strings are only trusted when there is exactly one per slide
+            slide_number, image_prompt = slide_numbers[position], item
+        else:
+            continue
+        if isinstance(slide_number, str) and slide_number.strip().isdigit():
+            slide_number = int(slide_number)
+        if not isinstance(slide_number, bool) and slide_number in wanted \
+                and isinstance(image_prompt, str) and image_prompt.strip():
+            prompts[slide_number] = image_prompt.strip()
+    return prompts
+
+def _asset_file_id(key):
+    # Asset keys look like "<kind>:<sha256>", the hash is unique enough for a file name
+    return key.split(':', 1)[1][:32]
+
+def _upload_audio_asset(audio):
+    """
+    Uploads newly generated audio to Firebase and records it in the asset store.
+
+    Parameters:
+        audio (Asset): The audio asset holding the MP3 bytes.
+
+    Returns:
+        str: The public URL of the uploaded audio.
+    """
+    file_name = f"{_asset_file_id(audio.key)}.mp3"
+
+    # Upload to Firebase straight from memory and get the URL
+    mp3_url = firebase_handler.upload_bytes(file_name, audio.data, "audio/mpeg")
+    asset_store.record(audio.key, AssetStore.AUDIO, mp3_url)
+    return mp3_url
 
 # 4.1 Start Presentation Generation
 @app.route('/api/start-presentation-generation', methods=['POST'])
@@ -286,43 +629,208 @@ def start_presentation():
     # Generate a unique course ID
     course_id = str(uuid.uuid4())
 
-    # Start background processing of slides
-    threading.Thread(target=process_slides, args=(input_prompt, course_id, username)).start()
-    
-    return jsonify({"courseId": course_id}), 202  # Return immediately
+    # Queue background processing of slides, the job ID is the course ID
+    try:
+        _, position = job_queue.enqueue(
+            "generate_course",
+            {"input_prompt": input_prompt, "course_id": course_id, "username": username},
+            username,
+            job_id=course_id,
+        )
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
+    return jsonify({"courseId": course_id, "queuePosition": position}), 202  # Return immediately
+
+# 4.1.1 Get Generation Job Status
+@app.route('/api/generation-job/<course_id>', methods=['GET'])
+def get_generation_job(course_id):
+    job = job_queue.get(course_id)
+
+    if not job:
+        return jsonify({"error": "Job not found."}), 404
+
+    return jsonify({
+        "courseId": course_id,
+        "status": job["status"],
+        "queuePosition": job_queue.position(job),
+        "attempts": job.get("attempts", 0),
+    }), 200
+
+# 4.1.2 Resume Generation
+@app.route('/api/resume-generation/<course_id>', methods=['POST'])
+def resume_generation(course_id):
+    course = course_repository.get_generation(course_id)
+
+    if not course:
+        return jsonify({"error": "Course not found."}), 404
+    if course.get("stage") == CourseRepository.STAGE_DONE:
+        return jsonify({"error": "Course is already generated."}), 409
+    if not course.get("inputPrompt"):
+        return jsonify({"error": "Course was generated without checkpoints and cannot be resumed."}), 409
+
+    # Nothing to do while its job is still queued or running, a lost lease is picked up by the queue
+    job = job_queue.get(course_id)
+    if job and job["status"] in (JobQueue.QUEUED, JobQueue.RUNNING):
+        return jsonify({"courseId": course_id, "status": job["status"],
+                        "queuePosition": job_queue.position(job)}), 200
+
+    try:
+        position = _resume_course(course)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
+    return jsonify({"courseId": course_id, "status": JobQueue.QUEUED, "queuePosition": position}), 202
+
+def _resume_course(course):
+    """
+    Puts an unfinished course's generation job back in the queue.
+
+    Returns:
+        int: The job's queue position, or 0 if it was not failed (e.g. already requeued elsewhere).
+
+    Raises:
+        QueueFullError: If the queue or the user's share of it is full.
+    """
+    course_id = course["courseId"]
+    position = job_queue.requeue(course_id)
+    if not position and job_queue.get(course_id) is None:
+        try:
+            _, position = job_queue.enqueue(
+                "generate_course",
+                {"input_prompt": course["inputPrompt"], "course_id": course_id, "username": course["username"]},
+                course["username"],
+                job_id=course_id,
+            )
+        except DuplicateKeyError:
+            position = 0
+    if position:
+        course_repository.count_resume(course_id)
+        # Clears the failed stage and its error, so the slide status no longer reports it
+        course_repository.set_stage(course_id, CourseRepository.STAGE_TEXT
+                                    if course_repository.get_course_text(course_id) is None
+                                    else CourseRepository.STAGE_SLIDES)
+    return position
+
+def recover_unfinished_courses():
+    """
+    Re-queues checkpointed courses whose generation failed or lost its job, at most
+    GENERATION_MAX_RESUMES times each. Jobs whose worker died mid-run are reclaimed by
+    the queue once their lease expires, so they are left alone.
+
+    Returns:
+        int: The number of courses re-queued.
+    """
+    requeued = 0
+    active = job_queue.active_ids()
+    for course in course_repository.find_unfinished(Config.GENERATION_MAX_RESUMES, exclude=active):
+        try:
+            if _resume_course(course):
+                requeued += 1
+        except QueueFullError as e:
+            logger.warning("Could not re-queue course: %s", e, extra={"course_id": course["courseId"]})
+    if requeued:
+        logger.info("Re-queued unfinished courses", extra={"count": requeued})
+    return requeued
 
 # 4.2 Get Slide Status
 @app.route('/api/slide-status/<course_id>', methods=['GET'])
 def get_slide_status(course_id):
-    course_data = mongo.db.coursecontent.find_one({"courseId": course_id})
+    course_data = course_repository.get_status(course_id)
 
     if not course_data:
         return jsonify({"error": "Course not found."}), 404
 
-    slides_generated = sum(1 for slide in course_data.get("slides", []) if slide)
+    slides_generated = course_data["slidesGenerated"]
+    provisional = course_data.get("totalSlidesProvisional", False)
     title =course_data.get("title", "No Title Found")
     title = title.capitalize()
+    if course_data.get("stage") == CourseRepository.STAGE_FAILED:
+        status = "Failed"  # Resumable through /api/resume-generation
+    elif not provisional and slides_generated == course_data.get("totalSlides"):
+        status = "Completed"
+    else:
+        status = "In Progress"
     return jsonify({
         "courseId": course_id,
         "slidesGenerated": slides_generated,
         "totalSlides": course_data.get("totalSlides"),
-        "status": "Completed" if slides_generated == course_data.get("totalSlides") else "In Progress",
+        # totalSlides is a placeholder while the course text is still being generated
+        "totalSlidesProvisional": provisional,
+        "status": status,
         "title": title
     }), 200
 
+# 4.2.1 Stream Slides
+@app.route('/api/slide-stream/<course_id>', methods=['GET'])
+def stream_slides(course_id):
+    """
+    Server-Sent Events stream of a course's slides.
+
+    Sends a status event and every slide already generated, then pushes each new slide
+    as process_slides finishes it, and ends with a complete event once all slides are in.
+    """
+    # Subscribe before reading the stored slides so no slide falls in between
+    subscription = slide_events.subscribe(course_id)
+    course_data = course_repository.get_status(course_id)
+
+    if not course_data:
+        subscription.close()
+        return jsonify({"error": "Course not found."}), 404
+
+    def events():
+        total_slides = course_data.get("totalSlides")
+        # Slide numbers already sent, a resumed course fills in its missing slides out of order
+        sent = set()
+        deadline = time.monotonic() + Config.SLIDE_STREAM_TIMEOUT
+        try:
+            yield _sse("status", {"courseId": course_id, "totalSlides": total_slides,
+                                  "provisional": course_data.get("totalSlidesProvisional", False)})
+            for slide_data in course_repository.get_slides(course_id):
+                yield _sse("slide", slide_data)
+                sent.add(slide_data["slideNumber"])
+
+            while len(sent) < total_slides and time.monotonic() < deadline:
+                event = subscription.get(timeout=Config.SLIDE_STREAM_HEARTBEAT)
+                if event is None:
+                    job = job_queue.get(course_id)
+                    if job and job["status"] == JobQueue.FAILED:
+                        yield _sse("error", {"error": "Course generation failed."})
+                        return
+                    yield ": keep-alive\n\n"
+                elif event["type"] == "status":
+                    total_slides = event["totalSlides"]
+                    yield _sse("status", {"courseId": course_id, "totalSlides": total_slides,
+                                          "provisional": event.get("provisional", False)})
+                elif event["type"] == "slide" and event["slide"]["slideNumber"] not in sent:
+                    yield _sse("slide", event["slide"])
+                    sent.add(event["slide"]["slideNumber"])
+
+            if len(sent) >= total_slides:
+                yield _sse("complete", {"courseId": course_id, "slidesGenerated": len(sent)})
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
 # 4.3 Get Slide
 @app.route('/api/slide/<course_id>/<int:slide_number>', methods=['GET'])
 def get_slide(course_id, slide_number):
-    course_data = mongo.db.coursecontent.find_one({"courseId": course_id})
+    if slide_number < 1:
+        return jsonify({"error": "Slide not available."}), 404
 
-    if not course_data:
+    course_found, slide_data = course_repository.get_slide(course_id, slide_number)
+
+    if not course_found:
         return jsonify({"error": "Course not found."}), 404
 
-    slides = course_data.get("slides", [])
-    if slide_number < 1 or slide_number > len(slides):
+    if not slide_data:
         return jsonify({"error": "Slide not available."}), 404
 
-    slide_data = slides[slide_number - 1]  # Adjust for zero-indexing
     return jsonify({
         "slideNumber": slide_data["slideNumber"],
         "content": slide_data["content"],
@@ -341,23 +849,10 @@ def get_course_ids(username):
     Returns:
         JSON response containing course IDs and their titles or an error message.
     """
-    # Fetch the user presentation document from MongoDB
-    user_presentation = mongo.db.user_presentation.find_one({"username": username})
-
-    if user_presentation:
-        # Get the course IDs for the user
-        course_ids = user_presentation.get("courseIds", [])
-
-        # Retrieve titles for each course ID from coursecontent collection
-        courses = []
-        for course_id in course_ids:
-            course = mongo.db.coursecontent.find_one({"courseId": course_id})
-            if course:
-                courses.append({
-                    "courseId": course_id,
-                    "title": course.get("title", "No Title Found")  # Use default message if title is missing
-                })
-        
+    # Fetch the user's course IDs and their titles in one $in query
+    courses = course_repository.list_course_titles(username)
+
+    if courses is not None:
         # Return the list of courses with their IDs and titles
         return jsonify(courses), 200
     else:
@@ -373,11 +868,11 @@ def get_course_title():
         return jsonify({"error": "courseId is required"}), 400
 
     # Search for the courseId in the coursecontent collection
-    course = mongo.db.coursecontent.find_one({"courseId": course_id}, {"_id": 0, "title": 1})
+    title = course_repository.get_title(course_id)
 
     # If course not found, return default title
-    if course and "title" in course:
-        title = course["title"].capitalize()
+    if title:
+        title = title.capitalize()
     else:
         title = "Title Not Found"
 
@@ -396,25 +891,85 @@ def generate_tts():
     if not text:
         return jsonify({"error": "Text is required."}), 400
 
+    # Clients pick a bitrate profile, e.g. a lower one on mobile data
+    profile = data.get('profile')
+    try:
+        voice_params = tts.params_for(profile)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Reuse audio already voiced with the same text and voice settings
+    key = AssetStore.audio_key(voice_params, text)
+    existing_url = asset_store.lookup(key)
+    if existing_url:
+        return jsonify({"mp3_url": existing_url}), 200
+
     # Generate MP3 using the TTS API
-    audio_content = tts.generate_audio(text)
+    audio_content = tts.generate_audio(text, profile=profile)
 
     if audio_content is None:
         return jsonify({"error": "Failed to generate audio."}), 500
 
-    # Save the audio file locally
-    file_name = f"{uuid.uuid4()}.mp3"
-    local_file_path = f"./tmp/{file_name}"
-    with open(local_file_path, 'wb') as f:
-        f.write(audio_content)
+    mp3_url = _upload_audio_asset(Asset(key, audio_content, None))
 
-    # Upload to Firebase and get public URL
-    mp3_url = firebase_handler.upload_to_firebase(file_name, local_file_path)
+    return jsonify({"mp3_url": mp3_url}), 200
 
-    # Optionally delete the local file after upload
-    firebase_handler.delete_local_file(local_file_path)
+@app.route('/api/admin/llm-cache-stats', methods=['GET'])
+def get_llm_cache_stats():
+    if llm_cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, "routes": llm_cache.stats()}), 200
 
-    return jsonify({"mp3_url": mp3_url}), 200
+@app.route('/generate-tts/stream', methods=['GET', 'POST'])
+def stream_tts():
+    # Text comes from the JSON body, or the query string so audio elements can use the URL directly
+    data = request.get_json(silent=True) or {}
+    text = data.get('text') or request.args.get('text')
+
+    # Truncate text to 1000 characters if necessary
+    if text:
+        text = text[:1000]  # Keep only the first 1000 characters
+
+    if not text:
+        return jsonify({"error": "Text is required."}), 400
+
+    profile = data.get('profile') or request.args.get('profile')
+    try:
+        voice_params = tts.params_for(profile)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Already voiced, let the client fetch the stored file
+    key = AssetStore.audio_key(voice_params, text)
+    existing_url = asset_store.lookup(key)
+    if existing_url:
+        return redirect(existing_url)
+
+    audio_chunks = tts.stream_audio(text, profile=profile)
+    if audio_chunks is None:
+        return jsonify({"error": "Failed to generate audio."}), 500
+
+    # Stream to the client while a background upload stores the same bytes for reuse
+    return Response(stream_with_context(tee_to_background(audio_chunks, _audio_stream_persister(key))),
+                    mimetype="audio/mpeg")
+
+def _audio_stream_persister(key):
+    # Reads the streamed MP3 from a ChunkPipe on a background thread, uploads it and records the asset
+    def persist(pipe):
+        mp3_url = firebase_handler.upload_stream(f"{_asset_file_id(key)}.mp3", pipe, "audio/mpeg")
+        asset_store.record(key, AssetStore.AUDIO, mp3_url)
+    return persist
+
+@app.route('/api/admin/course-trace/<course_id>', methods=['GET'])
+def get_course_trace(course_id):
+    trace = course_tracer.latest(course_id)
+    if trace is None:
+        return jsonify({"error": "No trace recorded for this course"}), 404
+    return jsonify(trace), 200
+
+@app.route('/api/admin/token-usage', methods=['GET'])
+def get_token_usage():
+    return jsonify(kindo_api.usage.snapshot()), 200
 
 @app.route('/api/ask-question', methods=['POST'])
 def ask_question():
@@ -429,23 +984,66 @@ def ask_question():
     if not course_text_data:
         return jsonify({"error": "Course not found."}), 404
 
-    course_id_text = course_text_data.get("text", "")
-    print("course_id_text:"+str(course_id_text))
-    
-    prompt = f"Answer the Question '{question}' in short based on the text: {course_id_text}"
+    messages = _ask_question_messages(question, course_text_data)
     # Call Kindo API with the model and the prompt
     model_name = 'azure/gpt-4o'
-    messages = [{"role": "user", "content": prompt}]
-    response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=2000)
+    response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=2000,
+                                        route="ask_question")
     answer_text = ""
     if 'error' not in response:
         answer_text = response.json()['choices'][0]['message']['content']
     else:
-        print(f"API call failed: {response['error']}, details: {response.get('details')}")
+        logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
         return jsonify({"error": "Failed to generate answer."}), 500
 
     return jsonify({"answer": answer_text}), 200
 
+@app.route('/api/ask-question/stream', methods=['POST'])
+def ask_question_stream():
+    """
+    Streams the answer as Server-Sent Events: a token event per delta, then a done event with the full answer.
+    """
+    data = request.json
+    question = data.get('question')
+    courseId = data.get('courseId')
+
+    course_text_data = mongo.db.course_text.find_one({"courseId": courseId})
+
+    if not course_text_data:
+        return jsonify({"error": "Course not found."}), 404
+
+    messages = _ask_question_messages(question, course_text_data)
+    deltas = kindo_api.stream_kindo_api(model='azure/gpt-4o', messages=messages, max_tokens=2000,
+                                        route="ask_question")
+    if isinstance(deltas, dict):
+        logger.error("API call failed", extra={"error": deltas['error'], "details": deltas.get('details')})
+        return jsonify({"error": "Failed to generate answer."}), 500
+
+    def events():
+        answer = []
+        try:
+            for delta in deltas:
+                answer.append(delta)
+                yield _sse("token", {"delta": delta})
+        except Exception:
+            logger.exception("Answer stream failed")
+            yield _sse("error", {"error": "Failed to generate answer."})
+            return
+        yield _sse("done", {"answer": "".join(answer)})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _ask_question_messages(question, course_text_data):
+    course_id_text = course_text_data.get("text", "")
+
+    # Only send the parts of the course most relevant to the question
+    course_id_text = fit_context(course_id_text, question, Config.QA_CONTEXT_TOKEN_BUDGET,
+                                 chunk_tokens=Config.CONTEXT_CHUNK_TOKENS)
+
+    prompt = f"Answer the Question '{question}' in short based on the text: {course_id_text}"
+    return [{"role": "user", "content": prompt}]
+
 
     
 @app.route('/api/generate-quiz', methods=['POST'])
@@ -453,34 +1051,55 @@ def generate_quiz():
      # Get the text input from the request
     data = request.json
     courseId = data.get('courseId')
-    
+    username = data.get('username')
+
+    # Serve a precomputed question when the course's bank has one (unseen by the user if given)
+    quiz = quiz_bank.next_question(courseId, username)
+    if quiz:
+        return jsonify({"quiz": quiz}), 200
+
     # Find the document where the key 'courseId' exists
     course_text_data = mongo.db.course_text.find_one({"courseId": courseId})
 
     if not course_text_data:
         return jsonify({"error": "Course not found."}), 404
 
-    course_id_text = course_text_data.get("text", "")
-    print("course_id_text:"+str(course_id_text))    
-    
-    prompt = f"Create a Multiple choice quiz that has a single answer generating 3 components. Give me the components in '#' seperated manner with no numbering. Here's the list: 1. The quiz question. 2. All the 4 options as A. B. C. D. newline seperated. 3. The correct option if they are numbered A,B,C,D in order, give me the correct option alphabet only. , it should be totally based on the text and nothing from outside: {course_id_text}"
+    messages = _quiz_messages(course_text_data)
     # Call Kindo API with the model and the prompt
     model_name = 'azure/gpt-4o'
-    messages = [{"role": "user", "content": prompt}]
-    response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=2000)
+    response = kindo_api.call_kindo_api(model=model_name, messages=messages, max_tokens=2000,
+                                        route="quiz")
     quiz_text = ""
     if 'error' not in response:
         quiz_text = response.json()['choices'][0]['message']['content']
-        print(quiz_text)
+        logger.debug("Generated quiz", extra={"quiz_text": quiz_text})
     else:
-        print(f"API call failed: {response['error']}, details: {response.get('details')}")
+        logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
         return jsonify({"error": "Failed to generate quiz."}), 500
+
+    quiz = _parse_quiz(quiz_text)
+    if quiz is None:
+        return jsonify({"error": "Failed to generate quiz. Malformed LLM Response"}), 500
+
+    return jsonify({"quiz": quiz}), 200
+
+def _quiz_messages(course_text_data):
+    course_id_text = course_text_data.get("text", "")
+    logger.debug("Quiz course text", extra={"chars": len(course_id_text)})
+
+    # Keep the quiz prompt within its token budget
+    course_id_text = fit_context(course_id_text, None, Config.QUIZ_CONTEXT_TOKEN_BUDGET,
+                                 chunk_tokens=Config.CONTEXT_CHUNK_TOKENS)
     
+    prompt = f"Create a Multiple choice quiz that has a single answer generating 3 components. Give me the components in '#' seperated manner with no numbering. Here's the list: 1. The quiz question. 2. All the 4 options as A. B. C. D. newline seperated. 3. The correct option if they are numbered A,B,C,D in order, give me the correct option alphabet only. , it should be totally based on the text and nothing from outside: {course_id_text}"
+    return [{"role": "user", "content": prompt}]
+
+def _parse_quiz(quiz_text):
     # Step 1: Split based on all occurrences of '-'
     parts = [item.strip() for item in quiz_text.split('#') if item.strip()]  # Remove empty strings after splitting
 
     if len(parts) < 3:
-        return jsonify({"error": "Failed to generate quiz. Malformed LLM Response"}), 500
+        return None
 
     # Step 2: First part is the question, second part are the options, third part is the answer
     question = parts[0].strip()
@@ -492,11 +1111,50 @@ def generate_quiz():
     # Get the first character of the third part as the answer (trim and take first character)
     answer = parts[2].strip()[0]
 
-    return jsonify({"quiz": {
+    return {
         'question':question,
         'options':options,
         'answer':ord(answer)-ord('A'),
-    }}), 200
+    }
+
+# Durable generation queue, workers run here or in separate processes via worker.py
+job_queue = JobQueue(
+    mongo.db.generation_jobs,
+    max_queued=Config.JOB_QUEUE_MAX,
+    max_per_user=Config.JOB_MAX_PER_USER,
+    lease_seconds=Config.JOB_LEASE_SECONDS,
+    max_attempts=Config.JOB_MAX_ATTEMPTS,
+    retry_backoff=Config.JOB_RETRY_BACKOFF,
+)
+job_queue.ensure_indexes()
+worker_pool = WorkerPool(
+    job_queue,
+    handlers={"generate_course": process_slides},
+    workers=Config.JOB_WORKERS,
+    poll_interval=Config.JOB_POLL_INTERVAL,
+)
+_workers_lock = threading.Lock()
+_workers_started = False
+
+def start_workers():
+    """
+    Re-queues unfinished courses (if GENERATION_RECOVER_ON_STARTUP) and starts the worker pool.
+    Called on import when JOB_WORKERS_IN_PROCESS is true, and by worker.py otherwise. Only the
+    first call in a process does anything, so recovery never runs twice.
+    """
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+    if Config.GENERATION_RECOVER_ON_STARTUP:
+        recover_unfinished_courses()
+    worker_pool.start()
+
+if Config.JOB_WORKERS_IN_PROCESS:
+    start_workers()
+# Jobs in flight are reported by the process running the pool, worker.py when it is not this one
+metrics.track_queue(job_queue, worker_pool if Config.JOB_WORKERS_IN_PROCESS else None)
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
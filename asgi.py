@@ -0,0 +1,342 @@
+# asgi.py
+# ASGI serving mode. The routes that spend their time waiting on Kindo, Unreal Speech or
+# long-lived streams run as coroutines with async HTTP clients and motor; every other route
+# is served by the Flask app (app.py) on a pool of WSGI threads behind the same server.
+#
+# Run with:
+#   python asgi.py
+# or any ASGI server, e.g. ASGI_WORKERS=4 uvicorn asgi:app --workers 4. ASGI_WORKERS must match
+# the server's worker count: with more than one, generation runs in worker.py processes
+# (JOB_WORKERS_IN_PROCESS=false) and slide events go through MongoDB (SLIDE_EVENTS_BACKEND=mongo).
+import contextlib
+import glob
+import logging
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, RedirectResponse, StreamingResponse
+from starlette.routing import Mount, Route
+import uvicorn
+
+from config import Config
+
+# Checked before importing app, which starts the in-process worker pool
+if Config.ASGI_WORKERS > 1 and (Config.JOB_WORKERS_IN_PROCESS or Config.SLIDE_EVENTS_BACKEND != "mongo"):
+    raise RuntimeError("ASGI_WORKERS > 1 requires JOB_WORKERS_IN_PROCESS=false and SLIDE_EVENTS_BACKEND=mongo: "
+                       "every worker process would start its own generation workers and in-memory "
+                       "slide events only reach clients of the process running the generation")
+if Config.ASGI_WORKERS > 1 and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    raise RuntimeError("ASGI_WORKERS > 1 requires PROMETHEUS_MULTIPROC_DIR, otherwise /metrics only "
+                       "reports the process that happens to serve the scrape")
+
+from app import (
+    app as flask_app,
+    asset_store,
+    course_repository,
+    kindo_api,
+    llm_cache,
+    quiz_bank,
+    slide_events,
+    _ask_question_messages,
+    _audio_stream_persister,
+    _parse_quiz,
+    _parse_recommendations,
+    _quiz_messages,
+    _recommended_prompts_messages,
+    _sse,
+    _upload_audio_asset,
+)
+from asset_store import Asset, AssetStore
+from async_clients import AsyncKindoAPI, AsyncTTS, close_async_transports
+from audio_stream import atee_to_background
+from job_queue import JobQueue
+import metrics
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Async driver for the queries the routes make themselves; repository classes stay
+# on pymongo and are called through the thread pool
+motor_client = AsyncIOMotorClient(Config.MONGO_URI)
+db = motor_client.get_default_database()
+
+# Same cache and token counters as the Flask app's client
+async_kindo_api = AsyncKindoAPI(api_key=Config.KINDO_API_KEY, cache=llm_cache,
+                                cache_routes=Config.LLM_CACHE_ROUTES, usage=kindo_api.usage,
+                                base_url=Config.KINDO_BASE_URL)
+async_tts = AsyncTTS(Config.TTS_KEY, stream_url=Config.TTS_STREAM_URL,
+                     bitrate_profiles=Config.TTS_BITRATE_PROFILES, default_profile=Config.TTS_DEFAULT_PROFILE)
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+async def get_recommended_prompts(request):
+    username = request.query_params.get('username')
+
+    user = await db.users.find_one({'username': username})
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+
+    response = await async_kindo_api.call_kindo_api(model='azure/gpt-4o', messages=_recommended_prompts_messages(user),
+                                                    max_tokens=150, route="recommended_prompts")
+    if isinstance(response, dict):
+        logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
+        return JSONResponse({"error": "Failed to fetch recommendations from Kindo AI"}, status_code=500)
+
+    content = response.json()['choices'][0]['message']['content']
+    return JSONResponse({"recommendations": _parse_recommendations(content)})
+
+
+async def stream_slides(request):
+    """
+    Server-Sent Events stream of a course's slides, see app.stream_slides.
+    Waiting for the next slide holds no thread, so idle streams are cheap.
+    """
+    course_id = request.path_params['course_id']
+
+    # Subscribe before reading the stored slides so no slide falls in between
+    subscription = slide_events.subscribe_async(course_id, db.slide_events)
+    course_data = await run_in_threadpool(course_repository.get_status, course_id)
+
+    if not course_data:
+        await subscription.close()
+        return JSONResponse({"error": "Course not found."}, status_code=404)
+
+    async def events():
+        total_slides = course_data.get("totalSlides")
+        # Slide numbers already sent, a resumed course fills in its missing slides out of order
+        sent = set()
+        deadline = time.monotonic() + Config.SLIDE_STREAM_TIMEOUT
+        try:
+            yield _sse("status", {"courseId": course_id, "totalSlides": total_slides,
+                                  "provisional": course_data.get("totalSlidesProvisional", False)})
+            for slide_data in await run_in_threadpool(course_repository.get_slides, course_id):
+                yield _sse("slide", slide_data)
+                sent.add(slide_data["slideNumber"])
+
+            while len(sent) < total_slides and time.monotonic() < deadline:
+                event = await subscription.get(timeout=Config.SLIDE_STREAM_HEARTBEAT)
+                if event is None:
+                    job = await db.generation_jobs.find_one({"_id": course_id}, {"status": 1})
+                    if job and job["status"] == JobQueue.FAILED:
+                        yield _sse("error", {"error": "Course generation failed."})
+                        return
+                    yield ": keep-alive\n\n"
+                elif event["type"] == "status":
+                    total_slides = event["totalSlides"]
+                    yield _sse("status", {"courseId": course_id, "totalSlides": total_slides,
+                                          "provisional": event.get("provisional", False)})
+                elif event["type"] == "slide" and event["slide"]["slideNumber"] not in sent:
+                    yield _sse("slide", event["slide"])
+                    sent.add(event["slide"]["slideNumber"])
+
+            if len(sent) >= total_slides:
+                yield _sse("complete", {"courseId": course_id, "slidesGenerated": len(sent)})
+        finally:
+            await subscription.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def generate_tts(request):
+    data = await request.json()
+    text = data.get('text')
+
+    # Truncate text to 1000 characters if necessary
+    if text:
+        text = text[:1000]
+
+    if not text:
+        return JSONResponse({"error": "Text is required."}, status_code=400)
+
+    # Clients pick a bitrate profile, e.g. a lower one on mobile data
+    profile = data.get('profile')
+    try:
+        voice_params = async_tts.params_for(profile)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # Reuse audio already voiced with the same text and voice settings
+    key = AssetStore.audio_key(voice_params, text)
+    existing_url = await run_in_threadpool(asset_store.lookup, key)
+    if existing_url:
+        return JSONResponse({"mp3_url": existing_url})
+
+    audio_content = await async_tts.generate_audio(text, profile=profile)
+    if audio_content is None:
+        return JSONResponse({"error": "Failed to generate audio."}, status_code=500)
+
+    # The Firebase SDK is blocking, upload on a worker thread
+    mp3_url = await run_in_threadpool(_upload_audio_asset, Asset(key, audio_content, None))
+    return JSONResponse({"mp3_url": mp3_url})
+
+
+async def stream_tts(request):
+    # Text comes from the JSON body, or the query string so audio elements can use the URL directly
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    text = (data or {}).get('text') or request.query_params.get('text')
+
+    if text:
+        text = text[:1000]
+
+    if not text:
+        return JSONResponse({"error": "Text is required."}, status_code=400)
+
+    profile = (data or {}).get('profile') or request.query_params.get('profile')
+    try:
+        voice_params = async_tts.params_for(profile)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # Already voiced, let the client fetch the stored file
+    key = AssetStore.audio_key(voice_params, text)
+    existing_url = await run_in_threadpool(asset_store.lookup, key)
+    if existing_url:
+        return RedirectResponse(existing_url, status_code=302)
+
+    audio_chunks = await async_tts.stream_audio(text, profile=profile)
+    if audio_chunks is None:
+        return JSONResponse({"error": "Failed to generate audio."}, status_code=500)
+
+    # Stream to the client while a background upload stores the same bytes for reuse
+    return StreamingResponse(atee_to_background(audio_chunks, _audio_stream_persister(key)),
+                             media_type="audio/mpeg")
+
+
+async def ask_question(request):
+    data = await request.json()
+    question = data.get('question')
+    course_id = data.get('courseId')
+
+    course_text_data = await db.course_text.find_one({"courseId": course_id})
+    if not course_text_data:
+        return JSONResponse({"error": "Course not found."}, status_code=404)
+
+    # Chunking and ranking the course text is CPU work, keep it off the event loop
+    messages = await run_in_threadpool(_ask_question_messages, question, course_text_data)
+    response = await async_kindo_api.call_kindo_api(model='azure/gpt-4o', messages=messages, max_tokens=2000,
+                                                    route="ask_question")
+    if isinstance(response, dict):
+        logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
+        return JSONResponse({"error": "Failed to generate answer."}, status_code=500)
+
+    return JSONResponse({"answer": response.json()['choices'][0]['message']['content']})
+
+
+async def ask_question_stream(request):
+    """
+    Streams the answer as Server-Sent Events, see app.ask_question_stream.
+    """
+    data = await request.json()
+    question = data.get('question')
+    course_id = data.get('courseId')
+
+    course_text_data = await db.course_text.find_one({"courseId": course_id})
+    if not course_text_data:
+        return JSONResponse({"error": "Course not found."}, status_code=404)
+
+    messages = await run_in_threadpool(_ask_question_messages, question, course_text_data)
+    deltas = await async_kindo_api.stream_kindo_api(model='azure/gpt-4o', messages=messages, max_tokens=2000,
+                                                    route="ask_question")
+    if isinstance(deltas, dict):
+        logger.error("API call failed", extra={"error": deltas['error'], "details": deltas.get('details')})
+        return JSONResponse({"error": "Failed to generate answer."}, status_code=500)
+
+    async def events():
+        answer = []
+        try:
+            async for delta in deltas:
+                answer.append(delta)
+                yield _sse("token", {"delta": delta})
+        except Exception:
+            logger.exception("Answer stream failed")
+            yield _sse("error", {"error": "Failed to generate answer."})
+            return
+        yield _sse("done", {"answer": "".join(answer)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def generate_quiz(request):
+    data = await request.json()
+    course_id = data.get('courseId')
+    username = data.get('username')
+
+    # Serve a precomputed question when the course's bank has one (unseen by the user if given)
+    quiz = await run_in_threadpool(quiz_bank.next_question, course_id, username)
+    if quiz:
+        return JSONResponse({"quiz": quiz})
+
+    course_text_data = await db.course_text.find_one({"courseId": course_id})
+    if not course_text_data:
+        return JSONResponse({"error": "Course not found."}, status_code=404)
+
+    messages = await run_in_threadpool(_quiz_messages, course_text_data)
+    response = await async_kindo_api.call_kindo_api(model='azure/gpt-4o', messages=messages, max_tokens=2000,
+                                                    route="quiz")
+    if isinstance(response, dict):
+        logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
+        return JSONResponse({"error": "Failed to generate quiz."}, status_code=500)
+
+    quiz = _parse_quiz(response.json()['choices'][0]['message']['content'])
+    if quiz is None:
+        return JSONResponse({"error": "Failed to generate quiz. Malformed LLM Response"}, status_code=500)
+
+    return JSONResponse({"quiz": quiz})
+
+
+def _timed(path, endpoint):
+    # Same request histogram as the Flask routes, labelled by the route template
+    async def timed(request):
+        # Each request runs in its own task, so this only marks this request's upstream calls
+        rate_limiter.set_priority(rate_limiter.INTERACTIVE)
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_request(request.method, path, status, time.perf_counter() - start)
+    return timed
+
+
+def _route(path, endpoint, methods):
+    return Route(path, _timed(path, endpoint), methods=methods)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await close_async_transports()
+    motor_client.close()
+
+
+app = Starlette(
+    routes=[
+        _route('/api/recommended-prompts', get_recommended_prompts, methods=['GET']),
+        _route('/api/slide-stream/{course_id}', stream_slides, methods=['GET']),
+        _route('/generate-tts', generate_tts, methods=['POST']),
+        _route('/generate-tts/stream', stream_tts, methods=['GET', 'POST']),
+        _route('/api/ask-question', ask_question, methods=['POST']),
+        _route('/api/ask-question/stream', ask_question_stream, methods=['POST']),
+        _route('/api/generate-quiz', generate_quiz, methods=['POST']),
+        # Everything else, e.g. signup, login and generation jobs, is served by Flask
+        Mount('/', app=WSGIMiddleware(flask_app, workers=Config.ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    if Config.ASGI_WORKERS > 1:
+        # Counts left by an earlier run would be added to this one's
+        for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+            os.remove(path)
+    uvicorn.run("asgi:app", host=Config.ASGI_HOST, port=Config.ASGI_PORT, workers=Config.ASGI_WORKERS)
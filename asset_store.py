@@ -0,0 +1,84 @@
+# asset_store.py
+from collections import namedtuple
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# A generated or reused asset moving through the slide pipeline.
+# New assets carry data and no url yet; reused assets carry only the url.
+Asset = namedtuple("Asset", ["key", "data", "url"])
+
+
+class AssetStore:
+    """
+    Content-addressed record of generated media already uploaded to Firebase.
+
+    Images are keyed by hash(model, prompt) and audio by hash(voice params, text),
+    so identical requests reuse the existing public URL instead of synthesizing and uploading again.
+    """
+
+    IMAGE = "image"
+    AUDIO = "audio"
+
+    def __init__(self, collection):
+        """
+        Initializes the AssetStore.
+
+        Parameters:
+            collection (Collection): MongoDB collection mapping asset keys to public URLs.
+        """
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index("kind")
+
+    @staticmethod
+    def image_key(model_name, prompt):
+        return AssetStore._hash(AssetStore.IMAGE, {"model": model_name, "prompt": prompt})
+
+    @staticmethod
+    def audio_key(voice_params, text):
+        return AssetStore._hash(AssetStore.AUDIO, {"voice": voice_params, "text": text})
+
+    def lookup(self, key):
+        """
+        Returns the public URL stored for a key, or None if the asset is unknown.
+        """
+        try:
+            doc = self.collection.find_one({"_id": key}, {"url": 1})
+        except Exception as e:
+            logger.warning("Asset lookup failed: %s", e)
+            return None
+        return doc["url"] if doc else None
+
+    def lookup_image(self, key):
+        """
+        Returns (url, variants) stored for an image key, variants being None for images
+        uploaded without resized copies, or (None, None) if the image is unknown.
+        """
+        try:
+            doc = self.collection.find_one({"_id": key}, {"url": 1, "variants": 1})
+        except Exception as e:
+            logger.warning("Asset lookup failed: %s", e)
+            return None, None
+        if not doc:
+            return None, None
+        return doc["url"], doc.get("variants")
+
+    def record(self, key, kind, url, variants=None):
+        fields = {"kind": kind, "url": url, "createdAt": datetime.now(timezone.utc)}
+        if variants:
+            fields["variants"] = variants
+        try:
+            self.collection.update_one({"_id": key}, {"$set": fields}, upsert=True)
+        except Exception as e:
+            logger.warning("Asset record failed: %s", e)
+
+    @staticmethod
+    def _hash(kind, parts):
+        payload = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+        return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
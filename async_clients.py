@@ -0,0 +1,403 @@
+# async_clients.py
+# asyncio counterparts of the provider clients, used by the ASGI app (asgi.py).
+# They reuse the request building, voice settings and cache helpers of the sync clients
+# and share each upstream's circuit breaker with its sync transport.
+import asyncio
+import json
+import logging
+import random
+import threading
+
+import httpx
+
+from config import Config
+from http_transport import CircuitOpenError, HttpTransport, get_transport
+from rate_limiter import get_limiter
+from kindo_api import KindoAPI, _completion_text
+import metrics
+from tts import TTS
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHttpTransport:
+    """
+    httpx.AsyncClient for one upstream provider with the retry, backoff and circuit
+    breaker behaviour of HttpTransport.
+
+    Waiting on a slow upstream costs a coroutine instead of a thread, so one event loop
+    can hold thousands of outstanding requests; max_connections bounds the sockets and
+    further requests wait for a free connection.
+    """
+
+    RETRY_STATUSES = HttpTransport.RETRY_STATUSES
+
+    def __init__(self, name, max_connections=500, connect_timeout=5, read_timeout=120,
+                 max_retries=3, backoff_base=0.5, backoff_max=30, breaker=None):
+        """
+        Initializes the AsyncHttpTransport.
+
+        Parameters:
+            name (str): Name of the upstream, used in log messages.
+            max_connections (int): Maximum number of open connections.
+            connect_timeout (float): Seconds to wait for a connection.
+            read_timeout (float): Seconds to wait between bytes of the response.
+            max_retries (int): Retries after the first attempt for transient failures.
+            backoff_base (float): Base delay in seconds for exponential backoff.
+            backoff_max (float): Upper bound for a single backoff delay.
+            breaker (CircuitBreaker): Circuit breaker for this upstream.
+        """
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or get_transport(name).breaker
+        self.client = httpx.AsyncClient(
+            # No pool timeout: requests queue for a connection rather than fail
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def post(self, url, stream=False, model=None, **kwargs):
+        return await self.request("POST", url, stream=stream, model=model, **kwargs)
+
+    async def request(self, method, url, stream=False, model=None, **kwargs):
+        """
+        Sends a request, retrying transient failures.
+
+        Parameters:
+            stream (bool): Return before reading the body; the caller must aclose() the response.
+            model (str): Model the request is for, selects a model's own rate limit.
+
+        Returns:
+            Response: The last response received, which may still carry an error status.
+
+        Raises:
+            CircuitOpenError: If the upstream's circuit is open.
+            RateLimitedError: If the upstream's rate limit stayed saturated.
+            TransportError: If every attempt failed without a response.
+        """
+        limiter = get_limiter()
+        attempt = 0
+        while True:
+            try:
+                response = await self._attempt(limiter, method, url, stream, model, kwargs)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                metrics.count_retry(self.name, type(e).__name__)
+                logger.warning("%s request failed (%s), retrying in %.2fs", self.name, e, delay)
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    return response
+                if attempt >= self.max_retries:
+                    return response
+                delay = HttpTransport._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                else:
+                    limiter.pause(self.name, model, min(delay, self.backoff_max))
+                delay = min(delay, self.backoff_max)
+                metrics.count_retry(self.name, f"http_{response.status_code}")
+                logger.warning("%s returned %s, retrying in %.2fs", self.name, response.status_code, delay)
+                await response.aclose()
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _attempt(self, limiter, method, url, stream, model, kwargs):
+        # Same order as HttpTransport._attempt: limiter slot, then breaker, and the
+        # half-open trial is released if the call is cancelled before an outcome
+        request = self.client.build_request(method, url, **kwargs)
+        async with limiter.acquire_async(self.name, model):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {self.name}")
+            recorded = False
+            try:
+                response = await self.client.send(request, stream=stream)
+                if response.status_code in self.RETRY_STATUSES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                recorded = True
+                return response
+            except Exception:
+                self.breaker.record_failure()
+                recorded = True
+                raise
+            finally:
+                if not recorded:
+                    self.breaker.release_trial()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _backoff(self, attempt):
+        # Full jitter: a random delay up to the exponential bound
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_async_transport(name):
+    """
+    Returns the shared async transport for an upstream, creating it from Config on first use.
+    Must be called from the event loop that will use it.
+    """
+    with _transports_lock:
+        if name not in _transports:
+            _transports[name] = AsyncHttpTransport(
+                name,
+                max_connections=Config.ASYNC_HTTP_MAX_CONNECTIONS,
+                connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+                read_timeout=Config.HTTP_READ_TIMEOUT,
+                max_retries=Config.HTTP_MAX_RETRIES,
+                backoff_base=Config.HTTP_BACKOFF_BASE,
+                backoff_max=Config.HTTP_BACKOFF_MAX,
+            )
+        return _transports[name]
+
+
+async def close_async_transports():
+    with _transports_lock:
+        transports = list(_transports.values())
+        _transports.clear()
+    for transport in transports:
+        await transport.aclose()
+
+
+class AsyncKindoAPI(KindoAPI):
+    """
+    KindoAPI whose calls are coroutines. Cache lookups and writes run in a thread
+    since the MongoDB tier of LLMCache is blocking.
+    """
+
+    def __init__(self, api_key, transport=None, cache=None, cache_routes=None, usage=None, base_url=None):
+        """
+        Parameters:
+            api_key (str): The Kindo API key.
+            transport (AsyncHttpTransport): Optional transport, the shared async "kindo" one by default.
+            cache (LLMCache): Optional response cache.
+            cache_routes (iterable): Routes allowed to use the cache, every named route if None.
+            usage (TokenUsage): Optional counters to share, e.g. the sync client's.
+            base_url (str): Optional chat completions URL, e.g. of a stand-in server.
+        """
+        super().__init__(api_key, transport=transport or get_async_transport("kindo"),
+                         cache=cache, cache_routes=cache_routes, base_url=base_url)
+        if usage is not None:
+            self.usage = usage
+
+    async def call_kindo_api(self, model, messages, max_tokens, route=None, **kwargs):
+        """
+        Calls the chat completions endpoint, see KindoAPI.call_kindo_api.
+
+        Returns:
+            Response: The successful (or cached) response.
+            dict: {"error": ..., "details": ...} if the request fails.
+        """
+        cache_key = None
+        if self._cache_enabled(route):
+            cache_key = self.cache.make_key(model, messages, max_tokens, kwargs)
+            body = await asyncio.to_thread(self.cache.get, cache_key, route)
+            if body is not None:
+                self.usage.record(model, route, cached=True)
+                return self._cached_response(body)
+
+        headers = {
+            "api-key": self.api_key,
+            "content-type": "application/json",
+        }
+        data = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+        }
+        data.update(kwargs)
+
+        try:
+            with metrics.track_upstream("kindo", model) as call:
+                response = await self.transport.post(self.base_url, model=model, headers=headers, json=data)
+                call.bytes = len(response.content)
+                response.raise_for_status()
+
+            body = response.json()
+            self.usage.record(model, route, body.get("usage"), messages=messages,
+                              completion=_completion_text(body))
+            if cache_key is not None:
+                await asyncio.to_thread(self.cache.set, cache_key, route, model, body)
+            return response
+
+        except httpx.HTTPStatusError as http_err:
+            error_details = _json_or_empty(response)
+            logger.error("HTTP error occurred: %s", http_err, extra={"details": error_details})
+            return {"error": str(http_err), "details": error_details}
+
+        except Exception as err:
+            logger.error("An error occurred: %s", err)
+            return {"error": str(err)}
+
+    async def stream_kindo_api(self, model, messages, max_tokens, route=None, **kwargs):
+        """
+        Calls the chat completions endpoint with streaming enabled, see KindoAPI.stream_kindo_api.
+
+        Returns:
+            async generator: The content deltas (str) as they arrive, if the request succeeds.
+            dict: {"error": ..., "details": ...} if the request fails.
+        """
+        cache_key = None
+        if self._cache_enabled(route):
+            cache_key = self.cache.make_key(model, messages, max_tokens, kwargs)
+            body = await asyncio.to_thread(self.cache.get, cache_key, route)
+            if body is not None:
+                self.usage.record(model, route, cached=True)
+                return _aiter_once(body['choices'][0]['message']['content'])
+
+        headers = {
+            "api-key": self.api_key,
+            "content-type": "application/json",
+            "accept": "text/event-stream",
+        }
+        data = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        data.update(kwargs)
+
+        try:
+            # Timed until the response headers, the body streams on
+            with metrics.track_upstream("kindo", model):
+                response = await self.transport.post(self.base_url, stream=True, model=model, headers=headers, json=data)
+                response.raise_for_status()
+        except httpx.HTTPStatusError as http_err:
+            await response.aread()
+            await response.aclose()
+            error_details = _json_or_empty(response)
+            logger.error("HTTP error occurred: %s", http_err, extra={"details": error_details})
+            return {"error": str(http_err), "details": error_details}
+        except Exception as err:
+            logger.error("An error occurred: %s", err)
+            return {"error": str(err)}
+
+        return self._aiter_deltas(response, model, route, cache_key, messages)
+
+    async def _aiter_deltas(self, response, model, route, cache_key, messages):
+        content = []
+        completed = False
+        usage_reported = False
+        try:
+            async for line in response.aiter_lines():
+                # Server-Sent Events: only "data:" lines carry chunks
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    completed = True
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("usage"):
+                    self.usage.record(model, route, chunk["usage"])
+                    usage_reported = True
+                for choice in chunk.get("choices", []):
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        content.append(delta)
+                        yield delta
+                    # The answer is whole once the model says why it stopped
+                    if choice.get("finish_reason"):
+                        completed = True
+            # A body that just ends (no [DONE] or finish_reason) is a truncated answer, never cached
+        finally:
+            await response.aclose()
+            if not usage_reported:
+                # Not every stream ends with a usage chunk, count what was received
+                self.usage.record(model, route, messages=messages, completion="".join(content))
+
+        if completed and cache_key is not None:
+            body = {"choices": [{"message": {"role": "assistant", "content": "".join(content)}}]}
+            await asyncio.to_thread(self.cache.set, cache_key, route, model, body)
+
+
+class AsyncTTS(TTS):
+    """
+    TTS whose requests are coroutines. Voice settings are those of TTS, so audio asset
+    keys match the ones computed by the sync client.
+    """
+
+    def __init__(self, api_token, transport=None, stream_url=None, bitrate_profiles=None, default_profile=None):
+        super().__init__(api_token, transport=transport or get_async_transport("tts"), stream_url=stream_url,
+                         bitrate_profiles=bitrate_profiles, default_profile=default_profile)
+
+    async def generate_audio(self, text, profile=None):
+        """
+        Generate audio using the TTS API.
+
+        Returns:
+            bytes: The audio content if successful.
+            None: If the request fails.
+        """
+        voice_params = self.params_for(profile)
+        try:
+            with metrics.track_upstream("tts", voice_params['VoiceId']) as call:
+                response = await self.transport.post(
+                    self.stream_url,
+                    model=voice_params['VoiceId'],
+                    headers={'Authorization': f'Bearer {self.api_token}'},
+                    json={'Text': text, **voice_params},
+                )
+                response.raise_for_status()
+                call.bytes = len(response.content)
+            return response.content
+        except Exception as e:
+            logger.error("Error generating audio: %s", e)
+            return None
+
+    async def stream_audio(self, text, chunk_size=16 * 1024, profile=None):
+        """
+        Stream audio from the TTS API without buffering the whole file.
+
+        Returns:
+            async generator: MP3 chunks as they arrive, if the request succeeds.
+            None: If the request fails.
+        """
+        voice_params = self.params_for(profile)
+        try:
+            with metrics.track_upstream("tts", voice_params['VoiceId']):
+                response = await self.transport.post(
+                    self.stream_url,
+                    model=voice_params['VoiceId'],
+                    stream=True,
+                    headers={'Authorization': f'Bearer {self.api_token}'},
+                    json={'Text': text, **voice_params},
+                )
+                if response.is_error:
+                    await response.aclose()
+                response.raise_for_status()
+        except Exception as e:
+            logger.error("Error streaming audio: %s", e)
+            return None
+
+        async def chunks():
+            try:
+                async for chunk in response.aiter_bytes(chunk_size=chunk_size):
+                    if chunk:
+                        yield chunk
+            finally:
+                await response.aclose()
+
+        return chunks()
+
+
+def _json_or_empty(response):
+    try:
+        return response.json() if response.content else {}
+    except (ValueError, httpx.ResponseNotRead):
+        return {}
+
+
+async def _aiter_once(value):
+    yield value
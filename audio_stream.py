@@ -0,0 +1,168 @@
+# audio_stream.py
+import collections
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkPipe:
+    """
+    File-like pipe between a producer of byte chunks and a blocking reader.
+
+    Writes never block: up to max_chunks are buffered in memory, and while the reader
+    is further behind, chunks spill to a temporary file, so a slow reader costs disk
+    space instead of holding up the producer. The reader sees EOF after close() and an
+    error after abort().
+    """
+
+    def __init__(self, max_chunks=64):
+        self.max_chunks = max_chunks
+        self._chunks = collections.deque()
+        # Overflow written at _spill_size and read from _spill_read, reused once drained
+        self._spill = None
+        self._spill_read = 0
+        self._spill_size = 0
+        self._closed = False
+        self._ready = threading.Condition()
+        self._buffer = bytearray()
+        self._position = 0
+        self._eof = False
+        self._aborted = threading.Event()
+
+    def write(self, chunk):
+        with self._ready:
+            if self._aborted.is_set() or self._closed:
+                return
+            # Once spilling, keep spilling until the reader catches up, so chunks stay in order
+            if self._spill_read < self._spill_size or len(self._chunks) >= self.max_chunks:
+                if self._spill is None:
+                    self._spill = tempfile.TemporaryFile()
+                self._spill.seek(self._spill_size)
+                self._spill.write(chunk)
+                self._spill_size += len(chunk)
+            else:
+                self._chunks.append(chunk)
+            self._ready.notify()
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+
+    def abort(self):
+        with self._ready:
+            self._aborted.set()
+            self._discard_spill()
+            self._ready.notify()
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            with self._ready:
+                while not (self._aborted.is_set() or self._chunks or self._spill_read < self._spill_size
+                           or self._closed):
+                    self._ready.wait()
+                if self._aborted.is_set():
+                    raise IOError("Stream aborted")
+                if self._chunks:
+                    self._buffer += self._chunks.popleft()
+                elif self._spill_read < self._spill_size:
+                    self._spill.seek(self._spill_read)
+                    data = self._spill.read(min(self._spill_size - self._spill_read, 1 << 16))
+                    self._spill_read += len(data)
+                    self._buffer += data
+                    if self._spill_read == self._spill_size:
+                        self._spill_read = self._spill_size = 0
+                else:
+                    self._eof = True
+                    self._discard_spill()
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._position += len(data)
+        return data
+
+    def _discard_spill(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            self._spill_read = self._spill_size = 0
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        # Only a no-op seek is possible on a pipe
+        if (whence == 0 and offset == self._position) or (whence == 1 and offset == 0):
+            return self._position
+        raise IOError("ChunkPipe is not seekable")
+
+
+def tee_to_background(chunks, persist, max_chunks=64):
+    """
+    Yields every chunk of a stream while a background thread persists a copy of it.
+
+    Parameters:
+        chunks (iterable): The source byte chunks.
+        persist (callable): Called on a background thread with a readable ChunkPipe.
+        max_chunks (int): Chunks buffered in memory for the background reader, more spill to disk.
+
+    Returns:
+        generator: The source chunks, unchanged.
+    """
+    pipe = ChunkPipe(max_chunks=max_chunks)
+    _start_persist(pipe, persist)
+
+    completed = False
+    try:
+        for chunk in chunks:
+            pipe.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            pipe.close()
+        else:
+            # Client went away or the source failed, do not persist a partial file
+            pipe.abort()
+
+
+async def atee_to_background(chunks, persist, max_chunks=64):
+    """
+    Async version of tee_to_background for an async iterable of chunks.
+
+    Like the sync version, a background reader that falls max_chunks behind makes the
+    pipe spill to a temporary file rather than hold up the stream.
+
+    Returns:
+        async generator: The source chunks, unchanged.
+    """
+    pipe = ChunkPipe(max_chunks=max_chunks)
+    _start_persist(pipe, persist)
+
+    completed = False
+    try:
+        async for chunk in chunks:
+            pipe.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            pipe.close()
+        else:
+            pipe.abort()
+
+
+def _start_persist(pipe, persist):
+    def _persist():
+        try:
+            persist(pipe)
+        except Exception:
+            logger.exception("Background persist failed")
+            pipe.abort()
+
+    thread = threading.Thread(target=_persist, name="stream-persist", daemon=True)
+    thread.start()
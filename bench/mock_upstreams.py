@@ -0,0 +1,245 @@
+# bench/mock_upstreams.py
+# Local stand-ins for the Kindo, Hugging Face and Unreal Speech APIs, with configurable
+# latency distributions, error rates and payload sizes.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import copy
+import json
+import math
+import random
+import re
+import threading
+import time
+
+# Latencies are lognormal, given as their median and 95th percentile in milliseconds
+DEFAULT_PROFILE = {
+    "kindo": {"latency_ms": [800, 3000], "error_rate": 0.0, "paragraphs": 8, "answer_words": 60},
+    "huggingface": {"latency_ms": [3000, 9000], "error_rate": 0.0, "bytes": 400 * 1024},
+    "tts": {"latency_ms": [500, 1500], "error_rate": 0.0, "bytes": 120 * 1024, "chunk_bytes": 16 * 1024},
+}
+
+WORDS = ("network packet exploit firewall cipher token session kernel buffer payload "
+         "signature audit phishing malware patch privilege sandbox entropy hash certificate").split()
+
+
+class Upstream:
+    """
+    Samples latencies, errors and payloads for one stand-in, from its own seeded generator.
+    """
+
+    def __init__(self, name, settings, seed, time_scale=1.0):
+        self.name = name
+        self.settings = settings
+        self.time_scale = time_scale
+        self._random = random.Random(f"{seed}:{name}")
+        self._lock = threading.Lock()
+        median, p95 = settings["latency_ms"]
+        self._mu = math.log(max(median, 1e-3))
+        # 1.645 standard deviations separate the median from the 95th percentile
+        self._sigma = max(0.0, (math.log(max(p95, 1e-3)) - self._mu) / 1.645)
+        self.calls = 0
+        self.errors = 0
+
+    def sample(self):
+        """
+        Returns (latency in seconds, whether the call fails) for the next call.
+        """
+        with self._lock:
+            latency = self._random.lognormvariate(self._mu, self._sigma) / 1000 * self.time_scale
+            failed = self._random.random() < self.settings.get("error_rate", 0.0)
+            self.calls += 1
+            self.errors += failed
+        return latency, failed
+
+    def words(self, count):
+        with self._lock:
+            return " ".join(self._random.choice(WORDS) for _ in range(count))
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors}
+
+
+class MockUpstreams:
+    """
+    Serves all stand-ins from one threaded HTTP server:
+        POST /kindo/v1/chat/completions   (JSON, or SSE when "stream" is set)
+        POST /hf/models/<model>           (PNG-like bytes)
+        POST /tts/stream                  (MP3-like bytes)
+        GET  /stats                       (calls and injected errors per upstream)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, profile=None, seed=1, time_scale=1.0):
+        profile = merge_profile(profile)
+        self.upstreams = {name: Upstream(name, settings, seed, time_scale) for name, settings in profile.items()}
+        self._payloads = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def urls(self):
+        """
+        Returns the app settings pointing each client at its stand-in.
+        """
+        return {
+            "KINDO_BASE_URL": f"{self.base_url}/kindo/v1/chat/completions",
+            "HUGGING_FACE_BASE_URL": f"{self.base_url}/hf/models",
+            "TTS_STREAM_URL": f"{self.base_url}/tts/stream",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-upstreams", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        return {name: upstream.stats() for name, upstream in self.upstreams.items()}
+
+    def payload(self, header, size):
+        # Random bytes are generated once per size, the content does not matter to the app
+        key = (header, size)
+        if key not in self._payloads:
+            body = random.Random(size).randbytes(max(0, size - len(header)))
+            self._payloads[key] = header + body
+        return self._payloads[key]
+
+    def completion_text(self, upstream, prompt):
+        # Answers shaped like the real model's for the prompts the app sends
+        if "JSON array" in prompt and "image generative model" in prompt:
+            slides = [int(number) for number in re.findall(r"^Slide (\d+):", prompt, re.MULTILINE)]
+            return json.dumps([{"slide": number, "prompt": upstream.words(12)} for number in slides])
+        if "JSON array" in prompt:
+            match = re.search(r"Create (\d+) multiple choice", prompt)
+            count = int(match.group(1)) if match else 5
+            return json.dumps([
+                {"question": f"{upstream.words(8)}?",
+                 "options": [f"{letter}. {upstream.words(3)}" for letter in "ABCD"],
+                 "answer": "ABCD"[i % 4]}
+                for i in range(count)
+            ])
+        if "Multiple choice quiz" in prompt:
+            options = "\n".join(f"{letter}. {upstream.words(3)}" for letter in "ABCD")
+            return f"{upstream.words(8)}?#{options}#B"
+        if "Generate a well designed course" in prompt:
+            paragraphs = upstream.settings.get("paragraphs", 8)
+            return "\n\n".join(upstream.words(20) for _ in range(paragraphs))
+        return upstream.words(upstream.settings.get("answer_words", 60))
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    self._send(200, "application/json", json.dumps(mock.stats()).encode())
+                else:
+                    self._send(404, "application/json", b'{"error": "not found"}')
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.startswith("/kindo/"):
+                    self._kindo(body)
+                elif self.path.startswith("/hf/models/"):
+                    self._binary("huggingface", "image/png", b"\x89PNG\r\n\x1a\n")
+                elif self.path.startswith("/tts/"):
+                    self._binary("tts", "audio/mpeg", b"ID3")
+                else:
+                    self._send(404, "application/json", b'{"error": "not found"}')
+
+            def _kindo(self, body):
+                upstream = mock.upstreams["kindo"]
+                if self._wait_or_fail(upstream):
+                    return
+                prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+                text = mock.completion_text(upstream, prompt)
+                usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4,
+                         "total_tokens": (len(prompt) + len(text)) // 4}
+                if body.get("stream"):
+                    events = [{"choices": [{"delta": {"content": word + " "}}]} for word in text.split(" ")]
+                    events.append({"choices": [], "usage": usage})
+                    payload = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+                    self._send(200, "text/event-stream", payload.encode())
+                    return
+                response = {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": usage}
+                self._send(200, "application/json", json.dumps(response).encode())
+
+            def _binary(self, name, content_type, header):
+                upstream = mock.upstreams[name]
+                if self._wait_or_fail(upstream):
+                    return
+                data = mock.payload(header, upstream.settings.get("bytes", 1024))
+                chunk_bytes = upstream.settings.get("chunk_bytes") or len(data) or 1
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                for start in range(0, len(data), chunk_bytes):
+                    self.wfile.write(data[start:start + chunk_bytes])
+
+            def _wait_or_fail(self, upstream):
+                latency, failed = upstream.sample()
+                time.sleep(latency)
+                if failed:
+                    self._send(503, "application/json", b'{"error": "injected failure"}')
+                return failed
+
+            def _send(self, status, content_type, data):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def merge_profile(overrides=None):
+    """
+    Returns DEFAULT_PROFILE with the given per-upstream settings applied on top.
+    """
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    for name, settings in (overrides or {}).items():
+        if name not in profile:
+            raise ValueError(f"Unknown upstream in profile: {name}")
+        profile[name].update(settings)
+    return profile
+
+
+def load_profile(path):
+    if not path:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the stand-in upstream servers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--profile", help="JSON file overriding DEFAULT_PROFILE settings per upstream.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplies every sampled latency.")
+    args = parser.parse_args()
+
+    mock = MockUpstreams(args.host, args.port, load_profile(args.profile), args.seed, args.time_scale)
+    for key, url in mock.urls().items():
+        print(f"{key}={url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
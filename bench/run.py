@@ -0,0 +1,404 @@
+# bench/run.py
+# Offline load test: starts the stand-in upstreams and the app against a local MongoDB,
+# drives the API at a fixed request rate and reports latency percentiles, throughput and
+# the app's peak memory. Compare a run with --baseline to catch regressions.
+#
+#   python -m bench.run --rps 5 --duration 60 --out bench_results.json
+#   python -m bench.run --rps 5 --duration 60 --baseline bench_results.json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from pymongo import MongoClient
+import requests
+
+from bench.mock_upstreams import MockUpstreams, load_profile, merge_profile
+from local_index import HashingEmbedding, build as build_local_index
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("generate", "slide_status", "slide", "ask", "quiz")
+DEFAULT_MIX = "generate=1,slide_status=4,slide=2,ask=2,quiz=1"
+# Polled courses may still be queued, a 404 there is the expected "not started yet" answer
+POLLING_SCENARIOS = ("slide_status", "slide")
+
+TOPICS = ["phishing defenses", "network segmentation", "password hashing", "TLS handshakes",
+          "incident response", "cloud IAM policies", "web application firewalls", "ransomware recovery"]
+
+QUESTIONS = ["What is the main idea?", "Why does this matter?", "How is it applied in practice?",
+             "What are the common mistakes?"]
+
+
+class Recorder:
+    """
+    Collects per-scenario latencies; latency is measured from the scheduled send time so
+    a saturated client or server shows up as latency rather than as a lower request rate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, scenario, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(scenario, []).append(seconds)
+            if not ok:
+                self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            scenarios = {
+                name: _latency_summary(samples, self.errors.get(name, 0), elapsed)
+                for name, samples in sorted(self.samples.items())
+            }
+            everything = [s for samples in self.samples.values() for s in samples]
+            total = _latency_summary(everything, sum(self.errors.values()), elapsed)
+        return scenarios, total
+
+
+class Driver:
+    """
+    The API calls of each scenario, sharing one connection pool.
+    """
+
+    def __init__(self, base_url, users, seed, timeout):
+        self.base_url = base_url
+        self.users = users
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=256)
+        self.session.mount("http://", adapter)
+        self.random = random.Random(seed)
+        self.courses = []
+        self._lock = threading.Lock()
+
+    def pick(self, values):
+        with self._lock:
+            return self.random.choice(values)
+
+    def course(self):
+        with self._lock:
+            return self.random.choice(self.courses)
+
+    def signup(self, username):
+        self.session.post(f"{self.base_url}/api/signup", json={
+            "username": username, "password": "bench", "name": username, "age": 30,
+            "language": "en", "working_professional": False,
+        }, timeout=self.timeout)
+
+    def start_generation(self, username=None):
+        response = self.session.post(f"{self.base_url}/api/start-presentation-generation", json={
+            "input": self.pick(TOPICS), "username": username or self.pick(self.users),
+        }, timeout=self.timeout)
+        if response.status_code == 202:
+            with self._lock:
+                self.courses.append(response.json()["courseId"])
+        return response
+
+    def wait_for_course(self, course_id, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.session.get(f"{self.base_url}/api/generation-job/{course_id}", timeout=self.timeout).json()
+            if job.get("status") == "done":
+                return
+            if job.get("status") == "failed":
+                raise RuntimeError(f"Seed course {course_id} failed to generate")
+            time.sleep(0.5)
+        raise TimeoutError(f"Seed course {course_id} did not finish within {timeout}s")
+
+    def run(self, scenario):
+        if scenario == "generate":
+            return self.start_generation()
+        if scenario == "slide_status":
+            return self.session.get(f"{self.base_url}/api/slide-status/{self.course()}", timeout=self.timeout)
+        if scenario == "slide":
+            return self.session.get(f"{self.base_url}/api/slide/{self.course()}/1", timeout=self.timeout)
+        if scenario == "ask":
+            return self.session.post(f"{self.base_url}/api/ask-question", json={
+                "courseId": self.course(), "question": self.pick(QUESTIONS),
+            }, timeout=self.timeout)
+        if scenario == "quiz":
+            return self.session.post(f"{self.base_url}/api/generate-quiz", json={
+                "courseId": self.course(), "username": self.pick(self.users),
+            }, timeout=self.timeout)
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name}, expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def schedule(rps, duration, mix, seed):
+    """
+    Returns the (offset in seconds, scenario) list of a run: evenly spaced sends with a
+    seeded scenario mix, so every run with the same arguments sends the same requests.
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    count = int(rps * duration)
+    return [(i / rps, rng.choices(names, weights)[0]) for i in range(count)]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def _latency_summary(samples, errors, elapsed):
+    ordered = sorted(samples)
+    ms = lambda value: None if value is None else round(value * 1000, 1)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput_rps": round((len(ordered) - errors) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": ms(percentile(ordered, 0.50)),
+        "p95_ms": ms(percentile(ordered, 0.95)),
+        "p99_ms": ms(percentile(ordered, 0.99)),
+    }
+
+
+def build_corpus_index(index_dir, documents=200, seed=1):
+    os.makedirs(index_dir, exist_ok=True)
+    rng = random.Random(seed)
+    words = " ".join(TOPICS).split() + "attack defense control risk threat key protocol".split()
+    corpus_path = os.path.join(index_dir, "corpus.jsonl")
+    with open(corpus_path, "w", encoding="utf-8") as f:
+        for _ in range(documents):
+            f.write(json.dumps({"text": " ".join(rng.choice(words) for _ in range(120))}) + "\n")
+    build_local_index(corpus_path, index_dir, HashingEmbedding(), "hashing")
+
+
+def start_app(args, env):
+    if args.server == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+                   "--port", str(args.port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--host", "127.0.0.1",
+                   "--port", str(args.port), "--no-reload", "--no-debugger", "--with-threads"]
+    return subprocess.Popen(command, cwd=REPO_DIR, env=env)
+
+
+def wait_until_up(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with status {process.returncode} during startup")
+        try:
+            requests.get(f"{base_url}/metrics", timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise TimeoutError(f"App did not start within {timeout}s")
+
+
+def peak_memory_mb(pid):
+    # VmHWM is the process's peak resident set size (Linux only)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def generation_summary(db, started_after):
+    # Course generation time from the job queue's own timestamps
+    durations = []
+    statuses = {}
+    for job in db.generation_jobs.find({"createdAt": {"$gte": started_after}}):
+        statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+        if job.get("finishedAt") and job["status"] == "done":
+            durations.append((job["finishedAt"] - job["createdAt"]).total_seconds())
+    summary = _latency_summary(durations, statuses.get("failed", 0), 0)
+    summary.pop("throughput_rps")
+    summary["statuses"] = statuses
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions of results against baseline: p95/p99 latencies more than
+    tolerance higher, or throughput more than tolerance lower.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if before.get(key) and current.get(key) and current[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {before[key]} -> {current[key]}")
+        if before.get("throughput_rps") and current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name} throughput_rps: {before['throughput_rps']} -> {current['throughput_rps']}")
+    if baseline.get("peak_memory_mb") and results.get("peak_memory_mb") \
+            and results["peak_memory_mb"] > baseline["peak_memory_mb"] * (1 + tolerance):
+        regressions.append(f"peak_memory_mb: {baseline['peak_memory_mb']} -> {results['peak_memory_mb']}")
+    return regressions
+
+
+def print_report(results):
+    print(f"\n{'scenario':<14}{'requests':>10}{'errors':>8}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(results["scenarios"].items()) + [("total", results["total"])]
+    for name, row in rows:
+        print(f"{name:<14}{row['requests']:>10}{row['errors']:>8}{row['throughput_rps']:>8}"
+              f"{str(row['p50_ms']):>10}{str(row['p95_ms']):>10}{str(row['p99_ms']):>10}")
+    generation = results["generation"]
+    print(f"\ncourse generation: {generation['statuses']}, p50 {generation['p50_ms']} ms, "
+          f"p95 {generation['p95_ms']} ms, p99 {generation['p99_ms']} ms")
+    print(f"peak app memory: {results['peak_memory_mb']} MB")
+    print(f"upstream calls: {results['upstreams']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against stand-in upstreams.")
+    parser.add_argument("--rps", type=float, default=5.0, help="Target request rate.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of load.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/morpheus_bench",
+                        help="Local MongoDB database, dropped at the start of the run.")
+    parser.add_argument("--profile", help="JSON file overriding the stand-ins' latency, error and size settings.")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplies every stand-in latency.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=256, help="Maximum requests in flight.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout.")
+    parser.add_argument("--drain", type=float, default=300.0,
+                        help="Seconds to wait after the load for queued generations to finish.")
+    parser.add_argument("--out", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression.")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    profile = merge_profile(load_profile(args.profile))
+    mock = MockUpstreams(profile=profile, seed=args.seed, time_scale=args.time_scale).start()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    mongo = MongoClient(args.mongo_uri)
+    db = mongo.get_default_database()
+    mongo.drop_database(db.name)
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as work_dir:
+        index_dir = os.path.join(work_dir, "index")
+        build_corpus_index(index_dir, seed=args.seed)
+
+        env = dict(os.environ, **mock.urls(),
+                   MONGO_URI=args.mongo_uri,
+                   STORAGE_BACKEND="local",
+                   LOCAL_STORAGE_DIR=os.path.join(work_dir, "storage"),
+                   LOCAL_STORAGE_BASE_URL=f"{base_url}/files",
+                   RETRIEVER_BACKEND="local",
+                   EMBEDDING_BACKEND="hashing",
+                   LOCAL_INDEX_DIR=index_dir,
+                   KINDO_API_KEY="bench", HUGGING_FACE_API_KEY="bench", TTS_TOKEN="bench",
+                   # Every request should reach the stand-ins for comparable runs
+                   LLM_CACHE_ENABLED="false",
+                   JOB_MAX_PER_USER="100000", JOB_QUEUE_MAX="100000",
+                   LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+        app_process = start_app(args, env)
+        try:
+            wait_until_up(base_url, app_process)
+            driver = Driver(base_url, [f"bench-user-{i}" for i in range(args.users)], args.seed, args.timeout)
+            for username in driver.users:
+                driver.signup(username)
+
+            # Seed course so the polling, question and quiz scenarios have something to read
+            seed_response = driver.start_generation(driver.users[0])
+            seed_response.raise_for_status()
+            driver.wait_for_course(driver.courses[0], timeout=args.drain)
+
+            plan = schedule(args.rps, args.duration, mix, args.seed)
+            recorder = Recorder()
+            load_started_at = time.time()
+            started = time.monotonic()
+
+            def send(scheduled_at, scenario):
+                try:
+                    status = driver.run(scenario).status_code
+                    ok = status < 400 or (status == 404 and scenario in POLLING_SCENARIOS)
+                except requests.RequestException:
+                    ok = False
+                recorder.add(scenario, time.monotonic() - scheduled_at, ok)
+
+            print(f"Sending {len(plan)} requests at {args.rps} rps to {args.server} on {base_url}")
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                for offset, scenario in plan:
+                    scheduled_at = started + offset
+                    delay = scheduled_at - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(send, scheduled_at, scenario)
+            elapsed = time.monotonic() - started
+
+            # Let queued generations finish so their durations are part of the report
+            deadline = time.monotonic() + args.drain
+            since = datetime.fromtimestamp(load_started_at, timezone.utc)
+            while time.monotonic() < deadline and db.generation_jobs.count_documents(
+                    {"createdAt": {"$gte": since}, "status": {"$in": ["queued", "running"]}}):
+                time.sleep(1)
+
+            scenarios, total = recorder.summary(elapsed)
+            results = {
+                "args": vars(args),
+                "profile": profile,
+                "elapsed_s": round(elapsed, 2),
+                "scenarios": scenarios,
+                "total": total,
+                "generation": generation_summary(db, since),
+                "peak_memory_mb": peak_memory_mb(app_process.pid),
+                "upstreams": mock.stats(),
+            }
+        finally:
+            stop_app(app_process)
+            mock.stop()
+
+    print_report(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# course_repository.py
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, UpdateOne
+
+
+class CourseRepository:
+    """
+    Data access for courses and their slides.
+
+    Schema version 2 keeps course metadata in coursecontent and every slide as its own
+    document in the slides collection, keyed by (courseId, slideNumber), so slide reads
+    and writes cost the same however long the course is. Version 1 courses, which embed
+    a slides array, are still read until migrate_slides.py has moved them.
+
+    Reads only fetch the fields they return: titles through a single $in query
+    and slide counts from the precomputed slidesGenerated counter.
+
+    Generation is checkpointed on the course document: its stage moves from "text" to
+    "slides" to "done" (or "failed"), and the course text and every finished slide are
+    saved with upserts, so a resumed generation skips whatever is already stored.
+    """
+
+    SCHEMA_VERSION = 2
+
+    # Generation stages, courses created before checkpoints have no stage
+    STAGE_TEXT = "text"
+    STAGE_SLIDES = "slides"
+    STAGE_DONE = "done"
+    STAGE_FAILED = "failed"
+    UNFINISHED_STAGES = (STAGE_TEXT, STAGE_SLIDES, STAGE_FAILED)
+
+    def __init__(self, db):
+        """
+        Initializes the CourseRepository.
+
+        Parameters:
+            db (Database): The MongoDB database holding the course collections.
+        """
+        self.courses = db.coursecontent
+        self.slides = db.slides
+        self.course_text = db.course_text
+        self.user_presentation = db.user_presentation
+        self.users = db.users
+
+    def ensure_indexes(self):
+        self.courses.create_index([("courseId", ASCENDING)])
+        self.courses.create_index([("stage", ASCENDING)])
+        self.slides.create_index([("courseId", ASCENDING), ("slideNumber", ASCENDING)], unique=True)
+        self.course_text.create_index([("courseId", ASCENDING)])
+        self.user_presentation.create_index([("username", ASCENDING)])
+        self.users.create_index([("username", ASCENDING)])
+
+    def create_course(self, course_id, title, total_slides, input_prompt=None, username=None):
+        """
+        Creates the course unless it already exists, e.g. when its generation is resumed.
+
+        Parameters:
+            input_prompt (str): The prompt the course is generated from, kept for resuming.
+            username (str): The course's owner, kept for resuming.
+
+        Returns:
+            dict: The stored course document.
+        """
+        course_data = {
+            "courseId": course_id,
+            "title": title,
+            "totalSlides": total_slides,
+            # Until set_total_slides, totalSlides is only an estimate
+            "totalSlidesProvisional": True,
+            "slidesGenerated": 0,
+            "schemaVersion": self.SCHEMA_VERSION,
+            "inputPrompt": input_prompt,
+            "username": username,
+            "stage": self.STAGE_TEXT,
+            "resumes": 0,
+        }
+        self.courses.update_one({"courseId": course_id}, {"$setOnInsert": course_data}, upsert=True)
+        return self.courses.find_one({"courseId": course_id}, {"_id": 0})
+
+    def set_stage(self, course_id, stage, error=None):
+        fields = {"stage": stage, "stageUpdatedAt": datetime.now(timezone.utc)}
+        update = {"$set": fields}
+        if error is not None:
+            fields["error"] = str(error)
+        else:
+            update["$unset"] = {"error": ""}
+        self.courses.update_one({"courseId": course_id}, update)
+
+    def get_generation(self, course_id):
+        """
+        Returns what is needed to resume the course's generation: courseId, stage,
+        inputPrompt, username and resumes, or None if the course is unknown.
+        """
+        return self.courses.find_one(
+            {"courseId": course_id},
+            {"_id": 0, "courseId": 1, "stage": 1, "inputPrompt": 1, "username": 1, "resumes": 1},
+        )
+
+    def find_unfinished(self, max_resumes, limit=100, exclude=()):
+        """
+        Returns the generation state of checkpointed courses that did not finish and
+        have been resumed fewer than max_resumes times, oldest first.
+
+        Parameters:
+            exclude (iterable): Course IDs to leave out, e.g. those whose job is still active,
+                so they do not take up the limit on every call.
+        """
+        return list(self.courses.find(
+            {"stage": {"$in": list(self.UNFINISHED_STAGES)}, "resumes": {"$lt": max_resumes},
+             "inputPrompt": {"$ne": None}, "courseId": {"$nin": list(exclude)}},
+            {"_id": 0, "courseId": 1, "stage": 1, "inputPrompt": 1, "username": 1, "resumes": 1},
+        ).sort("_id", ASCENDING).limit(limit))
+
+    def count_resume(self, course_id):
+        self.courses.update_one({"courseId": course_id}, {"$inc": {"resumes": 1}})
+
+    def save_course_text(self, course_id, text):
+        # Upserted, a resumed generation never adds a second text for the course
+        self.course_text.update_one({"courseId": course_id}, {"$set": {"text": text}}, upsert=True)
+
+    def get_course_text(self, course_id):
+        doc = self.course_text.find_one({"courseId": course_id}, {"_id": 0, "text": 1})
+        return doc["text"] if doc else None
+
+    def finished_slide_numbers(self, course_id, default_image_url):
+        """
+        Returns the numbers of stored slides that got both their image and their audio;
+        slides saved with a placeholder image or without audio are generated again on resume.
+        """
+        return {
+            slide["slideNumber"]
+            for slide in self.slides.find(
+                {"courseId": course_id, "audio": {"$nin": ["", None]}, "images.0": {"$ne": default_image_url}},
+                {"_id": 0, "slideNumber": 1},
+            )
+        }
+
+    def clear_slides(self, course_id):
+        """
+        Removes slides stored by an earlier attempt whose course text was never saved,
+        since a new text may split into different slides.
+        """
+        result = self.slides.delete_many({"courseId": course_id})
+        if result.deleted_count:
+            self.courses.update_one({"courseId": course_id}, {"$set": {"slidesGenerated": 0}})
+        return result.deleted_count
+
+    def recount_slides(self, course_id):
+        """
+        Sets slidesGenerated from the stored slides. add_slide stores a slide and counts it
+        in two writes, so a crash in between leaves the counter short until this runs.
+        """
+        count = self.slides.count_documents({"courseId": course_id})
+        self.courses.update_one({"courseId": course_id}, {"$set": {"slidesGenerated": count}})
+        return count
+
+    def set_total_slides(self, course_id, total_slides):
+        self.courses.update_one({"courseId": course_id},
+                                {"$set": {"totalSlides": total_slides, "totalSlidesProvisional": False}})
+
+    def add_slide(self, course_id, slide_data):
+        """
+        Stores a slide, replacing any earlier version of the same slide number.
+        The course's slidesGenerated counter only moves for slides that are new.
+        """
+        result = self.slides.update_one(
+            {"courseId": course_id, "slideNumber": slide_data["slideNumber"]},
+            {"$set": {**slide_data, "courseId": course_id}},
+            upsert=True,
+        )
+        if result.upserted_id is not None:
+            self.courses.update_one({"courseId": course_id}, {"$inc": {"slidesGenerated": 1}})
+
+    def add_course_to_user(self, username, course_id):
+        self.user_presentation.update_one(
+            {"username": username},
+            {"$addToSet": {"courseIds": course_id}},  # Use $addToSet to avoid duplicates
+            upsert=True,
+        )
+
+    def get_status(self, course_id):
+        """
+        Returns the course metadata with its slidesGenerated count, without any slide bodies.
+
+        Returns:
+            dict: courseId, title, totalSlides, totalSlidesProvisional and stage (both missing on
+                older courses) and slidesGenerated, or None if the course is unknown.
+        """
+        course = self.courses.find_one(
+            {"courseId": course_id},
+            {"_id": 0, "courseId": 1, "title": 1, "totalSlides": 1, "totalSlidesProvisional": 1,
+             "slidesGenerated": 1, "stage": 1},
+        )
+        if course and "slidesGenerated" not in course:
+            # Courses created before the counter existed, count on the server
+            counted = list(self.courses.aggregate([
+                {"$match": {"courseId": course_id}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "count": {"$size": {"$ifNull": ["$slides", []]}}}},
+            ]))
+            course["slidesGenerated"] = counted[0]["count"] if counted else 0
+        return course
+
+    def get_slide(self, course_id, slide_number):
+        """
+        Returns a single slide by its 1-based number.
+
+        Returns:
+            tuple: (course_found, slide) where slide is None if it is not available yet.
+        """
+        slide = self.slides.find_one({"courseId": course_id, "slideNumber": slide_number},
+                                     {"_id": 0, "courseId": 0})
+        if slide:
+            return True, slide
+
+        course = self.courses.find_one(
+            {"courseId": course_id},
+            {"_id": 0, "schemaVersion": 1, "slides": {"$slice": [slide_number - 1, 1]}},
+        )
+        if not course:
+            return False, None
+        # Version 1 courses still embed their slides
+        slides = course.get("slides", [])
+        return True, (slides[0] if slides else None)
+
+    def get_slides(self, course_id, after=0):
+        """
+        Returns the course's slides numbered above after, in slide order.
+        """
+        slides = list(self.slides.find(
+            {"courseId": course_id, "slideNumber": {"$gt": after}},
+            {"_id": 0, "courseId": 0},
+        ).sort("slideNumber", ASCENDING))
+        if slides:
+            return slides
+
+        course = self.courses.find_one({"courseId": course_id, "schemaVersion": {"$exists": False}},
+                                       {"_id": 0, "slides": 1})
+        if not course:
+            return []
+        return [slide for slide in course.get("slides", []) if slide["slideNumber"] > after]
+
+    def migrate_course(self, course):
+        """
+        Moves a version 1 course's embedded slides into the slides collection.
+
+        Parameters:
+            course (dict): The coursecontent document, including its slides array.
+
+        Returns:
+            int: The number of slides moved.
+        """
+        slides = course.get("slides", [])
+        if slides:
+            self.slides.bulk_write([
+                UpdateOne(
+                    {"courseId": course["courseId"], "slideNumber": slide["slideNumber"]},
+                    {"$set": {**slide, "courseId": course["courseId"]}},
+                    upsert=True,
+                )
+                for slide in slides
+            ], ordered=False)
+        self.courses.update_one(
+            {"_id": course["_id"]},
+            {"$set": {"schemaVersion": self.SCHEMA_VERSION, "slidesGenerated": len(slides)},
+             "$unset": {"slides": ""}},
+        )
+        return len(slides)
+
+    def get_title(self, course_id):
+        course = self.courses.find_one({"courseId": course_id}, {"_id": 0, "title": 1})
+        return course.get("title") if course else None
+
+    def list_course_titles(self, username):
+        """
+        Returns the user's courses with their titles using one $in query.
+
+        Returns:
+            list: dicts with courseId and title, or None if the user has no course mapping.
+        """
+        user_presentation = self.user_presentation.find_one(
+            {"username": username}, {"_id": 0, "courseIds": 1})
+        if not user_presentation:
+            return None
+
+        course_ids = user_presentation.get("courseIds", [])
+        titles = {}
+        for course in self.courses.find({"courseId": {"$in": course_ids}},
+                                        {"_id": 0, "courseId": 1, "title": 1}):
+            titles.setdefault(course["courseId"], course.get("title", "No Title Found"))
+
+        # Keep the user's course order
+        return [{"courseId": course_id, "title": titles[course_id]}
+                for course_id in course_ids if course_id in titles]
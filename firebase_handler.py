@@ -1,23 +1,87 @@
 # firebase_handler.py
 import firebase_admin
 from firebase_admin import credentials, storage
+from urllib.parse import quote
+import io
+import logging
 import os
+import uuid
+
+import metrics
+
+logger = logging.getLogger(__name__)
 
 class FirebaseHandler:
-    def __init__(self, firebase_cred_path, firebase_bucket_name):
+    # How uploaded files are made reachable:
+    #   "token"  - Firebase download token set in the upload metadata, no extra API call
+    #   "public" - the bucket is publicly readable, the plain public URL is used as is
+    #   "acl"    - blob.make_public() after the upload, one extra API call per file
+    URL_MODES = ("token", "public", "acl")
+
+    def __init__(self, firebase_cred_path, firebase_bucket_name, url_mode="token",
+                 chunk_size=8 * 1024 * 1024, resumable_threshold=5 * 1024 * 1024):
         """
         Initializes the FirebaseHandler with the provided credentials and bucket name.
         
         Parameters:
             firebase_cred_path (str): Path to Firebase Service Account JSON.
             firebase_bucket_name (str): Name of the Firebase Storage bucket.
+            url_mode (str): One of URL_MODES.
+            chunk_size (int): Chunk size for resumable uploads, a multiple of 256 KB.
+            resumable_threshold (int): Payloads larger than this use a chunked resumable upload.
         """
+        if url_mode not in self.URL_MODES:
+            raise ValueError(f"Unknown Firebase URL mode: {url_mode}")
+
         # Initialize Firebase Admin SDK
         cred = credentials.Certificate(firebase_cred_path)
         firebase_admin.initialize_app(cred, {
             'storageBucket': firebase_bucket_name
         })
         self.bucket = storage.bucket()
+        self.url_mode = url_mode
+        self.chunk_size = chunk_size
+        self.resumable_threshold = resumable_threshold
+
+    def upload_bytes(self, file_name, data, content_type):
+        """
+        Uploads in-memory data to Firebase Storage without touching the local disk.
+
+        Parameters:
+            file_name (str): The name to give the file in Firebase.
+            data (bytes): The file content.
+            content_type (str): MIME type stored with the file, e.g. "image/png".
+
+        Returns:
+            str: The URL of the uploaded file.
+        """
+        if len(data) > self.resumable_threshold:
+            return self.upload_stream(file_name, io.BytesIO(data), content_type, size=len(data))
+
+        with metrics.track_upstream("firebase", content_type) as call:
+            call.bytes = len(data)
+            blob = self._new_blob(file_name)
+            blob.upload_from_string(data, content_type=content_type)
+            return self._url_for(blob)
+
+    def upload_stream(self, file_name, stream, content_type, size=None):
+        """
+        Uploads a file-like object with a chunked resumable upload.
+
+        Parameters:
+            file_name (str): The name to give the file in Firebase.
+            stream (file-like): Readable binary stream, read until EOF when size is None.
+            content_type (str): MIME type stored with the file.
+            size (int): Total size in bytes if known.
+
+        Returns:
+            str: The URL of the uploaded file.
+        """
+        with metrics.track_upstream("firebase", content_type) as call:
+            blob = self._new_blob(file_name, chunk_size=self.chunk_size)
+            blob.upload_from_file(stream, size=size, content_type=content_type, rewind=False)
+            call.bytes = size if size is not None else stream.tell()
+            return self._url_for(blob)
 
     def upload_to_firebase(self, file_name, file_path):
         """
@@ -30,11 +94,11 @@ class FirebaseHandler:
         Returns:
             str: The public URL of the uploaded file.
         """
-        blob = self.bucket.blob(file_name)
-        blob.upload_from_filename(file_path)
-        blob.make_public()  # Make the file publicly accessible
+        with metrics.track_upstream("firebase", "file"):
+            blob = self._new_blob(file_name)
+            blob.upload_from_filename(file_path)
 
-        return blob.public_url
+            return self._url_for(blob)
 
     def delete_local_file(self, file_path):
         """
@@ -45,6 +109,22 @@ class FirebaseHandler:
         """
         if os.path.exists(file_path):
             os.remove(file_path)
-            print(f"Deleted local file: {file_path}")
+            logger.info("Deleted local file: %s", file_path)
         else:
-            print(f"File not found: {file_path}")
\ No newline at end of file
+            logger.warning("File not found: %s", file_path)
+
+    def _new_blob(self, file_name, chunk_size=None):
+        blob = self.bucket.blob(file_name, chunk_size=chunk_size)
+        if self.url_mode == "token":
+            # Sent together with the upload, so the download URL needs no extra request
+            blob.metadata = {"firebaseStorageDownloadTokens": str(uuid.uuid4())}
+        return blob
+
+    def _url_for(self, blob):
+        if self.url_mode == "token":
+            token = blob.metadata["firebaseStorageDownloadTokens"]
+            return (f"https://firebasestorage.googleapis.com/v0/b/{self.bucket.name}/o/"
+                    f"{quote(blob.name, safe='')}?alt=media&token={token}")
+        if self.url_mode == "acl":
+            blob.make_public()  # Make the file publicly accessible
+        return blob.public_url
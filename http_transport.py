@@ -0,0 +1,243 @@
+# http_transport.py
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+import metrics
+from rate_limiter import get_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and calls fail fast.
+    Once reset_timeout has passed a single trial call is let through (half-open);
+    its outcome closes the circuit again or re-opens it. A trial that reports no outcome
+    within trial_timeout is given up on and the next call becomes the trial.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, trial_timeout=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = reset_timeout if trial_timeout is None else trial_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if (self.state == self.OPEN and now - self._opened_at >= self.reset_timeout) or \
+                    (self.state == self.HALF_OPEN and now - self._trial_started >= self.trial_timeout):
+                self.state = self.HALF_OPEN
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def release_trial(self):
+        """
+        Ends a half-open trial that finished without an outcome, e.g. because it was cancelled,
+        so the next call becomes the trial instead of waiting for trial_timeout.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class HttpTransport:
+    """
+    Pooled keep-alive HTTP session for one upstream provider.
+
+    Adds connect/read timeouts, jittered exponential backoff on transient failures
+    (honouring Retry-After on 429 and 503) and a circuit breaker, so a slow or failing
+    provider cannot tie up every worker thread. Every attempt waits for the shared rate limiter.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, name, pool_size=20, connect_timeout=5, read_timeout=120,
+                 max_retries=3, backoff_base=0.5, backoff_max=30, breaker=None):
+        """
+        Initializes the HttpTransport.
+
+        Parameters:
+            name (str): Name of the upstream, used in log messages.
+            pool_size (int): Maximum number of kept-alive connections.
+            connect_timeout (float): Seconds to wait for a connection.
+            read_timeout (float): Seconds to wait between bytes of the response.
+            max_retries (int): Retries after the first attempt for transient failures.
+            backoff_base (float): Base delay in seconds for exponential backoff.
+            backoff_max (float): Upper bound for a single backoff delay.
+            breaker (CircuitBreaker): Circuit breaker for this upstream.
+        """
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, url, model=None, **kwargs):
+        return self.request("POST", url, model=model, **kwargs)
+
+    def request(self, method, url, model=None, **kwargs):
+        """
+        Sends a request, retrying transient failures.
+
+        Parameters:
+            model (str): Model the request is for, selects a model's own rate limit.
+
+        Returns:
+            Response: The last response received, which may still carry an error status.
+
+        Raises:
+            CircuitOpenError: If the upstream's circuit is open.
+            RateLimitedError: If the upstream's rate limit stayed saturated.
+            RequestException: If every attempt failed without a response.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        limiter = get_limiter()
+        attempt = 0
+        while True:
+            try:
+                response = self._attempt(limiter, method, url, model, kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                metrics.count_retry(self.name, type(e).__name__)
+                logger.warning("%s request failed (%s), retrying in %.2fs", self.name, e, delay)
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    return response
+                if attempt >= self.max_retries:
+                    return response
+                delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                else:
+                    # The provider asked for a pause, hold back the other callers as well
+                    limiter.pause(self.name, model, min(delay, self.backoff_max))
+                delay = min(delay, self.backoff_max)
+                metrics.count_retry(self.name, f"http_{response.status_code}")
+                logger.warning("%s returned %s, retrying in %.2fs", self.name, response.status_code, delay)
+                response.close()
+
+            attempt += 1
+            time.sleep(delay)
+
+    def _attempt(self, limiter, method, url, model, kwargs):
+        # The limiter slot is taken first, so a call held back or rejected by the limiter
+        # never uses up the breaker's half-open trial
+        with limiter.acquire(self.name, model):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {self.name}")
+            recorded = False
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code in self.RETRY_STATUSES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                recorded = True
+                return response
+            except Exception:
+                # Any call that ends without a response is a failure
+                self.breaker.record_failure()
+                recorded = True
+                raise
+            finally:
+                if not recorded:
+                    self.breaker.release_trial()
+
+    def _backoff(self, attempt):
+        # Full jitter: a random delay up to the exponential bound
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(response):
+        if response.status_code not in (429, 503):
+            return None
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(name):
+    """
+    Returns the shared transport for an upstream, creating it from Config on first use.
+
+    Parameters:
+        name (str): Upstream name, e.g. "kindo", "huggingface" or "tts".
+
+    Returns:
+        HttpTransport: The transport shared by every client of that upstream.
+    """
+    with _transports_lock:
+        if name not in _transports:
+            _transports[name] = HttpTransport(
+                name,
+                pool_size=Config.HTTP_POOL_SIZE,
+                connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+                read_timeout=Config.HTTP_READ_TIMEOUT,
+                max_retries=Config.HTTP_MAX_RETRIES,
+                backoff_base=Config.HTTP_BACKOFF_BASE,
+                backoff_max=Config.HTTP_BACKOFF_MAX,
+                breaker=CircuitBreaker(Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT,
+                                       Config.CIRCUIT_TRIAL_TIMEOUT),
+            )
+        return _transports[name]
@@ -1,17 +1,27 @@
 # huggingface_client.py
 
-import requests
+import logging
+
+from http_transport import get_transport
+import metrics
+
+logger = logging.getLogger(__name__)
 
 class HuggingFaceClient:
-    def __init__(self, api_key):
+    BASE_URL = "https://api-inference.huggingface.co/models"
+
+    def __init__(self, api_key, transport=None, base_url=None):
         """
         Initializes the HuggingFaceClient class with the provided API key.
         
         Parameters:
             api_key (str): The API key for authenticating with Hugging Face.
+            transport (HttpTransport): Optional transport, the shared "huggingface" one by default.
+            base_url (str): Optional models URL, e.g. of a stand-in server.
         """
         self.api_key = api_key
-        self.base_url = "https://api-inference.huggingface.co/models"
+        self.base_url = base_url or self.BASE_URL
+        self.transport = transport or get_transport("huggingface")
 
     def generate_image(self, input_text, model_name):
         """
@@ -36,12 +46,17 @@ class HuggingFaceClient:
         }
 
         try:
-            # Send a POST request to the Hugging Face model API
-            response = requests.post(
-                f'{self.base_url}/{model_name}',
-                headers=headers,
-                json=json_data
-            )
+            with metrics.track_upstream("huggingface", model_name) as call:
+                # Send a POST request to the Hugging Face model API
+                response = self.transport.post(
+                    f'{self.base_url}/{model_name}',
+                    model=model_name,
+                    headers=headers,
+                    json=json_data
+                )
+                call.bytes = len(response.content)
+                if response.status_code != 200:
+                    call.fail(f"http_{response.status_code}")
 
             # Check for successful response
             if response.status_code == 200:
@@ -49,10 +64,9 @@ class HuggingFaceClient:
                 return response.content
             else:
                 # Log error message if the request fails
-                print(f"Error: Received status code {response.status_code}")
-                print(f"Response: {response.json()}")
+                logger.error("Received status code %s", response.status_code, extra={"details": response.json()})
                 return None
         except Exception as e:
             # Handle exceptions and log error message
-            print(f"An error occurred: {str(e)}")
+            logger.error("An error occurred: %s", e)
             return None
\ No newline at end of file
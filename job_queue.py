@@ -0,0 +1,384 @@
+# job_queue.py
+from datetime import datetime, timedelta, timezone
+import logging
+import threading
+import time
+import uuid
+
+from pymongo import ASCENDING, ReturnDocument
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is rejected by admission control."""
+
+    def __init__(self, message, retry_after=30):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Durable job queue persisted in a MongoDB collection.
+
+    Jobs are claimed with a lease that the owning worker renews through heartbeats.
+    A job whose lease expires (its worker crashed or was restarted) becomes claimable again,
+    and a job whose handler raises is queued again after a backoff until its attempts run out.
+    Claims are ordered by the job's per-user sequence number first, so one user enqueueing
+    many jobs cannot starve everyone else.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, collection, max_queued=200, max_per_user=3, lease_seconds=60, max_attempts=3,
+                 retry_backoff=30):
+        """
+        Initializes the JobQueue.
+
+        Parameters:
+            collection (Collection): MongoDB collection holding the jobs.
+            max_queued (int): Maximum number of queued jobs before new ones are rejected.
+            max_per_user (int): Maximum number of queued or running jobs per user.
+            lease_seconds (int): How long a claim is valid without a heartbeat.
+            max_attempts (int): How many times a job is claimed before it is given up on.
+            retry_backoff (float): Seconds before a failed job is retried, doubled on each further attempt.
+        """
+        self.collection = collection
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+    def ensure_indexes(self):
+        self.collection.create_index([("status", ASCENDING), ("userSeq", ASCENDING), ("createdAt", ASCENDING)])
+        self.collection.create_index([("username", ASCENDING), ("status", ASCENDING)])
+
+    def enqueue(self, job_type, payload, username, job_id=None):
+        """
+        Adds a job to the queue, applying admission control.
+
+        Parameters:
+            job_type (str): Name of the handler that runs the job.
+            payload (dict): Keyword arguments passed to the handler.
+            username (str): Owner of the job, used for fairness and per-user limits.
+            job_id (str): Optional job ID, a new UUID is used if not given.
+
+        Returns:
+            tuple: (job_id, queue position starting at 1).
+
+        Raises:
+            QueueFullError: If the queue or the user's share of it is full.
+        """
+        active = {"$in": [self.QUEUED, self.RUNNING]}
+        if self.collection.count_documents({"status": self.QUEUED}) >= self.max_queued:
+            raise QueueFullError("Generation queue is full, please retry later.")
+
+        user_active = self.collection.count_documents({"username": username, "status": active})
+        if user_active >= self.max_per_user:
+            raise QueueFullError("Too many generations in progress for this user.")
+
+        job = {
+            "_id": job_id or str(uuid.uuid4()),
+            "type": job_type,
+            "payload": payload,
+            "username": username,
+            "status": self.QUEUED,
+            "userSeq": user_active,
+            "attempts": 0,
+            "createdAt": self._now(),
+        }
+        self.collection.insert_one(job)
+        self._admit(job)
+        return job["_id"], self.position(job)
+
+    def _admit(self, job):
+        """
+        Re-checks the limits of a job that was just queued, counting only the jobs queued
+        before it, so concurrent enqueues cannot all pass the checks made before inserting.
+        The job is removed if it is over a limit, otherwise its userSeq is set to the number
+        of the user's jobs ahead of it, which keeps the sequence numbers distinct.
+
+        Raises:
+            QueueFullError: If the queue or the user's share of it is full.
+        """
+        before = {"$or": [
+            {"createdAt": {"$lt": job["createdAt"]}},
+            {"createdAt": job["createdAt"], "_id": {"$lt": job["_id"]}},
+        ]}
+        queued_ahead = self.collection.count_documents({"status": self.QUEUED, **before})
+        user_ahead = self.collection.count_documents(
+            {"username": job["username"], "status": {"$in": [self.QUEUED, self.RUNNING]}, **before})
+        if queued_ahead >= self.max_queued or user_ahead >= self.max_per_user:
+            removed = self.collection.delete_one({"_id": job["_id"], "status": self.QUEUED, "attempts": 0})
+            if not removed.deleted_count:
+                # A worker claimed it in the meantime, it is running already
+                return
+            if queued_ahead >= self.max_queued:
+                raise QueueFullError("Generation queue is full, please retry later.")
+            raise QueueFullError("Too many generations in progress for this user.")
+        if user_ahead != job["userSeq"]:
+            self.collection.update_one({"_id": job["_id"]}, {"$set": {"userSeq": user_ahead}})
+            job["userSeq"] = user_ahead
+
+    def requeue(self, job_id):
+        """
+        Puts a failed job back in the queue with a fresh set of attempts, applying the
+        per-user limit of enqueue(). Jobs that are queued, running or done are left alone.
+
+        Returns:
+            int: The job's queue position, or 0 if it was not failed.
+
+        Raises:
+            QueueFullError: If the queue or the user's share of it is full.
+        """
+        job = self.collection.find_one({"_id": job_id}, {"status": 1, "username": 1})
+        if not job or job["status"] != self.FAILED:
+            return 0
+        if self.collection.count_documents({"status": self.QUEUED}) >= self.max_queued:
+            raise QueueFullError("Generation queue is full, please retry later.")
+        user_active = self.collection.count_documents(
+            {"username": job["username"], "status": {"$in": [self.QUEUED, self.RUNNING]}})
+        if user_active >= self.max_per_user:
+            raise QueueFullError("Too many generations in progress for this user.")
+
+        job = self.collection.find_one_and_update(
+            {"_id": job_id, "status": self.FAILED},
+            {
+                "$set": {"status": self.QUEUED, "userSeq": user_active, "attempts": 0, "createdAt": self._now()},
+                "$unset": {"error": "", "finishedAt": "", "runAfter": "", "leaseOwner": "", "leaseExpiresAt": ""},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        # Another process may have requeued it first
+        return self.position(job) if job else 0
+
+    def position(self, job):
+        """
+        Returns the 1-based position of a queued job, or 0 if it is no longer queued.
+        """
+        if job.get("status") != self.QUEUED:
+            return 0
+        ahead = self.collection.count_documents({
+            "status": self.QUEUED,
+            "$or": [
+                {"userSeq": {"$lt": job["userSeq"]}},
+                {"userSeq": job["userSeq"], "createdAt": {"$lt": job["createdAt"]}},
+            ],
+        })
+        return ahead + 1
+
+    def get(self, job_id):
+        return self.collection.find_one({"_id": job_id})
+
+    def active_ids(self):
+        """
+        Returns the IDs of the jobs that are queued or running.
+        """
+        return self.collection.distinct("_id", {"status": {"$in": [self.QUEUED, self.RUNNING]}})
+
+    def depth(self):
+        return self.collection.count_documents({"status": self.QUEUED})
+
+    def claim(self, worker_id):
+        """
+        Atomically leases the next runnable job, including jobs whose lease has expired.
+
+        Parameters:
+            worker_id (str): Identifier of the claiming worker.
+
+        Returns:
+            dict: The claimed job, or None if nothing is runnable.
+        """
+        now = self._now()
+        return self.collection.find_one_and_update(
+            {
+                "$or": [
+                    # Jobs waiting out a retry backoff are not runnable yet
+                    {"status": self.QUEUED, "runAfter": {"$not": {"$gt": now}}},
+                    {"status": self.RUNNING, "leaseExpiresAt": {"$lt": now}},
+                ],
+                "attempts": {"$lt": self.max_attempts},
+            },
+            {
+                "$set": {
+                    "status": self.RUNNING,
+                    "leaseOwner": worker_id,
+                    "leaseExpiresAt": now + timedelta(seconds=self.lease_seconds),
+                    "startedAt": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("userSeq", ASCENDING), ("createdAt", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, job_id, worker_id):
+        """
+        Extends the lease of a running job.
+
+        Returns:
+            bool: False if the lease was lost to another worker.
+        """
+        result = self.collection.update_one(
+            {"_id": job_id, "status": self.RUNNING, "leaseOwner": worker_id},
+            {"$set": {"leaseExpiresAt": self._now() + timedelta(seconds=self.lease_seconds)}},
+        )
+        return result.modified_count == 1
+
+    def complete(self, job_id, worker_id):
+        self.collection.update_one(
+            {"_id": job_id, "leaseOwner": worker_id},
+            {"$set": {"status": self.DONE, "finishedAt": self._now()},
+             "$unset": {"leaseExpiresAt": "", "error": "", "runAfter": ""}},
+        )
+
+    def retry(self, job, worker_id, error):
+        """
+        Queues a job whose handler raised again, after a backoff that doubles with each attempt.
+
+        Returns:
+            bool: False if the job has no attempts left (or its lease was lost), so it should be failed.
+        """
+        if job["attempts"] >= self.max_attempts:
+            return False
+        delay = self.retry_backoff * 2 ** (job["attempts"] - 1)
+        result = self.collection.update_one(
+            {"_id": job["_id"], "status": self.RUNNING, "leaseOwner": worker_id},
+            {"$set": {"status": self.QUEUED, "error": str(error),
+                      "runAfter": self._now() + timedelta(seconds=delay)},
+             "$unset": {"leaseOwner": "", "leaseExpiresAt": ""}},
+        )
+        return result.modified_count == 1
+
+    def fail(self, job_id, worker_id, error):
+        self.collection.update_one(
+            {"_id": job_id, "leaseOwner": worker_id},
+            {"$set": {"status": self.FAILED, "error": str(error), "finishedAt": self._now()},
+             "$unset": {"leaseExpiresAt": ""}},
+        )
+
+    def reap(self):
+        """
+        Marks jobs that expired after their last allowed attempt as failed.
+        """
+        self.collection.update_many(
+            {"status": self.RUNNING, "leaseExpiresAt": {"$lt": self._now()},
+             "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"status": self.FAILED, "error": "Lease expired after final attempt"}},
+        )
+
+    @staticmethod
+    def _now():
+        # MongoDB stores milliseconds, keep local timestamps comparable with stored ones
+        now = datetime.now(timezone.utc)
+        return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+class WorkerPool:
+    """
+    Pool of threads that claim jobs from a JobQueue and run them.
+
+    The same pool runs inside the Flask process or in a separate worker process (worker.py),
+    since coordination happens entirely through the queue's leases.
+    """
+
+    def __init__(self, job_queue, handlers, workers=4, poll_interval=1.0):
+        """
+        Initializes the WorkerPool.
+
+        Parameters:
+            job_queue (JobQueue): The queue to claim jobs from.
+            handlers (dict): Maps job type to a callable taking the job payload as keyword arguments.
+            workers (int): Number of worker threads.
+            poll_interval (float): Seconds to wait before polling an empty queue again.
+        """
+        self.job_queue = job_queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.pool_id = str(uuid.uuid4())
+        self._threads = []
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def start(self):
+        """
+        Starts the worker and heartbeat threads. Calling it again is a no-op.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, args=(f"{self.pool_id}-{i}",),
+                                          name=f"job-worker-{i}", daemon=True)
+                self._threads.append(thread)
+            self._threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                job = self.job_queue.claim(worker_id)
+            except Exception as e:
+                logger.warning("Failed to claim job: %s", e)
+                job = None
+            if not job:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            with self._lock:
+                self._in_flight[job["_id"]] = worker_id
+            start = time.perf_counter()
+            try:
+                handler = self.handlers[job["type"]]
+                handler(**job["payload"])
+                self.job_queue.complete(job["_id"], worker_id)
+                metrics.observe_job(job["type"], JobQueue.DONE, time.perf_counter() - start)
+            except Exception as e:
+                if self.job_queue.retry(job, worker_id, e):
+                    logger.exception("Job %s failed on attempt %d, retrying", job["_id"], job["attempts"])
+                    metrics.observe_job(job["type"], JobQueue.QUEUED, time.perf_counter() - start)
+                else:
+                    logger.exception("Job %s failed", job["_id"])
+                    self.job_queue.fail(job["_id"], worker_id, e)
+                    metrics.observe_job(job["type"], JobQueue.FAILED, time.perf_counter() - start)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(job["_id"], None)
+
+    def _heartbeat(self):
+        interval = max(1.0, self.job_queue.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            with self._lock:
+                in_flight = list(self._in_flight.items())
+            for job_id, worker_id in in_flight:
+                try:
+                    if not self.job_queue.heartbeat(job_id, worker_id):
+                        logger.warning("Lost lease on job %s", job_id)
+                except Exception as e:
+                    logger.warning("Heartbeat failed for job %s: %s", job_id, e)
+            try:
+                self.job_queue.reap()
+            except Exception as e:
+                logger.warning("Failed to reap expired jobs: %s", e)
@@ -1,11 +1,49 @@
+import json
+import logging
+
 import requests
 
+from http_transport import get_transport
+import metrics
+from token_budget import TokenUsage
+
+logger = logging.getLogger(__name__)
+
 class KindoAPI:
-    def __init__(self, api_key):
+    BASE_URL = "https://llm.kindo.ai/v1/chat/completions"
+
+    def __init__(self, api_key, transport=None, cache=None, cache_routes=None, base_url=None):
+        """
+        Parameters:
+            api_key (str): The Kindo API key.
+            transport (HttpTransport): Optional transport, the shared "kindo" one by default.
+            cache (LLMCache): Optional response cache.
+            cache_routes (iterable): Routes allowed to use the cache, every named route if None.
+            base_url (str): Optional chat completions URL, e.g. of a stand-in server.
+        """
         self.api_key = api_key
-        self.base_url = "https://llm.kindo.ai/v1/chat/completions"
+        self.base_url = base_url or self.BASE_URL
+        self.transport = transport or get_transport("kindo")
+        self.cache = cache
+        self.cache_routes = set(cache_routes) if cache_routes is not None else None
+        self.usage = TokenUsage()
+
+    def call_kindo_api(self, model, messages, max_tokens, route=None, **kwargs):
+        """
+        Calls the chat completions endpoint.
+
+        route names the call for the token usage counters, and opts it into the
+        response cache when that route is enabled for caching.
+        A cache hit returns a Response built from the stored body without calling Kindo.
+        """
+        cache_key = None
+        if self._cache_enabled(route):
+            cache_key = self.cache.make_key(model, messages, max_tokens, kwargs)
+            body = self.cache.get(cache_key, route)
+            if body is not None:
+                self.usage.record(model, route, cached=True)
+                return self._cached_response(body)
 
-    def call_kindo_api(self, model, messages, max_tokens, **kwargs):
         headers = {
             "api-key": self.api_key,
             "content-type": "application/json",
@@ -22,11 +60,19 @@ class KindoAPI:
         data.update(kwargs)
 
         try:
-            # Send the POST request
-            response = requests.post(self.base_url, headers=headers, json=data)
+            with metrics.track_upstream("kindo", model) as call:
+                # Send the POST request
+                response = self.transport.post(self.base_url, model=model, headers=headers, json=data)
+                call.bytes = len(response.content)
+
+                # Check for HTTP errors
+                response.raise_for_status()
 
-            # Check for HTTP errors
-            response.raise_for_status()
+            body = response.json()
+            self.usage.record(model, route, body.get("usage"), messages=messages,
+                              completion=_completion_text(body))
+            if cache_key is not None:
+                self.cache.set(cache_key, route, model, body)
 
             # Return the JSON response if successful
             return response
@@ -34,10 +80,114 @@ class KindoAPI:
         except requests.exceptions.HTTPError as http_err:
             # Handle HTTP error responses
             error_details = response.json() if response.content else {}
-            print(f"HTTP error occurred: {http_err}, details: {error_details}")
+            logger.error("HTTP error occurred: %s", http_err, extra={"details": error_details})
             return {"error": str(http_err), "details": error_details}
 
         except Exception as err:
             # Handle other errors (network issues, etc.)
-            print(f"An error occurred: {err}")
+            logger.error("An error occurred: %s", err)
+            return {"error": str(err)}
+
+    def stream_kindo_api(self, model, messages, max_tokens, route=None, **kwargs):
+        """
+        Calls the chat completions endpoint with streaming enabled.
+
+        Returns:
+            generator: The content deltas (str) as they arrive, if the request succeeds.
+            dict: {"error": ..., "details": ...} if the request fails, like call_kindo_api.
+        On a cache hit the whole cached answer is yielded as one delta. A completed
+        stream is stored in the cache in the same shape as a non-streamed response.
+        """
+        cache_key = None
+        if self._cache_enabled(route):
+            cache_key = self.cache.make_key(model, messages, max_tokens, kwargs)
+            body = self.cache.get(cache_key, route)
+            if body is not None:
+                self.usage.record(model, route, cached=True)
+                return iter([body['choices'][0]['message']['content']])
+
+        headers = {
+            "api-key": self.api_key,
+            "content-type": "application/json",
+            "accept": "text/event-stream",
+        }
+        data = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        data.update(kwargs)
+
+        try:
+            # Timed until the response headers, the body streams on
+            with metrics.track_upstream("kindo", model):
+                response = self.transport.post(self.base_url, model=model, headers=headers, json=data, stream=True)
+                response.raise_for_status()
+        except requests.exceptions.HTTPError as http_err:
+            error_details = response.json() if response.content else {}
+            logger.error("HTTP error occurred: %s", http_err, extra={"details": error_details})
+            return {"error": str(http_err), "details": error_details}
+        except Exception as err:
+            logger.error("An error occurred: %s", err)
             return {"error": str(err)}
+
+        return self._iter_deltas(response, model, route, cache_key, messages)
+
+    def _iter_deltas(self, response, model, route, cache_key, messages):
+        content = []
+        completed = False
+        usage_reported = False
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                # Server-Sent Events: only "data:" lines carry chunks
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    completed = True
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("usage"):
+                    self.usage.record(model, route, chunk["usage"])
+                    usage_reported = True
+                for choice in chunk.get("choices", []):
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        content.append(delta)
+                        yield delta
+                    # The answer is whole once the model says why it stopped
+                    if choice.get("finish_reason"):
+                        completed = True
+            # A body that just ends (no [DONE] or finish_reason) is a truncated answer, never cached
+        finally:
+            response.close()
+            if not usage_reported:
+                # Not every stream ends with a usage chunk, count what was received
+                self.usage.record(model, route, messages=messages, completion="".join(content))
+
+        if completed and cache_key is not None:
+            body = {"choices": [{"message": {"role": "assistant", "content": "".join(content)}}]}
+            self.cache.set(cache_key, route, model, body)
+
+    def _cache_enabled(self, route):
+        if self.cache is None or route is None:
+            return False
+        return self.cache_routes is None or route in self.cache_routes
+
+    def _cached_response(self, body):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(body).encode("utf-8")
+        response.headers["content-type"] = "application/json"
+        response.headers["x-cache"] = "hit"
+        response.url = self.base_url
+        return response
+
+
+def _completion_text(body):
+    # The answer text of a chat completion body, for counting its tokens locally
+    try:
+        return body["choices"][0]["message"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        return ""
@@ -0,0 +1,109 @@
+# llm_cache.py
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import logging
+import threading
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """
+    Content-addressed cache for chat completion responses.
+
+    Entries are keyed by a hash of (model, messages, max_tokens, kwargs) and kept in two tiers:
+    an in-process LRU with TTL, and an optional MongoDB collection whose TTL index expires old entries.
+    Hits and misses are counted per route.
+    """
+
+    def __init__(self, collection=None, max_entries=1024, ttl_seconds=86400):
+        """
+        Initializes the LLMCache.
+
+        Parameters:
+            collection (Collection): Optional MongoDB collection for the shared tier.
+            max_entries (int): Maximum number of entries in the in-memory tier.
+            ttl_seconds (int): How long an entry stays valid in both tiers.
+        """
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._memory = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def ensure_indexes(self):
+        if self.collection is not None:
+            self.collection.create_index("expireAt", expireAfterSeconds=0)
+
+    @staticmethod
+    def make_key(model, messages, max_tokens, kwargs):
+        """
+        Returns the hex SHA-256 of the canonical JSON form of a request.
+        """
+        payload = json.dumps(
+            {"model": model, "messages": messages, "max_tokens": max_tokens, "kwargs": kwargs},
+            sort_keys=True, separators=(",", ":"), default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, route):
+        """
+        Looks a response body up in memory first, then in MongoDB.
+
+        Returns:
+            dict: The cached response body, or None on a miss.
+        """
+        with self._lock:
+            body = self._memory.get(key)
+        if body is not None:
+            self._count(route, "memory_hits")
+            return body
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({"_id": key, "expireAt": {"$gt": self._now()}})
+            except Exception as e:
+                logger.warning("LLM cache lookup failed: %s", e)
+                doc = None
+            if doc:
+                with self._lock:
+                    self._memory[key] = doc["body"]
+                self._count(route, "mongo_hits")
+                return doc["body"]
+
+        self._count(route, "misses")
+        return None
+
+    def set(self, key, route, model, body):
+        with self._lock:
+            self._memory[key] = body
+        if self.collection is not None:
+            now = self._now()
+            try:
+                self.collection.replace_one(
+                    {"_id": key},
+                    {"_id": key, "route": route, "model": model, "body": body,
+                     "createdAt": now, "expireAt": now + timedelta(seconds=self.ttl_seconds)},
+                    upsert=True,
+                )
+            except Exception as e:
+                logger.warning("LLM cache write failed: %s", e)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters per route.
+        """
+        with self._lock:
+            return {route: dict(counters) for route, counters in self._stats.items()}
+
+    def _count(self, route, counter):
+        with self._lock:
+            counters = self._stats.setdefault(route, {"memory_hits": 0, "mongo_hits": 0, "misses": 0})
+            counters[counter] += 1
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc)
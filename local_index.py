@@ -0,0 +1,252 @@
+# local_index.py
+# On-disk retrieval index used by rag.LocalRetriever: a memory-mapped NumPy embedding
+# matrix searched in batches, an optional HNSW graph (hnswlib) and a BM25 keyword index.
+#
+# Build one from a JSONL corpus with one {"text": ...} object per line:
+#   python local_index.py ingest corpus.jsonl --out ./local_index --embedding openai
+import argparse
+from collections import Counter
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # Optional approximate index
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class HashingEmbedding:
+    """
+    Deterministic local embedding based on the hashing trick.
+
+    Needs no network or model download, so indexes and tests can run offline.
+    Exposes the same get_text_embedding method as the llama_index embedding models.
+    """
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def get_text_embedding(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+
+class BM25Index:
+    """
+    Okapi BM25 keyword index over the corpus documents.
+    """
+
+    def __init__(self, doc_freqs, doc_lengths, term_freqs, k1=1.5, b=0.75):
+        self.doc_freqs = doc_freqs
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        self.term_freqs = term_freqs
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, texts):
+        doc_freqs = Counter()
+        doc_lengths = []
+        term_freqs = []
+        for text in texts:
+            counts = Counter(tokenize(text))
+            term_freqs.append(dict(counts))
+            doc_lengths.append(sum(counts.values()))
+            doc_freqs.update(counts.keys())
+        return cls(dict(doc_freqs), doc_lengths, term_freqs)
+
+    def scores(self, query, doc_ids):
+        """
+        Returns the BM25 score of the query for each of the given document IDs.
+        """
+        n_docs = len(self.term_freqs)
+        result = np.zeros(len(doc_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            df = self.doc_freqs.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for i, doc_id in enumerate(doc_ids):
+                tf = self.term_freqs[doc_id].get(term, 0)
+                if tf:
+                    length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1.0)
+                    result[i] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        return result
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"doc_freqs": self.doc_freqs, "doc_lengths": self.doc_lengths.tolist(),
+                       "term_freqs": self.term_freqs, "k1": self.k1, "b": self.b}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["doc_freqs"], data["doc_lengths"], data["term_freqs"], data["k1"], data["b"])
+
+
+class LocalVectorIndex:
+    """
+    Embedding matrix stored as a .npy file and opened memory-mapped.
+
+    Rows are L2-normalized, so the dot product is the cosine similarity.
+    search() scans the matrix in batches and keeps a running top-k, or queries
+    the HNSW graph when one was built and hnswlib is installed.
+    """
+
+    EMBEDDINGS_FILE = "embeddings.npy"
+    DOCS_FILE = "docs.jsonl"
+    BM25_FILE = "bm25.json"
+    HNSW_FILE = "hnsw.bin"
+    META_FILE = "meta.json"
+
+    def __init__(self, index_dir, batch_size=65536):
+        """
+        Opens an index built by build().
+
+        Parameters:
+            index_dir (str): Directory holding the index files.
+            batch_size (int): Rows scored per batch in the exact search.
+        """
+        self.index_dir = index_dir
+        self.batch_size = batch_size
+        with open(os.path.join(index_dir, self.META_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.embeddings = np.load(os.path.join(index_dir, self.EMBEDDINGS_FILE), mmap_mode="r")
+        with open(os.path.join(index_dir, self.DOCS_FILE), encoding="utf-8") as f:
+            self.docs = [json.loads(line)["text"] for line in f]
+        self.bm25 = BM25Index.load(os.path.join(index_dir, self.BM25_FILE))
+
+        self.hnsw = None
+        hnsw_path = os.path.join(index_dir, self.HNSW_FILE)
+        # Only a graph built with these vectors, a rebuild without --hnsw may leave an old one
+        if hnswlib is not None and self.meta.get("hnsw") and os.path.exists(hnsw_path):
+            self.hnsw = hnswlib.Index(space="ip", dim=self.embeddings.shape[1])
+            self.hnsw.load_index(hnsw_path)
+            self.hnsw.set_ef(max(64, self.meta.get("hnsw_ef", 64)))
+
+    def search(self, query_embedding, top_k):
+        """
+        Returns (doc_ids, similarities) of the top_k nearest documents, best first.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        top_k = min(top_k, len(self.docs))
+        if top_k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        if self.hnsw is not None:
+            labels, distances = self.hnsw.knn_query(query, k=top_k)
+            # hnswlib's inner product distance is 1 - similarity
+            return labels[0].astype(np.int64), 1.0 - distances[0]
+
+        best_ids = np.array([], dtype=np.int64)
+        best_scores = np.array([], dtype=np.float32)
+        for start in range(0, self.embeddings.shape[0], self.batch_size):
+            batch_scores = np.asarray(self.embeddings[start:start + self.batch_size]) @ query
+            ids = np.concatenate([best_ids, np.arange(start, start + len(batch_scores))])
+            scores = np.concatenate([best_scores, batch_scores])
+            if len(scores) > top_k:
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+                ids, scores = ids[keep], scores[keep]
+            best_ids, best_scores = ids, scores
+
+        order = np.argsort(-best_scores)
+        return best_ids[order], best_scores[order]
+
+
+def build(corpus_path, index_dir, embed_model, embedding_name, hnsw=False, log_every=1000):
+    """
+    Builds a local index from a JSONL corpus.
+
+    Parameters:
+        corpus_path (str): JSONL file with a "text" field per line.
+        index_dir (str): Output directory.
+        embed_model: Object with get_text_embedding(text).
+        embedding_name (str): Name of the embedding backend, stored so queries use the same one.
+        hnsw (bool): Also build an HNSW graph (requires hnswlib).
+
+    Returns:
+        int: The number of documents indexed.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with open(corpus_path, encoding="utf-8") as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    if not texts:
+        raise ValueError(f"No documents found in {corpus_path}")
+
+    first = np.asarray(embed_model.get_text_embedding(texts[0]), dtype=np.float32)
+    embeddings = np.lib.format.open_memmap(
+        os.path.join(index_dir, LocalVectorIndex.EMBEDDINGS_FILE),
+        mode="w+", dtype=np.float32, shape=(len(texts), len(first)),
+    )
+    with open(os.path.join(index_dir, LocalVectorIndex.DOCS_FILE), "w", encoding="utf-8") as docs:
+        for i, text in enumerate(texts):
+            vector = first if i == 0 else np.asarray(embed_model.get_text_embedding(text), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            embeddings[i] = vector / norm if norm else vector
+            docs.write(json.dumps({"text": text}) + "\n")
+            if log_every and (i + 1) % log_every == 0:
+                logger.info("Embedded %d/%d documents", i + 1, len(texts))
+    embeddings.flush()
+
+    BM25Index.build(texts).save(os.path.join(index_dir, LocalVectorIndex.BM25_FILE))
+
+    hnsw_path = os.path.join(index_dir, LocalVectorIndex.HNSW_FILE)
+    if hnsw:
+        if hnswlib is None:
+            raise RuntimeError("hnswlib is not installed, build without --hnsw")
+        graph = hnswlib.Index(space="ip", dim=embeddings.shape[1])
+        graph.init_index(max_elements=len(texts), ef_construction=200, M=16)
+        graph.add_items(np.asarray(embeddings), np.arange(len(texts)))
+        graph.save_index(hnsw_path)
+    elif os.path.exists(hnsw_path):
+        # Left by an earlier build into the same directory, its ids no longer match the vectors
+        os.remove(hnsw_path)
+
+    with open(os.path.join(index_dir, LocalVectorIndex.META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"embedding": embedding_name, "dimensions": int(embeddings.shape[1]),
+                   "documents": len(texts), "hnsw": bool(hnsw)}, f)
+    return len(texts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local retrieval index tools.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    ingest = subcommands.add_parser("ingest", help="Build an index from a JSONL corpus.")
+    ingest.add_argument("corpus", help="JSONL file with a 'text' field per line.")
+    ingest.add_argument("--out", default="./local_index", help="Output directory.")
+    ingest.add_argument("--embedding", choices=["openai", "hashing"], default="openai",
+                        help="Embedding backend, queries must use the same one.")
+    ingest.add_argument("--hnsw", action="store_true", help="Also build an HNSW graph (requires hnswlib).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from rag import create_embed_model
+    count = build(args.corpus, args.out, create_embed_model(args.embedding), args.embedding, hnsw=args.hnsw)
+    print(f"Indexed {count} documents into {args.out}")
@@ -0,0 +1,68 @@
+# local_storage.py
+import logging
+import os
+import shutil
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LocalStorageHandler:
+    """
+    Stores uploads in a local directory instead of Firebase Storage, for offline runs and benchmarks.
+    Has the upload methods of FirebaseHandler; the files are served by the app's /files route.
+    """
+
+    def __init__(self, root_dir, base_url, chunk_size=1024 * 1024):
+        """
+        Initializes the LocalStorageHandler.
+
+        Parameters:
+            root_dir (str): Directory the files are written to, created if missing.
+            base_url (str): URL the directory is served under, file names are appended to it.
+            chunk_size (int): Read size when copying streams.
+        """
+        self.root_dir = os.path.abspath(root_dir)
+        self.base_url = base_url.rstrip("/")
+        self.chunk_size = chunk_size
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def upload_bytes(self, file_name, data, content_type):
+        with metrics.track_upstream("local_storage", content_type) as call:
+            call.bytes = len(data)
+            with open(self._path(file_name), "wb") as f:
+                f.write(data)
+            return self._url_for(file_name)
+
+    def upload_stream(self, file_name, stream, content_type, size=None):
+        with metrics.track_upstream("local_storage", content_type) as call:
+            written = 0
+            with open(self._path(file_name), "wb") as f:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    written += len(chunk)
+            call.bytes = written
+            return self._url_for(file_name)
+
+    def upload_to_firebase(self, file_name, file_path):
+        with metrics.track_upstream("local_storage", "file"):
+            shutil.copyfile(file_path, self._path(file_name))
+            return self._url_for(file_name)
+
+    def delete_local_file(self, file_path):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            logger.info("Deleted local file: %s", file_path)
+        else:
+            logger.warning("File not found: %s", file_path)
+
+    def _path(self, file_name):
+        # Names are generated by the app, but never let one escape the storage directory
+        return os.path.join(self.root_dir, os.path.basename(file_name))
+
+    def _url_for(self, file_name):
+        return f"{self.base_url}/{os.path.basename(file_name)}"
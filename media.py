@@ -0,0 +1,80 @@
+# media.py
+# Post-processing of generated slide images: compressed WebP or JPEG variants at several widths.
+from collections import namedtuple
+import io
+import logging
+
+try:
+    from PIL import Image
+except ImportError:  # Optional, without Pillow the original PNG is uploaded
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# One encoded size of an image, widest first in the lists returned by ImageTranscoder
+ImageVariant = namedtuple("ImageVariant", ["data", "content_type", "extension", "width", "height"])
+
+
+class ImageTranscoder:
+    """
+    Re-encodes images as WebP or JPEG at a set of widths, never upscaling.
+    """
+
+    FORMATS = {
+        "webp": ("WEBP", "image/webp", "webp"),
+        "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    }
+
+    def __init__(self, image_format="webp", widths=(1024, 512, 256), quality=80):
+        """
+        Initializes the ImageTranscoder.
+
+        Parameters:
+            image_format (str): One of FORMATS.
+            widths (iterable): Target widths in pixels; an empty list disables transcoding.
+            quality (int): Encoder quality, 1-100.
+        """
+        if image_format not in self.FORMATS:
+            raise ValueError(f"Unknown image variant format: {image_format}")
+        self.image_format = image_format
+        self.widths = sorted({int(width) for width in widths}, reverse=True)
+        self.quality = quality
+        if self.widths and Image is None:
+            logger.warning("Pillow is not installed, slide images are uploaded without variants")
+
+    @property
+    def enabled(self):
+        return bool(self.widths) and Image is not None
+
+    def transcode(self, data):
+        """
+        Returns the image's variants, widest first, or an empty list if transcoding is disabled
+        or the data is not a readable image.
+        """
+        if not self.enabled:
+            return []
+        try:
+            source = Image.open(io.BytesIO(data))
+            source.load()
+        except Exception as e:
+            logger.warning("Could not read image for transcoding: %s", e)
+            return []
+
+        pil_format, content_type, extension = self.FORMATS[self.image_format]
+        if pil_format == "JPEG" and source.mode not in ("RGB", "L"):
+            source = source.convert("RGB")
+
+        variants = []
+        seen_widths = set()
+        for width in self.widths:
+            # Smaller images keep their size rather than being scaled up
+            width = min(width, source.width)
+            if width in seen_widths:
+                continue
+            seen_widths.add(width)
+            height = max(1, round(source.height * width / source.width))
+            image = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, format=pil_format, quality=self.quality, optimize=True)
+            variants.append(ImageVariant(out.getvalue(), content_type, extension, width, height))
+        return variants
@@ -0,0 +1,181 @@
+# metrics.py
+# Prometheus metrics shared by the API, the workers and the upstream clients,
+# exposed by the /metrics route and, in worker.py processes, by their own HTTP server.
+#
+# With several server processes (ASGI_WORKERS > 1) set PROMETHEUS_MULTIPROC_DIR to an empty
+# directory: every process then writes its metrics there and /metrics aggregates them.
+from contextlib import contextmanager
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess, start_http_server)
+from prometheus_client.core import GaugeMetricFamily
+
+import tracing
+
+# Upstream calls range from a fast cache-backed Mongo read to minutes of image synthesis
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time until an API route returns its response (headers, for streamed responses).",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Duration of calls to upstream providers, including retries.",
+    ["provider", "model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total",
+    "Upstream calls that failed after retries.",
+    ["provider", "model", "reason"],
+)
+UPSTREAM_RETRIES = Counter(
+    "upstream_retries_total",
+    "Upstream attempts retried by the HTTP transport.",
+    ["provider", "reason"],
+)
+RATE_LIMIT_WAIT = Histogram(
+    "upstream_rate_limit_wait_seconds",
+    "Time upstream calls waited for the rate limiter.",
+    ["provider", "priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RATE_LIMITED = Counter(
+    "upstream_rate_limited_total",
+    "Upstream calls rejected by the rate limiter without being sent.",
+    ["provider", "priority"],
+)
+JOB_DURATION = Histogram(
+    "generation_job_duration_seconds",
+    "Duration of generation jobs run by the worker pool.",
+    ["job_type", "status"],
+    buckets=LATENCY_BUCKETS + (600, 1200),
+)
+
+
+class _QueueCollector:
+    """
+    Reads the queue depth and the running jobs when metrics are scraped. A collector rather
+    than a Gauge, so the values stay live in multiprocess mode, which only aggregates files.
+    """
+
+    def __init__(self):
+        self.job_queue = None
+        self.worker_pool = None
+
+    def collect(self):
+        if self.job_queue is not None:
+            yield GaugeMetricFamily("generation_job_queue_depth", "Generation jobs waiting in the queue.",
+                                    value=self.job_queue.depth())
+        if self.worker_pool is not None:
+            yield GaugeMetricFamily("generation_jobs_in_flight", "Generation jobs running in this process.",
+                                    value=self.worker_pool.in_flight)
+
+
+_queue_collector = _QueueCollector()
+REGISTRY.register(_queue_collector)
+
+
+class UpstreamCall:
+    """
+    Handle yielded by track_upstream; call fail() for failures that do not raise,
+    and set bytes to the payload size for the course trace.
+    """
+
+    def __init__(self):
+        self.error = None
+        self.bytes = None
+
+    def fail(self, reason):
+        self.error = reason
+
+
+@contextmanager
+def track_upstream(provider, model):
+    """
+    Times an upstream call and counts it as an error if the block raises or fail() is called.
+    The call is also a span of the current course trace, if any.
+
+    Parameters:
+        provider (str): Upstream name, e.g. "kindo", "huggingface", "tts" or "firebase".
+        model (str): Model or operation the call is for.
+    """
+    call = UpstreamCall()
+    start = time.perf_counter()
+    with tracing.span(provider, model=model) as span:
+        try:
+            yield call
+        except Exception as e:
+            call.fail(call.error or _error_reason(e))
+            raise
+        finally:
+            outcome = "error" if call.error else "ok"
+            UPSTREAM_LATENCY.labels(provider, model, outcome).observe(time.perf_counter() - start)
+            if call.error:
+                UPSTREAM_ERRORS.labels(provider, model, call.error).inc()
+                span.set(error=call.error)
+            if call.bytes is not None:
+                span.set(bytes=call.bytes)
+
+
+def count_retry(provider, reason):
+    UPSTREAM_RETRIES.labels(provider, reason).inc()
+    tracing.current_span().inc("retries")
+
+
+def observe_rate_limit_wait(provider, priority, seconds):
+    RATE_LIMIT_WAIT.labels(provider, priority).observe(seconds)
+
+
+def count_rate_limited(provider, priority):
+    RATE_LIMITED.labels(provider, priority).inc()
+
+
+def observe_request(method, route, status, seconds):
+    REQUEST_LATENCY.labels(method, route, str(status)).observe(seconds)
+
+
+def observe_job(job_type, status, seconds):
+    JOB_DURATION.labels(job_type, status).observe(seconds)
+
+
+def track_queue(job_queue, worker_pool=None):
+    """
+    Reports the queue depth and, for a pool running in this process, its running jobs
+    whenever metrics are scraped.
+    """
+    _queue_collector.job_queue = job_queue
+    _queue_collector.worker_pool = worker_pool
+
+
+def start_server(port):
+    """
+    Serves the metrics on their own port, for processes without the API (worker.py).
+    """
+    start_http_server(port)
+
+
+def render():
+    """
+    Returns (body, content type) of the Prometheus text exposition.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_queue_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def _error_reason(error):
+    # HTTP errors are labelled by status code, everything else by exception type
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return f"http_{status}"
+    return type(error).__name__
@@ -0,0 +1,41 @@
+# migrate_slides.py
+# Moves slides embedded in coursecontent documents (schema version 1) into the
+# slides collection (schema version 2). Safe to re-run: slides are upserted by
+# (courseId, slideNumber) and migrated courses are skipped.
+import argparse
+
+from pymongo import MongoClient
+
+from config import Config
+from course_repository import CourseRepository
+
+
+def migrate(db, dry_run=False, limit=0):
+    repository = CourseRepository(db)
+    repository.ensure_indexes()
+
+    query = {"schemaVersion": {"$exists": False}}
+    courses = db.coursecontent.find(query).limit(limit)
+    migrated = 0
+    moved_slides = 0
+    for course in courses:
+        slide_count = len(course.get("slides", []))
+        if dry_run:
+            print(f"Would migrate course {course['courseId']} with {slide_count} slides")
+        else:
+            repository.migrate_course(course)
+            print(f"Migrated course {course['courseId']} with {slide_count} slides")
+        migrated += 1
+        moved_slides += slide_count
+    return migrated, moved_slides
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded slides into the slides collection.")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the courses that would be migrated.")
+    parser.add_argument("--limit", type=int, default=0, help="Migrate at most this many courses (0 for all).")
+    args = parser.parse_args()
+
+    db = MongoClient(Config.MONGO_URI).get_default_database()
+    courses, slides = migrate(db, dry_run=args.dry_run, limit=args.limit)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {courses} courses and {slides} slides")
@@ -0,0 +1,188 @@
+# quiz_bank.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import json
+import logging
+import re
+import threading
+
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+
+class QuizBank:
+    """
+    Bank of validated multiple choice questions generated ahead of time per course.
+
+    Questions are generated in batches as structured JSON and stored in MongoDB.
+    Serving a question is a database read; the bank is topped up in the background
+    when a user is running out of questions they have not seen.
+    """
+
+    OPTION_LETTERS = "ABCD"
+
+    def __init__(self, collection, course_text_collection, kindo_api, bank_size=10,
+                 low_watermark=3, max_questions=50, context_fn=None, workers=2):
+        """
+        Initializes the QuizBank.
+
+        Parameters:
+            collection (Collection): MongoDB collection holding the questions.
+            course_text_collection (Collection): Collection with the generated course texts.
+            kindo_api (KindoAPI): Client used to generate the questions.
+            bank_size (int): Number of questions generated per batch.
+            low_watermark (int): Unseen questions left for a user that trigger a top-up.
+            max_questions (int): Upper bound of questions kept per course.
+            context_fn (callable): Optional (course_text) -> text to put in the prompt.
+            workers (int): Number of background generation threads.
+        """
+        self.collection = collection
+        self.course_text = course_text_collection
+        self.kindo_api = kindo_api
+        self.bank_size = bank_size
+        self.low_watermark = low_watermark
+        self.max_questions = max_questions
+        self.context_fn = context_fn or (lambda text: text)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quiz-bank")
+        self._filling = set()
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.collection.create_index([("courseId", ASCENDING)])
+
+    def fill_async(self, course_id):
+        """
+        Schedules a batch of questions for the course unless one is already being generated.
+        """
+        with self._lock:
+            if course_id in self._filling:
+                return
+            self._filling.add(course_id)
+        self._executor.submit(self._fill, course_id)
+
+    def next_question(self, course_id, username=None):
+        """
+        Returns a random question from the bank, one the user has not seen if a username is given.
+
+        Returns:
+            dict: question, options and answer (option index), or None if the bank has nothing to serve.
+        """
+        match = {"courseId": course_id}
+        if username:
+            match["seenBy"] = {"$ne": username}
+        sampled = list(self.collection.aggregate([
+            {"$match": match},
+            {"$sample": {"size": 1}},
+            {"$project": {"question": 1, "options": 1, "answer": 1}},
+        ]))
+
+        if username:
+            if sampled:
+                self.collection.update_one({"_id": sampled[0]["_id"]}, {"$addToSet": {"seenBy": username}})
+            unseen = self.collection.count_documents(match) - len(sampled)
+            if unseen < self.low_watermark:
+                self.fill_async(course_id)
+        elif not sampled:
+            self.fill_async(course_id)
+
+        if not sampled:
+            return None
+        question = sampled[0]
+        return {"question": question["question"], "options": question["options"], "answer": question["answer"]}
+
+    def generate(self, course_id, count=None):
+        """
+        Generates a batch of questions for the course and stores the valid ones.
+
+        Returns:
+            int: The number of questions added.
+        """
+        existing = self.collection.count_documents({"courseId": course_id})
+        count = min(count or self.bank_size, self.max_questions - existing)
+        if count <= 0:
+            return 0
+
+        course_text_data = self.course_text.find_one({"courseId": course_id})
+        if not course_text_data:
+            return 0
+        context = self.context_fn(course_text_data.get("text", ""))
+
+        # Ask for new questions only
+        asked = [doc["question"] for doc in self.collection.find({"courseId": course_id}, {"question": 1})]
+        avoid = f" Do not repeat any of these questions: {json.dumps(asked)}." if asked else ""
+
+        prompt = (f"Create {count} multiple choice quiz questions that each have a single correct answer. "
+                  "Reply with only a JSON array, no other text. Each element must be an object with "
+                  "\"question\" (string), \"options\" (array of exactly 4 strings starting with 'A. ', 'B. ', 'C. ' and 'D. ') "
+                  "and \"answer\" (the letter of the correct option)."
+                  f"{avoid} The questions should be totally based on the text and nothing from outside: {context}")
+        messages = [{"role": "user", "content": prompt}]
+        response = self.kindo_api.call_kindo_api(model='azure/gpt-4o', messages=messages,
+                                                 max_tokens=min(4000, 250 * count), route="quiz_bank")
+        if 'error' in response:
+            logger.error("Quiz bank generation failed", extra={"course_id": course_id, "error": response['error'], "details": response.get('details')})
+            return 0
+
+        questions = self.parse_questions(response.json()['choices'][0]['message']['content'])
+        known = set(asked)
+        now = datetime.now(timezone.utc)
+        docs = []
+        for question in questions[:count]:
+            if question["question"] in known:
+                continue
+            known.add(question["question"])
+            docs.append({**question, "courseId": course_id, "seenBy": [], "createdAt": now})
+        if docs:
+            self.collection.insert_many(docs)
+        logger.info("Added questions to the quiz bank", extra={"course_id": course_id, "questions": len(docs)})
+        return len(docs)
+
+    @classmethod
+    def parse_questions(cls, content):
+        """
+        Parses and validates the model's JSON reply, dropping malformed questions.
+
+        Returns:
+            list: dicts with question, options (4 strings) and answer (option index).
+        """
+        # Tolerate code fences or text around the array
+        match = re.search(r"\[.*\]", content, re.DOTALL)
+        if not match:
+            return []
+        try:
+            items = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return []
+
+        questions = []
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            question = item.get("question")
+            options = item.get("options")
+            answer = str(item.get("answer", "")).strip()[:1].upper()
+            if not isinstance(question, str) or not question.strip():
+                continue
+            if not isinstance(options, list) or len(options) != 4:
+                continue
+            if not all(isinstance(option, str) and option.strip() for option in options):
+                continue
+            # "" is in every string, so a missing or empty answer needs its own check
+            if len(answer) != 1 or answer not in cls.OPTION_LETTERS:
+                continue
+            questions.append({
+                "question": question.strip(),
+                "options": [option.strip() for option in options],
+                "answer": cls.OPTION_LETTERS.index(answer),
+            })
+        return questions
+
+    def _fill(self, course_id):
+        try:
+            self.generate(course_id)
+        except Exception:
+            logger.exception("Quiz bank fill failed", extra={"course_id": course_id})
+        finally:
+            with self._lock:
+                self._filling.discard(course_id)
@@ -1,67 +1,286 @@
+import hashlib
+import logging
 import os
+import re
+import struct
+import threading
+
+from cachetools import TTLCache
 from llama_index.embeddings.openai import OpenAIEmbedding
 from qdrant_client import QdrantClient
 import dotenv
 
+from config import Config
 from kindo_api import KindoAPI
+from local_index import HashingEmbedding, LocalVectorIndex
+from stage_runner import StageRunner
+from token_budget import fit_context
+import tracing
+
+logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv()
 
-def retrieve_relevant_documents(query, top_k=5):
-    qdrant_client = QdrantClient(
-        url=os.getenv("QDRANT_URL"),
-        api_key=os.getenv("QDRANT_KEY"),
-    )
+# Long-lived clients, created on first use or injected with configure_clients()
+_clients_lock = threading.Lock()
+_qdrant_client = None
+_embed_model = None
+_kindo_api = None
+_retriever = None
+
+# Query embeddings keyed on normalized query text, search results keyed on (embedding hash, top_k)
+_cache_lock = threading.Lock()
+_embedding_cache = TTLCache(maxsize=Config.EMBEDDING_CACHE_SIZE, ttl=Config.EMBEDDING_CACHE_TTL_SECONDS)
+_retrieval_cache = TTLCache(maxsize=Config.RETRIEVAL_CACHE_SIZE, ttl=Config.RETRIEVAL_CACHE_TTL_SECONDS)
+
+
+class Retriever:
+    """
+    Interface of the retrieval backends used by retrieve_relevant_documents.
+    """
+
+    name = "base"
+
+    def search(self, query, query_embedding, top_k):
+        """
+        Returns the text of the top_k documents most relevant to the query.
+
+        Parameters:
+            query (str): The query text, for backends that also match keywords.
+            query_embedding (list): The query embedding.
+            top_k (int): Number of documents to return.
+        """
+        raise NotImplementedError
+
+
+class QdrantRetriever(Retriever):
+    """
+    Vector search in the remote Qdrant arxiv_papers collection.
+    """
+
+    name = "qdrant"
+
+    def __init__(self, client, collection_name="arxiv_papers"):
+        self.client = client
+        self.collection_name = collection_name
+
+    def search(self, query, query_embedding, top_k):
+        search_result = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=query_embedding,
+            limit=top_k
+        )
+        return [hit.payload["text"] for hit in search_result]
+
+
+class LocalRetriever(Retriever):
+    """
+    Hybrid search over a local index built with local_index.py.
+
+    The dense index returns candidates_factor * top_k candidates, which are re-ranked
+    by a weighted sum of their normalized cosine and BM25 scores.
+    """
+
+    name = "local"
+
+    def __init__(self, index, dense_weight=0.7, candidates_factor=4):
+        """
+        Parameters:
+            index (LocalVectorIndex): The opened local index.
+            dense_weight (float): Weight of the embedding score, the rest goes to BM25.
+            candidates_factor (int): How many more candidates than top_k to re-rank.
+        """
+        self.index = index
+        self.dense_weight = dense_weight
+        self.candidates_factor = candidates_factor
+
+    def search(self, query, query_embedding, top_k):
+        doc_ids, dense_scores = self.index.search(query_embedding, top_k * self.candidates_factor)
+        if len(doc_ids) == 0:
+            return []
+
+        keyword_scores = self.index.bm25.scores(query, doc_ids)
+        combined = (self.dense_weight * _min_max(dense_scores)
+                    + (1 - self.dense_weight) * _min_max(keyword_scores))
+        best = combined.argsort()[::-1][:top_k]
+        return [self.index.docs[doc_ids[i]] for i in best]
+
+
+def _min_max(scores):
+    scores = scores.astype("float32")
+    spread = scores.max() - scores.min()
+    if spread == 0:
+        return scores * 0
+    return (scores - scores.min()) / spread
+
+
+def configure_clients(kindo_api=None, qdrant_client=None, embed_model=None, retriever=None):
+    """
+    Injects clients to use instead of the ones built from the environment,
+    e.g. the application's KindoAPI so RAG calls share its cache and transport.
+    """
+    global _kindo_api, _qdrant_client, _embed_model, _retriever
+    with _clients_lock:
+        if kindo_api is not None:
+            _kindo_api = kindo_api
+        if qdrant_client is not None:
+            _qdrant_client = qdrant_client
+        if embed_model is not None:
+            _embed_model = embed_model
+        if retriever is not None:
+            _retriever = retriever
+
+
+def create_embed_model(name):
+    """
+    Returns a new embedding model: "openai", or "hashing" for the offline stub.
+    """
+    if name == "hashing":
+        return HashingEmbedding()
+    if name == "openai":
+        return OpenAIEmbedding(api_key=os.getenv("OPENAI_API_KEY"))
+    raise ValueError(f"Unknown embedding backend: {name}")
+
 
-    embed_model = OpenAIEmbedding(api_key=os.getenv("OPENAI_API_KEY"))
+def get_qdrant_client():
+    global _qdrant_client
+    with _clients_lock:
+        if _qdrant_client is None:
+            _qdrant_client = QdrantClient(
+                url=os.getenv("QDRANT_URL"),
+                api_key=os.getenv("QDRANT_KEY"),
+            )
+        return _qdrant_client
 
+
+def get_embed_model():
+    global _embed_model
+    with _clients_lock:
+        if _embed_model is None:
+            _embed_model = create_embed_model(Config.EMBEDDING_BACKEND)
+        return _embed_model
+
+
+def get_retriever():
+    global _retriever
+    with _clients_lock:
+        retriever = _retriever
+    if retriever is not None:
+        return retriever
+
+    if Config.RETRIEVER_BACKEND == "local":
+        index = LocalVectorIndex(Config.LOCAL_INDEX_DIR)
+        if index.meta["embedding"] != Config.EMBEDDING_BACKEND:
+            raise ValueError(f"Local index was built with {index.meta['embedding']} embeddings, "
+                             f"but EMBEDDING_BACKEND is {Config.EMBEDDING_BACKEND}")
+        retriever = LocalRetriever(index, dense_weight=Config.HYBRID_DENSE_WEIGHT)
+    elif Config.RETRIEVER_BACKEND == "qdrant":
+        retriever = QdrantRetriever(get_qdrant_client())
+    else:
+        raise ValueError(f"Unknown retriever backend: {Config.RETRIEVER_BACKEND}")
+
+    with _clients_lock:
+        if _retriever is None:
+            _retriever = retriever
+        return _retriever
+
+
+def get_kindo_api():
+    global _kindo_api
+    with _clients_lock:
+        if _kindo_api is None:
+            _kindo_api = KindoAPI(api_key=os.getenv("KINDO_API_KEY"), base_url=Config.KINDO_BASE_URL)
+        return _kindo_api
+
+
+def normalize_query(query):
+    # Case, punctuation and spacing differences should not cost another embedding request
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+def embed_query(query):
+    # The normalized text is only the cache key, the model embeds the query as written
+    key = normalize_query(query)
+    with _cache_lock:
+        embedding = _embedding_cache.get(key)
+    if embedding is None:
+        with tracing.span("embedding", backend=Config.EMBEDDING_BACKEND):
+            embedding = get_embed_model().get_text_embedding(query)
+        with _cache_lock:
+            _embedding_cache[key] = embedding
+    return embedding
+
+
+def _embedding_hash(embedding):
+    return hashlib.sha256(struct.pack(f"{len(embedding)}d", *embedding)).hexdigest()
+
+
+def retrieve_relevant_documents(query, top_k=5):
     # Generate query embedding
-    query_embedding = embed_model.get_text_embedding(query)
-    
-    # Search in Qdrant
-    search_result = qdrant_client.search(
-        collection_name="arxiv_papers",
-        query_vector=query_embedding,
-        limit=top_k
-    )
-    
-    # Extract and return the text of relevant documents
-    relevant_docs = [hit.payload["text"] for hit in search_result]
+    query_embedding = embed_query(query)
+
+    retriever = get_retriever()
+    cache_key = (retriever.name, _embedding_hash(query_embedding), top_k)
+    with _cache_lock:
+        relevant_docs = _retrieval_cache.get(cache_key)
+    if relevant_docs is not None:
+        tracing.current_span().set(retrieval_cache="hit")
+        return list(relevant_docs)
+
+    # Search the configured backend and return the text of relevant documents
+    with tracing.span("retrieval", retriever=retriever.name, top_k=top_k):
+        relevant_docs = retriever.search(query, query_embedding, top_k)
+    with _cache_lock:
+        _retrieval_cache[cache_key] = tuple(relevant_docs)
     return relevant_docs
 
 # 5. Generate article based on user prompt
 def generate_article(prompt):
-    kindo_api = KindoAPI(api_key=os.getenv("KINDO_API_KEY"))
-
-    relevant_docs = retrieve_relevant_documents(prompt)
-    print(f"Found {len(relevant_docs)} relevant documents")
-    
-    # Combine relevant documents into a single context
-    context = "\n\n".join(relevant_docs)
-
-    summarized_context = kindo_api.call_kindo_api(model="azure/gpt-4o", messages=[{"role": "user", "content": f"Summarize this content into 100 words. Content: {context}"}], max_tokens=200).json()['choices'][0]['message']['content']
-    
-    # Generate article using OpenAI
-    rabbit_prompt = f"Give keywords related to this information: {summarized_context}. Dont give any excess output."
-    response = kindo_api.call_kindo_api(
-        model="/models/WhiteRabbitNeo-33B-DeepSeekCoder", 
-        messages=[{"role": "user", "content": rabbit_prompt}], 
-        max_tokens=500
-    )
-
-    if 'error' not in response:
-        rabbit_response = response.json()['choices'][0]['message']['content']
-    else:
-        print(f"API call failed: {response['error']}, details: {response.get('details')}")
-        rabbit_response = ""
-
-    gpt_prompt = f"User question: {prompt} Generate a well designed course as paragraphs(word limit on each paragraph is 20) on topic. Strictly use only the following information as reference: Knowledge Source 1: {context} Knowledge Source 2: {rabbit_response}. The reader is a subject expert in the field so the article should be detailed and informative. avoid special characters like '*' or '#' keep it plain text with basic formatting."
-    messages = [
-        {
-            "role": "user", 
-            "content": gpt_prompt 
-        }
-    ]
-    article = kindo_api.call_kindo_api(model="azure/gpt-4o", messages=messages, max_tokens=2000).json()['choices'][0]['message']['content']
-
-    return article
\ No newline at end of file
+    """
+    Generates a course for a professional user from the retrieved research context.
+
+    Keywords are extracted from the retrieved context itself rather than from a summary
+    of it, which saves an LLM round trip before the final article call.
+    """
+    kindo_api = get_kindo_api()
+
+    def retrieve():
+        relevant_docs = retrieve_relevant_documents(prompt)
+        logger.info("Found %d relevant documents", len(relevant_docs))
+
+        # Combine the parts of the relevant documents closest to the prompt into a budgeted context
+        return fit_context(relevant_docs, prompt, Config.RAG_CONTEXT_TOKEN_BUDGET,
+                           chunk_tokens=Config.CONTEXT_CHUNK_TOKENS)
+
+    def keywords(context):
+        rabbit_prompt = f"Give keywords related to this information: {context}. Dont give any excess output."
+        response = kindo_api.call_kindo_api(
+            model="/models/WhiteRabbitNeo-33B-DeepSeekCoder",
+            messages=[{"role": "user", "content": rabbit_prompt}],
+            max_tokens=500,
+            route="rag_keywords"
+        )
+
+        if 'error' not in response:
+            return response.json()['choices'][0]['message']['content']
+        logger.error("API call failed", extra={"error": response['error'], "details": response.get('details')})
+        return ""
+
+    def article(context, keywords):
+        gpt_prompt = f"User question: {prompt} Generate a well designed course as paragraphs(word limit on each paragraph is 20) on topic. Strictly use only the following information as reference: Knowledge Source 1: {context} Knowledge Source 2: {keywords}. The reader is a subject expert in the field so the article should be detailed and informative. avoid special characters like '*' or '#' keep it plain text with basic formatting."
+        messages = [
+            {
+                "role": "user",
+                "content": gpt_prompt
+            }
+        ]
+        response = kindo_api.call_kindo_api(model="azure/gpt-4o", messages=messages, max_tokens=2000, route="rag_article")
+        if 'error' in response:
+            raise RuntimeError(f"Article generation failed: {response['error']}")
+        return response.json()['choices'][0]['message']['content']
+
+    runner = StageRunner("generate_article", max_workers=1)
+    runner.add("context", retrieve)
+    runner.add("keywords", keywords, depends_on=["context"])
+    runner.add("article", article, depends_on=["context", "keywords"])
+    return runner.run()["article"]
@@ -0,0 +1,360 @@
+# rate_limiter.py
+# Shared limits for upstream API calls: a token bucket and a concurrency limit per provider
+# (or per provider and model), with interactive calls served ahead of background generation.
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+import asyncio
+import logging
+import threading
+import time
+
+from pymongo import ReturnDocument
+import requests
+
+from config import Config
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = ("interactive", "background")
+
+# Work that does not say otherwise (generation jobs, pipeline and pool threads) is background
+_priority = ContextVar("upstream_priority", default=BACKGROUND)
+
+
+class RateLimitedError(requests.exceptions.RequestException):
+    """Raised without calling the upstream when its limit is saturated (fail-fast mode or after max_wait)."""
+
+
+class TokenBucket:
+    """
+    In-process token bucket: rate tokens per second, holding at most burst tokens.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        Takes a token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until the next one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class MongoTokenBucket:
+    """
+    Token bucket kept in a MongoDB document, shared by every process using the same collection.
+    Refill and take happen in one atomic update on the server's clock.
+    """
+
+    def __init__(self, collection, key, rate, burst):
+        self.collection = collection
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def take(self):
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updatedAt", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [self.burst, {"$add": [{"$ifNull": ["$tokens", self.burst]},
+                                                   {"$multiply": [elapsed, self.rate]}]}]}
+        doc = self.collection.find_one_and_update(
+            {"_id": self.key},
+            [
+                {"$set": {"tokens": refilled, "updatedAt": "$$NOW"}},
+                {"$set": {"granted": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$granted", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["granted"]:
+            return 0.0
+        return (1 - doc["tokens"]) / self.rate
+
+
+class _Gate:
+    """
+    The bucket, concurrency slots and waiting callers of one limit.
+    """
+
+    def __init__(self, bucket, concurrency):
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.waiting = [0] * len(PRIORITY_NAMES)
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+
+    def reserve(self, priority):
+        """
+        Reserves a concurrency slot, unless a higher priority caller is waiting. Call with cond held;
+        the token is taken afterwards without it, since the bucket may be a MongoDB round trip.
+
+        Returns:
+            float: 0 if a slot was reserved, the seconds until a pause ends, or None to wait for a release.
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if any(self.waiting[:priority]) or self.in_flight >= self.concurrency:
+            return None
+        self.in_flight += 1
+        return 0.0
+
+    def take(self):
+        """
+        Takes a token for a reserved slot, giving the slot back if none is available.
+
+        Returns:
+            float: 0 on success, otherwise the seconds until the next token.
+        """
+        try:
+            wait = self.bucket.take()
+        except BaseException:
+            self.release()
+            raise
+        if wait:
+            self.release()
+        return wait
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+
+class UpstreamLimiter:
+    """
+    Rate and concurrency limits for upstream calls, shared by every client in the process.
+
+    limits maps "provider" or "provider:model" to {"rate": per second, "burst": tokens,
+    "concurrency": calls in flight}; a model's own entry takes precedence over its provider's,
+    and calls without an entry are not limited. When a limit is saturated callers either queue
+    (interactive ones first) for up to max_wait seconds, or fail at once in "fail_fast" mode.
+    """
+
+    MODES = ("queue", "fail_fast")
+
+    def __init__(self, limits, mode="queue", max_wait=60, collection=None):
+        """
+        Initializes the UpstreamLimiter.
+
+        Parameters:
+            limits (dict): Limit settings per "provider" or "provider:model" key.
+            mode (str): One of MODES.
+            max_wait (float): Seconds a queued call waits before giving up.
+            collection (Collection): Optional MongoDB collection to share the token buckets
+                between processes; concurrency limits always apply per process.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown rate limit mode: {mode}")
+        self.limits = limits
+        self.mode = mode
+        self.max_wait = max_wait
+        self.collection = collection
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, provider, model=None):
+        """
+        Holds a slot of the call's limit for the enclosed block.
+
+        Raises:
+            RateLimitedError: If no slot was free in time.
+        """
+        gate = self._gate(provider, model)
+        if gate is None:
+            yield
+            return
+
+        priority = _priority.get()
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        # Held from the check through the wait, so a release in between cannot be missed
+        with gate.cond:
+            gate.waiting[priority] += 1
+            try:
+                while True:
+                    wait = gate.reserve(priority)
+                    if wait == 0:
+                        gate.cond.release()
+                        try:
+                            wait = gate.take()
+                        finally:
+                            gate.cond.acquire()
+                        if wait == 0:
+                            break
+                    remaining = self._remaining(provider, priority, deadline)
+                    gate.cond.wait(min(wait, remaining) if wait else remaining)
+            finally:
+                gate.waiting[priority] -= 1
+                gate.cond.notify_all()
+        self._observe_wait(provider, priority, start)
+        try:
+            yield
+        finally:
+            gate.release()
+
+    @asynccontextmanager
+    async def acquire_async(self, provider, model=None):
+        """
+        acquire() for coroutines: waits with asyncio.sleep instead of blocking the event loop.
+        """
+        gate = self._gate(provider, model)
+        if gate is None:
+            yield
+            return
+
+        priority = _priority.get()
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        with gate.cond:
+            gate.waiting[priority] += 1
+        try:
+            while True:
+                # The lock is only held for bookkeeping, never across the token round trip
+                with gate.cond:
+                    wait = gate.reserve(priority)
+                if wait == 0:
+                    if isinstance(gate.bucket, MongoTokenBucket):
+                        # A MongoDB round trip, keep it off the event loop
+                        wait = await self._take_in_thread(gate)
+                    else:
+                        wait = gate.take()
+                    if wait == 0:
+                        break
+                remaining = self._remaining(provider, priority, deadline)
+                await asyncio.sleep(min(wait or 0.05, remaining))
+        finally:
+            with gate.cond:
+                gate.waiting[priority] -= 1
+                gate.cond.notify_all()
+        self._observe_wait(provider, priority, start)
+        try:
+            yield
+        finally:
+            gate.release()
+
+    @staticmethod
+    async def _take_in_thread(gate):
+        task = asyncio.ensure_future(asyncio.to_thread(gate.take))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The thread carries on, give the slot back if it still gets a token
+            def release_granted(done):
+                if not done.cancelled() and done.exception() is None and done.result() == 0:
+                    gate.release()
+            task.add_done_callback(release_granted)
+            raise
+
+    def pause(self, provider, model, seconds):
+        """
+        Holds back every call of the limit for the given time, e.g. after a 429 with Retry-After,
+        so queued callers wait together instead of each running into the same error.
+        """
+        gate = self._gate(provider, model)
+        if gate is None:
+            return
+        with gate.cond:
+            gate.paused_until = max(gate.paused_until, time.monotonic() + seconds)
+
+    def _gate(self, provider, model):
+        key = f"{provider}:{model}" if model and f"{provider}:{model}" in self.limits else provider
+        limit = self.limits.get(key)
+        if not limit:
+            return None
+        with self._lock:
+            if key not in self._gates:
+                rate = float(limit.get("rate", 1))
+                burst = float(limit.get("burst", max(1.0, rate)))
+                if self.collection is not None:
+                    bucket = MongoTokenBucket(self.collection, key, rate, burst)
+                else:
+                    bucket = TokenBucket(rate, burst)
+                self._gates[key] = _Gate(bucket, int(limit.get("concurrency", 1 << 30)))
+            return self._gates[key]
+
+    def _remaining(self, provider, priority, deadline):
+        remaining = deadline - time.monotonic()
+        if self.mode == "fail_fast" or remaining <= 0:
+            metrics.count_rate_limited(provider, PRIORITY_NAMES[priority])
+            raise RateLimitedError(f"Rate limit of {provider} saturated")
+        return remaining
+
+    @staticmethod
+    def _observe_wait(provider, priority, start):
+        waited = time.monotonic() - start
+        metrics.observe_rate_limit_wait(provider, PRIORITY_NAMES[priority], waited)
+        if waited >= 0.001:
+            tracing.current_span().inc("rate_limit_wait_ms", round(waited * 1000, 1))
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def configure_limiter(collection=None):
+    """
+    Replaces the shared limiter with one built from Config, optionally sharing its token
+    buckets through a MongoDB collection.
+    """
+    global _limiter
+    with _limiter_lock:
+        _limiter = UpstreamLimiter(Config.RATE_LIMITS, mode=Config.RATE_LIMIT_MODE,
+                                   max_wait=Config.RATE_LIMIT_MAX_WAIT, collection=collection)
+        return _limiter
+
+
+def get_limiter():
+    """
+    Returns the shared limiter, an in-process one built from Config unless configured otherwise.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = UpstreamLimiter(Config.RATE_LIMITS, mode=Config.RATE_LIMIT_MODE,
+                                       max_wait=Config.RATE_LIMIT_MAX_WAIT)
+        return _limiter
+
+
+def set_priority(priority):
+    """
+    Sets the priority of upstream calls made in the current context.
+
+    Returns:
+        Token: To pass to reset_priority().
+    """
+    return _priority.set(priority)
+
+
+def reset_priority(token):
+    _priority.reset(token)
+
+
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
@@ -0,0 +1,182 @@
+# slide_events.py
+import asyncio
+from datetime import datetime, timezone
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SlideEventBus:
+    """
+    In-process pub/sub for slide generation events.
+
+    Only reaches subscribers in the process that runs the generation, so it fits the
+    in-process worker pool and tests. Use MongoSlideEventBus when workers run elsewhere.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, course_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(course_id, ()))
+        for deliver in subscribers:
+            deliver(event)
+
+    def subscribe(self, course_id):
+        """
+        Returns a subscription receiving every event published for the course from now on.
+        """
+        events = queue.Queue()
+        self._add(course_id, events.put)
+        return _QueueSubscription(self, course_id, events)
+
+    def subscribe_async(self, course_id, collection=None):
+        """
+        Like subscribe(), for a coroutine running on the current event loop.
+        Publishing threads hand events to the loop, so waiting holds no thread.
+
+        Parameters:
+            collection: Unused, accepted for symmetry with MongoSlideEventBus.subscribe_async.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def deliver(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        self._add(course_id, deliver)
+        return _AsyncQueueSubscription(self, course_id, events, deliver)
+
+    def _add(self, course_id, deliver):
+        with self._lock:
+            self._subscribers.setdefault(course_id, []).append(deliver)
+
+    def _unsubscribe(self, course_id, deliver):
+        with self._lock:
+            subscribers = self._subscribers.get(course_id, [])
+            if deliver in subscribers:
+                subscribers.remove(deliver)
+            if not subscribers:
+                self._subscribers.pop(course_id, None)
+
+
+class _QueueSubscription:
+    def __init__(self, bus, course_id, events):
+        self._bus = bus
+        self._course_id = course_id
+        self._events = events
+
+    def get(self, timeout):
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus._unsubscribe(self._course_id, self._events.put)
+
+
+class _AsyncQueueSubscription:
+    def __init__(self, bus, course_id, events, deliver):
+        self._bus = bus
+        self._course_id = course_id
+        self._events = events
+        self._deliver = deliver
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self._events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self._bus._unsubscribe(self._course_id, self._deliver)
+
+
+class MongoSlideEventBus:
+    """
+    Slide events stored in a MongoDB collection and delivered through change streams,
+    so API processes see events published by separate worker processes.
+    Requires a replica set (MongoDB Atlas clusters are).
+    """
+
+    def __init__(self, collection, ttl_seconds=3600):
+        """
+        Initializes the MongoSlideEventBus.
+
+        Parameters:
+            collection (Collection): MongoDB collection the events are written to.
+            ttl_seconds (int): How long events are kept before MongoDB expires them.
+        """
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index("createdAt", expireAfterSeconds=self.ttl_seconds)
+
+    def publish(self, course_id, event):
+        try:
+            self.collection.insert_one({
+                "courseId": course_id,
+                "event": event,
+                "createdAt": datetime.now(timezone.utc),
+            })
+        except Exception as e:
+            logger.warning("Failed to publish slide event: %s", e)
+
+    def subscribe(self, course_id):
+        stream = self.collection.watch(
+            [{"$match": {"operationType": "insert", "fullDocument.courseId": course_id}}],
+            max_await_time_ms=1000,
+        )
+        return _ChangeStreamSubscription(stream)
+
+    def subscribe_async(self, course_id, collection):
+        """
+        Like subscribe(), watching through an async driver.
+
+        Parameters:
+            collection (AsyncIOMotorCollection): The events collection opened with motor.
+        """
+        stream = collection.watch(
+            [{"$match": {"operationType": "insert", "fullDocument.courseId": course_id}}],
+            max_await_time_ms=1000,
+        )
+        return _AsyncChangeStreamSubscription(stream)
+
+
+class _ChangeStreamSubscription:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self._stream.alive and time.monotonic() < deadline:
+            change = self._stream.try_next()
+            if change is not None:
+                return change["fullDocument"]["event"]
+        return None
+
+    def close(self):
+        self._stream.close()
+
+
+class _AsyncChangeStreamSubscription:
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self._stream.alive and time.monotonic() < deadline:
+            change = await self._stream.try_next()
+            if change is not None:
+                return change["fullDocument"]["event"]
+        return None
+
+    async def close(self):
+        await self._stream.close()
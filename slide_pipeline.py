@@ -0,0 +1,254 @@
+# slide_pipeline.py
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import queue
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class SlidePipeline:
+    """
+    Staged, bounded-concurrency pipeline that turns slide texts into finished slides.
+
+    Every slide flows through two independent branches:
+        image: image_prompt -> image -> [transcode] -> upload
+        audio: tts -> upload
+    Each stage has its own thread pool, so a slow provider only limits its own stage
+    and the total time approaches that of the slowest stage rather than the sum of all calls.
+    Finished slides are yielded by results() in the order they were submitted.
+    Within a course trace, each slide gets a span with one child span per stage call.
+
+    With a batch image prompt callable, submit_all() asks for the image prompts of many
+    slides in one call and only falls back to per-slide calls for prompts it did not return.
+
+    With a transcode callable, images are re-encoded before upload and upload_image may return
+    several variant URLs, which become the slide's images list (widest first).
+    """
+
+    STAGES = ("image_prompt", "image", "transcode", "tts", "upload")
+
+    def __init__(self, generate_image_prompt, generate_image, upload_image,
+                 generate_audio, upload_audio, default_image_url, workers=None,
+                 generate_image_prompts=None, batch_size=20, transcode_image=None):
+        """
+        Initializes the pipeline with the callables for each stage.
+
+        Parameters:
+            generate_image_prompt (callable): (slide_number, content) -> image prompt or None.
+            generate_image (callable): (slide_number, image_prompt) -> image or None.
+            upload_image (callable): (slide_number, image) -> public URL, list of
+                {"url", "width", "height", "format"} variant dicts, or None.
+            generate_audio (callable): (slide_number, content) -> audio or None.
+            upload_audio (callable): (slide_number, audio) -> public URL or None.
+            default_image_url (str): Image used when the image branch produces nothing.
+            workers (dict): Optional worker limit per stage name, see STAGES.
+            generate_image_prompts (callable): Optional [(slide_number, content)] -> {slide_number: image prompt}.
+            batch_size (int): Maximum number of slides per generate_image_prompts call.
+            transcode_image (callable): Optional (slide_number, image) -> image, run between
+                image generation and upload.
+        """
+        workers = workers or {}
+        self._executors = {
+            stage: ThreadPoolExecutor(max_workers=max(1, int(workers.get(stage, 2))),
+                                      thread_name_prefix=f"slide-{stage}")
+            for stage in self.STAGES
+        }
+        self._generate_image_prompt = generate_image_prompt
+        self._generate_image = generate_image
+        self._upload_image = upload_image
+        self._generate_audio = generate_audio
+        self._upload_audio = upload_audio
+        self._default_image_url = default_image_url
+        self._generate_image_prompts = generate_image_prompts
+        self._batch_size = max(1, int(batch_size))
+        self._transcode_image = transcode_image
+        self._pending = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def submit(self, slide_number, content):
+        """
+        Schedules a slide on every stage of the pipeline without blocking.
+
+        Parameters:
+            slide_number (int): 1-based slide number.
+            content (str): The slide text.
+        """
+        self._submit(slide_number, content)
+
+    def submit_all(self, slides):
+        """
+        Schedules several slides without blocking, with batched image prompts when available.
+
+        Parameters:
+            slides (list): (slide_number, content) tuples in slide order.
+        """
+        if self._generate_image_prompts is None:
+            for slide_number, content in slides:
+                self._submit(slide_number, content)
+            return
+
+        parent = tracing.current_span()
+        for start in range(0, len(slides), self._batch_size):
+            batch = slides[start:start + self._batch_size]
+            batch_future = self._executors["image_prompt"].submit(self._prompt_batch, parent, batch)
+            for slide_number, content in batch:
+                self._submit(slide_number, content, batch_future)
+
+    def _submit(self, slide_number, content, batch_future=None):
+        slide_span = tracing.start_span("slide", slide_number=slide_number)
+        generate_image_prompt = self._traced(slide_span, "image_prompt", self._generate_image_prompt)
+        generate_image = self._traced(slide_span, "image", self._generate_image)
+        upload_image = self._traced(slide_span, "upload_image", self._upload_image)
+        generate_audio = self._traced(slide_span, "tts", self._generate_audio)
+        upload_audio = self._traced(slide_span, "upload_audio", self._upload_audio)
+
+        if batch_future is None:
+            prompt_future = self._executors["image_prompt"].submit(generate_image_prompt, slide_number, content)
+        else:
+            prompt_future = self._from_batch(batch_future, slide_number,
+                                             lambda: generate_image_prompt(slide_number, content))
+        image_future = self._then("image", prompt_future,
+                                  lambda image_prompt: generate_image(slide_number, image_prompt))
+        if self._transcode_image is not None:
+            transcode_image = self._traced(slide_span, "transcode", self._transcode_image)
+            image_future = self._then("transcode", image_future,
+                                      lambda image: transcode_image(slide_number, image))
+        image_url_future = self._then("upload", image_future,
+                                      lambda image: upload_image(slide_number, image))
+
+        audio_future = self._executors["tts"].submit(generate_audio, slide_number, content)
+        audio_url_future = self._then("upload", audio_future,
+                                      lambda audio: upload_audio(slide_number, audio))
+
+        self._pending.put((slide_number, content, image_url_future, audio_url_future, slide_span))
+
+    def close(self):
+        """
+        Signals that no more slides will be submitted, so results() can finish.
+        """
+        self._pending.put(None)
+
+    def results(self):
+        """
+        Yields the finished slides in submission order, blocking until each one is ready.
+
+        Returns:
+            generator: dicts with slideNumber, content, images and audio keys, plus
+                imageVariants when the image was uploaded in several sizes.
+        """
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            slide_number, content, image_url_future, audio_url_future, slide_span = item
+            image_url = self._result_or_none(image_url_future, slide_number, "image")
+            audio_url = self._result_or_none(audio_url_future, slide_number, "audio")
+            slide_span.end()
+            variants = image_url if isinstance(image_url, list) and image_url else None
+            slide = {
+                "slideNumber": slide_number,
+                "content": content,
+                "images": [variant["url"] for variant in variants] if variants
+                          else [image_url or self._default_image_url],
+                "audio": audio_url or "",
+            }
+            if variants:
+                slide["imageVariants"] = variants
+            yield slide
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _then(self, stage, upstream, fn):
+        """
+        Runs fn on the given stage's pool once upstream has finished.
+        A None upstream result short-circuits the chain to None, a failure is passed on.
+        """
+        downstream = Future()
+
+        def _copy(inner):
+            self._copy_outcome(inner, downstream)
+
+        def _submit(done):
+            if done.cancelled() or done.exception() is not None:
+                self._copy_outcome(done, downstream)
+                return
+            value = done.result()
+            if value is None:
+                downstream.set_result(None)
+                return
+            try:
+                self._executors[stage].submit(fn, value).add_done_callback(_copy)
+            except RuntimeError as e:
+                # Executor already shut down
+                downstream.set_exception(e)
+
+        upstream.add_done_callback(_submit)
+        return downstream
+
+    def _prompt_batch(self, parent, batch):
+        with tracing.use_span(parent), tracing.span("image_prompt_batch", slides=len(batch)):
+            return self._generate_image_prompts(batch)
+
+    def _from_batch(self, batch_future, slide_number, fallback):
+        """
+        Resolves to the slide's prompt from the batch result, or runs fallback on the
+        image prompt pool when the batch failed or did not include the slide.
+        """
+        downstream = Future()
+
+        def _copy(inner):
+            self._copy_outcome(inner, downstream)
+
+        def _pick(done):
+            if done.cancelled():
+                # Cancelled at shutdown, no point in a fallback
+                downstream.cancel()
+                return
+            prompts = {} if done.exception() is not None else (done.result() or {})
+            image_prompt = prompts.get(slide_number)
+            if image_prompt:
+                downstream.set_result(image_prompt)
+                return
+            try:
+                self._executors["image_prompt"].submit(fallback).add_done_callback(_copy)
+            except RuntimeError as e:
+                # Executor already shut down
+                downstream.set_exception(e)
+
+        batch_future.add_done_callback(_pick)
+        return downstream
+
+    @staticmethod
+    def _copy_outcome(source, target):
+        # Futures still queued at shutdown are cancelled, calling exception() on them would raise
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    @staticmethod
+    def _traced(slide_span, stage, fn):
+        # Pool threads do not inherit the submitting thread's span, so pass the slide's along
+        def run(*args):
+            with tracing.use_span(slide_span), tracing.span(stage):
+                return fn(*args)
+        return run
+
+    @staticmethod
+    def _result_or_none(future, slide_number, branch):
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error("Slide %s %s stage failed: %s", slide_number, branch, e, extra={"slide_number": slide_number})
+            return None
@@ -0,0 +1,94 @@
+# stage_runner.py
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import time
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class StageRunner:
+    """
+    Runs a small graph of dependent stages on a thread pool.
+
+    A stage starts as soon as every stage it depends on has finished, so independent
+    stages (e.g. two LLM calls on the same input) run at the same time.
+    Each stage's wall time is recorded in timings, and as a span of the current course trace.
+    """
+
+    def __init__(self, name, max_workers=4):
+        """
+        Initializes the StageRunner.
+
+        Parameters:
+            name (str): Name used in log messages.
+            max_workers (int): Maximum number of stages running at once.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.timings = {}
+        self._stages = {}
+
+    def add(self, name, fn, depends_on=()):
+        """
+        Registers a stage.
+
+        Parameters:
+            name (str): Unique stage name, also the keyword its result is passed as.
+            fn (callable): Called with the results of its dependencies as keyword arguments.
+            depends_on (iterable): Names of the stages that must finish first.
+        """
+        if name in self._stages:
+            raise ValueError(f"Stage {name} already added")
+        self._stages[name] = (fn, tuple(depends_on))
+        return self
+
+    def run(self):
+        """
+        Runs every stage and returns their results.
+
+        Returns:
+            dict: Stage name to result.
+
+        Raises:
+            Exception: The first exception raised by a stage; stages not yet started are skipped.
+        """
+        for name, (_, depends_on) in self._stages.items():
+            for dependency in depends_on:
+                if dependency not in self._stages:
+                    raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+
+        parent = tracing.current_span()
+        results = {}
+        running = {}
+        pending = dict(self._stages)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name) as executor:
+            while pending or running:
+                for name, (fn, depends_on) in list(pending.items()):
+                    if all(dependency in results for dependency in depends_on):
+                        kwargs = {dependency: results[dependency] for dependency in depends_on}
+                        running[executor.submit(self._timed, parent, name, fn, kwargs)] = name
+                        del pending[name]
+
+                if not running:
+                    raise ValueError(f"Stages {sorted(pending)} have circular dependencies")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    # Re-raises the stage's exception, leaving the executor to finish running stages
+                    results[name] = future.result()
+
+        logger.info("%s stage timings: %s", self.name,
+                    ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.timings.items()),
+                    extra={"timings": dict(self.timings)})
+        return results
+
+    def _timed(self, parent, name, fn, kwargs):
+        start = time.perf_counter()
+        try:
+            with tracing.use_span(parent), tracing.span(name):
+                return fn(**kwargs)
+        finally:
+            self.timings[name] = time.perf_counter() - start
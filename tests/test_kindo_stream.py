@@ -0,0 +1,229 @@
+# tests/test_kindo_stream.py
+# Drives KindoAPI.stream_kindo_api (and its async counterpart) against a local SSE stub.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import threading
+
+import pytest
+import requests
+
+from http_transport import CircuitBreaker, HttpTransport
+from kindo_api import KindoAPI
+
+MESSAGES = [{"role": "user", "content": "Say hello"}]
+
+
+class StubCache:
+    """LLMCache stand-in that never hits and records what is stored."""
+
+    def __init__(self):
+        self.stored = []
+
+    def make_key(self, model, messages, max_tokens, kwargs):
+        return f"{model}:{max_tokens}"
+
+    def get(self, key, route):
+        return None
+
+    def set(self, key, route, model, body):
+        self.stored.append(body)
+
+
+def _event(payload):
+    return f"data: {json.dumps(payload) if not isinstance(payload, str) else payload}\n\n".encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Chunked responses, so a connection dropped mid-body is an error rather than a clean end
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        model = body["model"]
+        if model == "error":
+            data = json.dumps({"error": "boom"}).encode()
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._chunk(b": keep-alive\n\n")
+        self._chunk(_event({"choices": [{"delta": {"content": "Hel"}}]}))
+        if model == "midstream":
+            # Drop the connection without the terminating chunk
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        if model == "truncated":
+            # A well-formed end of the body, but the answer never finished
+            self._chunk(b"")
+            return
+        if model == "finished":
+            # No [DONE], the finish_reason alone marks the answer as whole
+            self._chunk(_event({"choices": [{"delta": {"content": "lo"}, "finish_reason": "stop"}]}))
+            self._chunk(b"")
+            return
+        self._chunk(_event({"choices": [{"delta": {"role": "assistant"}}]}))
+        self._chunk(_event({"choices": [{"delta": {"content": "lo"}}]}))
+        self._chunk(_event({"choices": [], "usage": {"prompt_tokens": 7, "completion_tokens": 2}}))
+        self._chunk(_event("[DONE]"))
+        # Anything after [DONE] must be ignored
+        self._chunk(_event({"choices": [{"delta": {"content": " ignored"}}]}))
+        self._chunk(b"")
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    yield f"http://{host}:{port}/v1/chat/completions"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache():
+    return StubCache()
+
+
+@pytest.fixture
+def kindo(stub_url, cache):
+    # No retries and an unlimited upstream name, so error paths answer at once
+    transport = HttpTransport("kindo-stub", max_retries=0, breaker=CircuitBreaker())
+    return KindoAPI("key", transport=transport, cache=cache, base_url=stub_url)
+
+
+def test_stream_yields_deltas_until_done(kindo, cache):
+    deltas = kindo.stream_kindo_api("ok", MESSAGES, 50, route="ask_question")
+
+    assert list(deltas) == ["Hel", "lo"]
+    # The completed stream is cached in the shape of a non-streamed response
+    assert cache.stored == [{"choices": [{"message": {"role": "assistant", "content": "Hello"}}]}]
+    usage = kindo.usage.snapshot()["ok|ask_question"]
+    assert usage["calls"] == 1
+    assert usage["prompt_tokens"] == 7
+    assert usage["completion_tokens"] == 2
+    assert usage["estimated_calls"] == 0
+
+
+def test_stream_http_error_returns_error_dict(kindo, cache):
+    result = kindo.stream_kindo_api("error", MESSAGES, 50, route="ask_question")
+
+    assert isinstance(result, dict)
+    assert "500" in result["error"]
+    assert result["details"] == {"error": "boom"}
+    assert cache.stored == []
+
+
+def test_stream_mid_stream_error_raises_after_partial_output(kindo, cache):
+    deltas = kindo.stream_kindo_api("midstream", MESSAGES, 50, route="ask_question")
+
+    received = []
+    with pytest.raises(requests.exceptions.RequestException):
+        for delta in deltas:
+            received.append(delta)
+
+    assert received == ["Hel"]
+    # An incomplete answer is never cached, but the call is still counted
+    assert cache.stored == []
+    usage = kindo.usage.snapshot()["midstream|ask_question"]
+    assert usage["calls"] == 1
+    assert usage["estimated_calls"] == 1
+
+
+def test_stream_ending_without_done_is_not_cached(kindo, cache):
+    deltas = kindo.stream_kindo_api("truncated", MESSAGES, 50, route="ask_question")
+
+    assert list(deltas) == ["Hel"]
+    assert cache.stored == []
+
+
+def test_stream_finish_reason_completes_without_done(kindo, cache):
+    deltas = kindo.stream_kindo_api("finished", MESSAGES, 50, route="ask_question")
+
+    assert list(deltas) == ["Hel", "lo"]
+    assert cache.stored == [{"choices": [{"message": {"role": "assistant", "content": "Hello"}}]}]
+
+
+def _async_kindo(stub_url, cache):
+    httpx = pytest.importorskip("httpx")
+    from async_clients import AsyncHttpTransport, AsyncKindoAPI
+
+    transport = AsyncHttpTransport("kindo-stub", max_retries=0, breaker=CircuitBreaker())
+    return httpx, transport, AsyncKindoAPI("key", transport=transport, cache=cache, base_url=stub_url)
+
+
+def test_async_stream_yields_deltas_until_done(stub_url, cache):
+    _, transport, kindo = _async_kindo(stub_url, cache)
+
+    async def run():
+        try:
+            deltas = await kindo.stream_kindo_api("ok", MESSAGES, 50, route="ask_question")
+            return [delta async for delta in deltas]
+        finally:
+            await transport.aclose()
+
+    assert asyncio.run(run()) == ["Hel", "lo"]
+    assert cache.stored[0]["choices"][0]["message"]["content"] == "Hello"
+
+
+def test_async_stream_http_error_returns_error_dict(stub_url, cache):
+    _, transport, kindo = _async_kindo(stub_url, cache)
+
+    async def run():
+        try:
+            return await kindo.stream_kindo_api("error", MESSAGES, 50, route="ask_question")
+        finally:
+            await transport.aclose()
+
+    result = asyncio.run(run())
+    assert isinstance(result, dict)
+    assert result["details"] == {"error": "boom"}
+
+
+def test_async_stream_mid_stream_error_raises_after_partial_output(stub_url, cache):
+    httpx, transport, kindo = _async_kindo(stub_url, cache)
+
+    async def run(received):
+        try:
+            deltas = await kindo.stream_kindo_api("midstream", MESSAGES, 50, route="ask_question")
+            async for delta in deltas:
+                received.append(delta)
+        finally:
+            await transport.aclose()
+
+    received = []
+    with pytest.raises(httpx.HTTPError):
+        asyncio.run(run(received))
+    assert received == ["Hel"]
+    assert cache.stored == []
+
+
+def test_async_stream_ending_without_done_is_not_cached(stub_url, cache):
+    _, transport, kindo = _async_kindo(stub_url, cache)
+
+    async def run():
+        try:
+            deltas = await kindo.stream_kindo_api("truncated", MESSAGES, 50, route="ask_question")
+            return [delta async for delta in deltas]
+        finally:
+            await transport.aclose()
+
+    assert asyncio.run(run()) == ["Hel"]
+    assert cache.stored == []
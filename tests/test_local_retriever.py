@@ -0,0 +1,126 @@
+# tests/test_local_retriever.py
+# Builds a small local index with the hashing embedder and checks the hybrid ranking
+# of rag.LocalRetriever and reopening the index memory-mapped.
+import json
+
+import numpy as np
+import pytest
+
+import local_index
+from local_index import HashingEmbedding, LocalVectorIndex
+from rag import LocalRetriever
+
+CORPUS = [
+    "firewall rules block unwanted network traffic",
+    "phishing emails trick users into revealing passwords",
+    "a firewall filters packets between networks",
+    "hash functions map data to fixed size digests",
+    "malware spreads through infected email attachments",
+    "certificate authorities sign server certificates",
+    "sandbox isolation limits what untrusted code can do",
+    "password managers generate strong unique passwords",
+]
+
+
+def _build(tmp_path, hnsw=False):
+    corpus = tmp_path / "corpus.jsonl"
+    corpus.write_text("".join(json.dumps({"text": text}) + "\n" for text in CORPUS), encoding="utf-8")
+    index_dir = tmp_path / ("index_hnsw" if hnsw else "index")
+    count = local_index.build(str(corpus), str(index_dir), HashingEmbedding(), "hashing", hnsw=hnsw, log_every=0)
+    assert count == len(CORPUS)
+    return str(index_dir)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return LocalVectorIndex(_build(tmp_path))
+
+
+def _similarities(index, query):
+    # Cosine similarity of the query to every document, rows are stored normalized
+    return np.asarray(index.embeddings) @ np.asarray(HashingEmbedding().get_text_embedding(query))
+
+
+def test_index_reopens_memory_mapped(tmp_path):
+    index_dir = _build(tmp_path)
+    first = LocalVectorIndex(index_dir)
+    reopened = LocalVectorIndex(index_dir)
+
+    assert isinstance(reopened.embeddings, np.memmap)
+    assert reopened.embeddings.shape == (len(CORPUS), HashingEmbedding().dimensions)
+    assert reopened.meta == {"embedding": "hashing", "dimensions": 384, "documents": len(CORPUS), "hnsw": False}
+    # Rows are stored normalized, so dot products are cosine similarities
+    assert np.allclose(np.linalg.norm(reopened.embeddings, axis=1), 1.0, atol=1e-5)
+    assert reopened.docs == CORPUS
+
+    query = HashingEmbedding().get_text_embedding("firewall packets")
+    assert list(first.search(query, 3)[0]) == list(reopened.search(query, 3)[0])
+
+
+def test_batched_exact_search_matches_a_single_batch(tmp_path):
+    index_dir = _build(tmp_path)
+    query = HashingEmbedding().get_text_embedding("email passwords")
+    whole_ids, whole_scores = LocalVectorIndex(index_dir).search(query, 5)
+    batched_ids, batched_scores = LocalVectorIndex(index_dir, batch_size=3).search(query, 5)
+
+    # The hashing embedder produces ties, so rankings are compared by score
+    assert np.allclose(whole_scores, batched_scores)
+    assert list(whole_scores) == sorted(whole_scores, reverse=True)
+    similarities = _similarities(LocalVectorIndex(index_dir), "email passwords")
+    assert np.allclose(similarities[batched_ids], batched_scores, atol=1e-5)
+    assert np.allclose(batched_scores, np.sort(similarities)[::-1][:5], atol=1e-5)
+
+
+def test_hnsw_search_matches_exact_search(tmp_path):
+    pytest.importorskip("hnswlib")
+    exact = LocalVectorIndex(_build(tmp_path))
+    approximate = LocalVectorIndex(_build(tmp_path, hnsw=True))
+    assert approximate.hnsw is not None
+
+    query = HashingEmbedding().get_text_embedding("firewall network traffic")
+    exact_ids, exact_scores = exact.search(query, 3)
+    hnsw_ids, hnsw_scores = approximate.search(query, 3)
+    assert hnsw_ids[0] == exact_ids[0]
+    assert np.allclose(hnsw_scores, exact_scores, atol=1e-5)
+
+
+def test_rebuild_without_hnsw_drops_stale_graph(tmp_path):
+    index_dir = tmp_path / "index"
+    index_dir.mkdir()
+    stale = index_dir / LocalVectorIndex.HNSW_FILE
+    stale.write_bytes(b"graph of an earlier build")
+
+    rebuilt = LocalVectorIndex(_build(tmp_path))
+    assert not stale.exists()
+    assert rebuilt.hnsw is None
+
+
+def test_hybrid_weights_select_dense_or_keyword_ranking(index):
+    query = "firewall network"
+    embedding = HashingEmbedding().get_text_embedding(query)
+    similarities = _similarities(index, query)
+    keyword_scores = index.bm25.scores(query, list(range(len(CORPUS))))
+
+    dense_only = LocalRetriever(index, dense_weight=1.0).search(query, embedding, 3)
+    keyword_only = LocalRetriever(index, dense_weight=0.0).search(query, embedding, 3)
+
+    dense_ids = [CORPUS.index(text) for text in dense_only]
+    assert np.allclose(similarities[dense_ids], np.sort(similarities)[::-1][:3], atol=1e-5)
+    keyword_ids = [CORPUS.index(text) for text in keyword_only]
+    assert np.allclose(keyword_scores[keyword_ids], np.sort(keyword_scores)[::-1][:3])
+    # Both firewall documents match the keyword, the firewall-and-network one ranks first
+    assert keyword_only[0] == CORPUS[0]
+
+
+def test_hybrid_ranks_documents_matching_both_signals_first(index):
+    query = "firewall"
+    embedding = HashingEmbedding().get_text_embedding(query)
+    results = LocalRetriever(index, dense_weight=0.5).search(query, embedding, 2)
+
+    # Only the two firewall documents match the keyword and share its embedding bucket
+    assert set(results) == {CORPUS[0], CORPUS[2]}
+
+
+def test_hybrid_returns_nothing_for_an_empty_candidate_set(index):
+    embedding = HashingEmbedding().get_text_embedding("firewall")
+    assert LocalRetriever(index).search("firewall", embedding, 0) == []
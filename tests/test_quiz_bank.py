@@ -0,0 +1,41 @@
+# tests/test_quiz_bank.py
+# Validation of the model's quiz replies in QuizBank.parse_questions.
+import json
+
+from quiz_bank import QuizBank
+
+OPTIONS = ["Phishing", "Patching", "Backups", "Logging"]
+
+
+def _reply(*items):
+    return "```json\n" + json.dumps(list(items)) + "\n```"
+
+
+def test_parses_valid_question():
+    questions = QuizBank.parse_questions(_reply({"question": "Which is a social attack?",
+                                                 "options": OPTIONS, "answer": "a) Phishing"}))
+    assert questions == [{"question": "Which is a social attack?", "options": OPTIONS, "answer": 0}]
+
+
+def test_drops_missing_and_empty_answers():
+    questions = QuizBank.parse_questions(_reply(
+        {"question": "No answer field?", "options": OPTIONS},
+        {"question": "Empty answer?", "options": OPTIONS, "answer": ""},
+        {"question": "Blank answer?", "options": OPTIONS, "answer": "   "},
+        {"question": "Kept?", "options": OPTIONS, "answer": "C"},
+    ))
+    assert [q["question"] for q in questions] == ["Kept?"]
+    assert questions[0]["answer"] == 2
+
+
+def test_drops_unknown_letters_and_bad_options():
+    questions = QuizBank.parse_questions(_reply(
+        {"question": "Letter out of range?", "options": OPTIONS, "answer": "E"},
+        {"question": "Three options?", "options": OPTIONS[:3], "answer": "A"},
+        {"question": "", "options": OPTIONS, "answer": "A"},
+    ))
+    assert questions == []
+
+
+def test_rejects_reply_without_array():
+    assert QuizBank.parse_questions("I cannot write a quiz about that.") == []
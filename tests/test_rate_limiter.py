@@ -0,0 +1,60 @@
+# tests/test_rate_limiter.py
+# Concurrency slots of UpstreamLimiter.acquire handed between threads.
+import threading
+import time
+
+from rate_limiter import UpstreamLimiter
+
+
+def test_slot_freed_while_queued_wakes_waiter():
+    limiter = UpstreamLimiter({"stub": {"rate": 1000, "burst": 1000, "concurrency": 1}}, max_wait=5)
+    holding = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        with limiter.acquire("stub"):
+            holding.set()
+            done.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    holding.wait()
+
+    # Frees the slot while the queued caller is between its check and its wait
+    check = limiter._remaining
+
+    def free_slot(*args):
+        done.set()
+        holder.join(0.1)
+        return check(*args)
+
+    limiter._remaining = free_slot
+
+    start = time.monotonic()
+    with limiter.acquire("stub"):
+        waited = time.monotonic() - start
+    holder.join()
+    assert waited < 1
+
+
+def test_waiters_share_slot_in_turn():
+    limiter = UpstreamLimiter({"stub": {"rate": 1000, "burst": 1000, "concurrency": 1}}, max_wait=5)
+    active = []
+    peak = []
+
+    def call():
+        with limiter.acquire("stub"):
+            active.append(1)
+            peak.append(len(active))
+            time.sleep(0.01)
+            active.pop()
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 1
+    assert len(peak) == 8
+    assert time.monotonic() - start < 2
@@ -0,0 +1,38 @@
+# tests/test_slide_pipeline.py
+# SlidePipeline shut down with slides still queued on its stages.
+import threading
+import time
+
+from slide_pipeline import SlidePipeline
+
+
+def _slow(result):
+    def stage(*args):
+        time.sleep(0.1)
+        return result
+    return stage
+
+
+def test_shutdown_with_queued_slides_still_yields_every_slide():
+    pipeline = SlidePipeline(
+        _slow("prompt"), _slow(b"image"), _slow("image-url"), _slow(b"audio"), _slow("audio-url"),
+        default_image_url="default.png",
+        workers={stage: 1 for stage in SlidePipeline.STAGES},
+        generate_image_prompts=_slow({}),
+        batch_size=2,
+    )
+    pipeline.submit_all([(number, f"slide {number}") for number in range(1, 7)])
+    pipeline.close()
+    # Cancels whatever has not started, the chained stages must see the cancellation
+    pipeline.shutdown()
+
+    slides = []
+    reader = threading.Thread(target=lambda: slides.extend(pipeline.results()), daemon=True)
+    reader.start()
+    reader.join(5)
+
+    assert not reader.is_alive()
+    # Cancelled branches fall back like failed ones
+    assert [slide["slideNumber"] for slide in slides] == [1, 2, 3, 4, 5, 6]
+    assert slides[-1]["images"] == ["default.png"]
+    assert slides[-1]["audio"] == ""
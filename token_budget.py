@@ -0,0 +1,194 @@
+# token_budget.py
+import logging
+import re
+import threading
+
+from local_index import BM25Index
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding(model):
+    """
+    Returns the tiktoken encoding of the model family, or None when tiktoken is not installed
+    or its BPE file cannot be loaded (it is downloaded on first use, which fails offline).
+    """
+    if tiktoken is None:
+        return None
+    # gpt-4o family uses o200k_base, older OpenAI models cl100k_base
+    name = "o200k_base" if "4o" in model else "cl100k_base"
+    with _encodings_lock:
+        if name not in _encodings:
+            try:
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                # Remembered as missing, so the download is not retried on every call
+                logger.warning("Could not load tokenizer %s, estimating token counts: %s", name, e)
+                _encodings[name] = None
+        return _encodings[name]
+
+
+def count_tokens(text, model="azure/gpt-4o"):
+    """
+    Counts the tokens of a text with the local tokenizer of the model family.
+    Without a usable tokenizer, estimates four characters per token.
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_budget(text, budget, model="azure/gpt-4o"):
+    """
+    Cuts a text down to at most budget tokens.
+    """
+    if count_tokens(text, model) <= budget:
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:budget * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+
+
+def chunk_text(text, max_tokens=200, model="azure/gpt-4o"):
+    """
+    Splits a text into chunks of at most max_tokens, keeping paragraphs and then sentences together.
+
+    Returns:
+        list: The chunks, in text order.
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph, model) <= max_tokens:
+            pieces.append(paragraph)
+        else:
+            for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+                if sentence:
+                    pieces.append(truncate_to_budget(sentence, max_tokens, model))
+
+    # Merge neighbouring pieces while they fit in one chunk
+    chunks = []
+    current, current_tokens = [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece, model)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def select_chunks(chunks, query, budget, model="azure/gpt-4o"):
+    """
+    Picks the chunks most relevant to the query (BM25) that fit in the token budget.
+    Without a query the leading chunks are kept. The result keeps the original chunk order.
+
+    Returns:
+        list: The selected chunks.
+    """
+    if not chunks:
+        return []
+    order = list(range(len(chunks)))
+    if query:
+        scores = BM25Index.build(chunks).scores(query, order)
+        order.sort(key=lambda i: -scores[i])
+
+    selected, used = [], 0
+    for i in order:
+        tokens = count_tokens(chunks[i], model)
+        if used + tokens > budget:
+            continue
+        selected.append(i)
+        used += tokens
+    if not selected:
+        # Budget smaller than any chunk, keep what fits of the best one
+        return [truncate_to_budget(chunks[order[0]], budget, model)]
+    return [chunks[i] for i in sorted(selected)]
+
+
+def fit_context(texts, query, budget, chunk_tokens=200, model="azure/gpt-4o"):
+    """
+    Builds a context string of at most budget tokens from one or more texts.
+
+    Parameters:
+        texts (str or list): A text or a list of documents.
+        query (str): Question the context should answer, None to keep the leading text.
+        budget (int): Maximum number of tokens of the returned context.
+        chunk_tokens (int): Size of the chunks the selection works on.
+
+    Returns:
+        str: The selected chunks joined by blank lines.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    chunks = [chunk for text in texts for chunk in chunk_text(text, chunk_tokens, model)]
+    return "\n\n".join(select_chunks(chunks, query, budget, model))
+
+
+class TokenUsage:
+    """
+    Calls and prompt and completion token counts per model and route.
+
+    Tokens are those reported by the API; calls answered without a usage report are
+    counted with the local tokenizer (estimated_calls), and cache hits are counted as
+    calls (cached_calls) that used no tokens.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage = {}
+
+    def record(self, model, route, usage=None, messages=None, completion=None, cached=False):
+        """
+        Counts one call.
+
+        Parameters:
+            usage (dict): The API's usage report, if any.
+            messages (list): The prompt messages, counted locally when usage is missing.
+            completion (str): The answer text, counted locally when usage is missing.
+            cached (bool): Whether the answer came from the response cache.
+        """
+        estimated = not usage and not cached
+        if cached:
+            prompt_tokens = completion_tokens = 0
+        elif usage:
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        else:
+            prompt_tokens = sum(count_tokens(str(message.get("content", "")), model) for message in messages or [])
+            completion_tokens = count_tokens(completion or "", model)
+        logger.info("Token usage", extra={"model": model, "route": route or "-",
+                                          "prompt_tokens": prompt_tokens,
+                                          "completion_tokens": completion_tokens,
+                                          "cached": cached, "estimated": estimated})
+        with self._lock:
+            counters = self._usage.setdefault(f"{model}|{route or '-'}",
+                                              {"calls": 0, "cached_calls": 0, "estimated_calls": 0,
+                                               "prompt_tokens": 0, "completion_tokens": 0})
+            counters["calls"] += 1
+            counters["cached_calls"] += cached
+            counters["estimated_calls"] += estimated
+            counters["prompt_tokens"] += prompt_tokens
+            counters["completion_tokens"] += completion_tokens
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(counters) for key, counters in self._usage.items()}
@@ -0,0 +1,250 @@
+# tracing.py
+# Lightweight span trees for course generation, persisted per course for the admin trace endpoint.
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+
+from pymongo import DESCENDING
+
+logger = logging.getLogger(__name__)
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation of a trace. Attributes hold details such as model, bytes and retries.
+    """
+
+    def __init__(self, trace, span_id, parent_id, name, attributes):
+        self.trace = trace
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end_time = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def inc(self, key, amount=1):
+        with self.trace.lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self, error=None):
+        """
+        Records the span's end; only the first call counts.
+        """
+        if self.end_time is not None:
+            return
+        self.end_time = time.perf_counter()
+        if error is not None:
+            self.error = str(error)
+        self.trace.record(self)
+
+
+class _NoopSpan:
+    # Stands in when there is no sampled trace, so instrumented code needs no checks
+    trace = None
+
+    def set(self, **attributes):
+        pass
+
+    def inc(self, key, amount=1):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """
+    The spans of one course generation, kept up to max_spans; later spans are only counted.
+    """
+
+    def __init__(self, course_id, max_spans):
+        self.trace_id = str(uuid.uuid4())
+        self.course_id = course_id
+        self.max_spans = max_spans
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans = []
+        self.dropped = 0
+        self._ids = itertools.count(1)
+
+    def start_span(self, name, parent=None, **attributes):
+        parent_id = parent.span_id if isinstance(parent, Span) else None
+        return Span(self, next(self._ids), parent_id, name, attributes)
+
+    def record(self, span):
+        entry = {
+            "id": span.span_id,
+            "parentId": span.parent_id,
+            "name": span.name,
+            "startMs": round((span.start - self.start) * 1000, 1),
+            "durationMs": round((span.end_time - span.start) * 1000, 1),
+        }
+        if span.attributes:
+            entry["attributes"] = dict(span.attributes)
+        if span.error:
+            entry["error"] = span.error
+        with self.lock:
+            # The root span ends last and is always kept
+            if len(self.spans) < self.max_spans or span.parent_id is None:
+                self.spans.append(entry)
+            else:
+                self.dropped += 1
+
+    def to_document(self, status):
+        with self.lock:
+            spans = list(self.spans)
+            dropped = self.dropped
+        return {
+            "_id": self.trace_id,
+            "courseId": self.course_id,
+            "status": status,
+            "startedAt": self.started_at,
+            "durationMs": round((time.perf_counter() - self.start) * 1000, 1),
+            "spans": spans,
+            "droppedSpans": dropped,
+        }
+
+
+class CourseTracer:
+    """
+    Starts sampled course traces and stores them in MongoDB when they finish.
+    """
+
+    def __init__(self, collection, sample_rate=1.0, max_spans=500, ttl_days=14):
+        """
+        Initializes the CourseTracer.
+
+        Parameters:
+            collection (Collection): MongoDB collection the traces are written to.
+            sample_rate (float): Fraction of course generations traced, 0 disables tracing.
+            max_spans (int): Maximum number of spans stored per trace.
+            ttl_days (int): How long traces are kept before MongoDB expires them.
+        """
+        self.collection = collection
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.ttl_days = ttl_days
+
+    def ensure_indexes(self):
+        self.collection.create_index([("courseId", 1), ("startedAt", DESCENDING)])
+        self.collection.create_index("startedAt", expireAfterSeconds=self.ttl_days * 86400)
+
+    @contextmanager
+    def trace(self, course_id, **attributes):
+        """
+        Traces the enclosed block as the root "course" span, if the course is sampled.
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            yield NOOP_SPAN
+            return
+
+        trace = Trace(course_id, self.max_spans)
+        root = trace.start_span("course", **attributes)
+        token = _current_span.set(root)
+        status = "completed"
+        try:
+            yield root
+        except Exception as e:
+            status = "failed"
+            root.end(error=e)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
+            self._save(trace, status)
+
+    def latest(self, course_id):
+        """
+        Returns the most recent trace of the course with its spans nested as a tree, or None.
+        """
+        doc = self.collection.find_one({"courseId": course_id}, sort=[("startedAt", DESCENDING)])
+        if not doc:
+            return None
+        doc["traceId"] = doc.pop("_id")
+        doc["spans"] = build_tree(doc["spans"])
+        return doc
+
+    def _save(self, trace, status):
+        try:
+            self.collection.insert_one(trace.to_document(status))
+        except Exception as e:
+            logger.warning("Failed to save trace of course %s: %s", trace.course_id, e)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def start_span(name, **attributes):
+    """
+    Starts a child of the current span that the caller ends, for work that outlives a with block.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return parent.trace.start_span(name, parent, **attributes)
+
+
+@contextmanager
+def use_span(span):
+    """
+    Makes span the parent of spans started in the block, e.g. on a pool thread.
+    """
+    if span is NOOP_SPAN or span is None:
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a child of the current span. A no-op outside a sampled trace.
+    """
+    child = start_span(name, **attributes)
+    if child is NOOP_SPAN:
+        yield child
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def build_tree(spans):
+    """
+    Nests a flat span list by parentId, children in start order.
+    """
+    nodes = {entry["id"]: dict(entry, children=[]) for entry in spans}
+    roots = []
+    for node in sorted(nodes.values(), key=lambda node: node["startMs"]):
+        parent = nodes.get(node["parentId"])
+        # Spans whose parent was dropped by the span limit are shown at the top level
+        (parent["children"] if parent else roots).append(node)
+    return roots
@@ -1,39 +1,119 @@
-import requests
+import logging
+
+from http_transport import get_transport
+import metrics
+
+logger = logging.getLogger(__name__)
 
 class TTS:
-    def __init__(self, api_token):
+    STREAM_URL = 'https://api.v7.unrealspeech.com/stream'
+
+    def __init__(self, api_token, transport=None, stream_url=None, bitrate_profiles=None, default_profile=None):
+        """
+        Parameters:
+            api_token (str): The Unreal Speech API token.
+            transport (HttpTransport): Optional transport, the shared "tts" one by default.
+            stream_url (str): Optional endpoint URL, e.g. of a stand-in server.
+            bitrate_profiles (dict): MP3 bitrate per profile name, e.g. {"speech": "64k"}.
+            default_profile (str): Profile used when a request names none.
+        """
         self.api_token = api_token
+        self.stream_url = stream_url or self.STREAM_URL
+        self.transport = transport or get_transport("tts")
+        self.bitrate_profiles = dict(bitrate_profiles or {})
+        # Voice settings sent with every request, also part of the audio asset key
+        self.voice_params = {
+            'VoiceId': 'Will',  # You can change this as needed
+            'Bitrate': '192k',
+            'Speed': '0',
+            'Pitch': '0.92',
+            'Codec': 'libmp3lame',
+        }
+        if default_profile:
+            self.voice_params = self.params_for(default_profile)
 
-    def generate_audio(self, text):
+    def params_for(self, profile=None):
+        """
+        Returns the voice settings for a bitrate profile, the default ones if profile is None.
+
+        Raises:
+            ValueError: If the profile is unknown.
+        """
+        if profile is None:
+            return self.voice_params
+        if profile not in self.bitrate_profiles:
+            raise ValueError(f"Unknown TTS bitrate profile: {profile}")
+        return {**self.voice_params, 'Bitrate': self.bitrate_profiles[profile]}
+
+    def generate_audio(self, text, profile=None):
         """
         Generate audio using the TTS API.
 
         Parameters:
             text (str): The text to convert to speech.
+            profile (str): Optional bitrate profile, see params_for.
 
         Returns:
             bytes: The audio content if successful.
             None: If the request fails.
         """
+        voice_params = self.params_for(profile)
         try:
-            response = requests.post(
-                'https://api.v7.unrealspeech.com/stream',
-                headers={
-                    'Authorization': f'Bearer {self.api_token}'
-                },
-                json={
-                    'Text': text,
-                    'VoiceId': 'Will',  # You can change this as needed
-                    'Bitrate': '192k',
-                    'Speed': '0',
-                    'Pitch': '0.92',
-                    'Codec': 'libmp3lame',
-                }
-            )
-
-            response.raise_for_status()  # Raise an error for bad responses
+            with metrics.track_upstream("tts", voice_params['VoiceId']) as call:
+                response = self.transport.post(
+                    self.stream_url,
+                    model=voice_params['VoiceId'],
+                    headers={
+                        'Authorization': f'Bearer {self.api_token}'
+                    },
+                    json={'Text': text, **voice_params}
+                )
+
+                response.raise_for_status()  # Raise an error for bad responses
+                call.bytes = len(response.content)
             return response.content  # Return the audio content
 
         except Exception as e:
-            print(f"Error generating audio: {str(e)}")
+            logger.error("Error generating audio: %s", e)
             return None
+
+    def stream_audio(self, text, chunk_size=16 * 1024, profile=None):
+        """
+        Stream audio from the TTS API without buffering the whole file.
+
+        Parameters:
+            text (str): The text to convert to speech.
+            profile (str): Optional bitrate profile, see params_for.
+            chunk_size (int): Size of the chunks read from the response.
+
+        Returns:
+            generator: MP3 chunks as they arrive, if the request succeeds.
+            None: If the request fails.
+        """
+        voice_params = self.params_for(profile)
+        try:
+            # Timed until the response headers, the audio streams on
+            with metrics.track_upstream("tts", voice_params['VoiceId']):
+                response = self.transport.post(
+                    self.stream_url,
+                    model=voice_params['VoiceId'],
+                    headers={
+                        'Authorization': f'Bearer {self.api_token}'
+                    },
+                    json={'Text': text, **voice_params},
+                    stream=True,
+                )
+                response.raise_for_status()
+        except Exception as e:
+            logger.error("Error streaming audio: %s", e)
+            return None
+
+        def chunks():
+            try:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        yield chunk
+            finally:
+                response.close()
+
+        return chunks()
@@ -0,0 +1,13 @@
+# worker.py
+# Runs generation workers in a separate process. Start the API with
+# JOB_WORKERS_IN_PROCESS=false to leave all generation to these processes.
+from app import job_queue, start_workers, worker_pool
+from config import Config
+import metrics
+
+if __name__ == "__main__":
+    metrics.track_queue(job_queue, worker_pool)
+    if Config.WORKER_METRICS_PORT:
+        metrics.start_server(Config.WORKER_METRICS_PORT)
+    start_workers()
+    worker_pool.join()